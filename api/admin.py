@@ -5,9 +5,10 @@ from django.contrib import admin, messages
 from django.contrib.admin.filters import DateFieldListFilter
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.contrib.gis.admin import GISModelAdmin
+from django.db import transaction
 from django.db.models import Q
 
-from .models import Account, Appointment, User, VaccinationCenter,  VaccinationRecord, VaccinationTimeslot
+from .models import Account, Appointment, JobRun, PushNotification, User, VaccinationCenter,  VaccinationRecord, VaccinationTimeslot
 
 admin.site.disable_action('delete_selected')
 
@@ -171,7 +172,9 @@ class AppointmentAdmin(admin.ModelAdmin):
         for obj in queryset:
             if(obj.appointment_status == Appointment.APPOINTMENT_STATUS_PENDING):
                 obj.appointment_status = Appointment.APPOINTMENT_STATUS_APPROVED
-                Appointment.save(obj)
+                # Commits the push notification's outbox row with the appointment
+                with transaction.atomic():
+                    Appointment.save(obj)
                 self.message_user(
                     request,
                     f'Appointment ID: {obj.id} was successfully approved.',
@@ -190,7 +193,9 @@ class AppointmentAdmin(admin.ModelAdmin):
         for obj in queryset:
             if(obj.appointment_status == Appointment.APPOINTMENT_STATUS_PENDING):
                 obj.appointment_status = Appointment.APPOINTMENT_STATUS_REJECTED
-                Appointment.save(obj)
+                # Commits the push notification's outbox row with the appointment
+                with transaction.atomic():
+                    Appointment.save(obj)
                 self.message_user(
                     request,
                     f'Appointment ID: {obj.id} was successfully rejected.',
@@ -267,7 +272,7 @@ class VaccinationRecordAdmin(admin.ModelAdmin):
 
 @ admin.register(VaccinationTimeslot)
 class VaccinationTimeslotAdmin(admin.ModelAdmin):
-    list_display = ('id', 'datetime_formatted', 'center')
+    list_display = ('id', 'datetime_formatted', 'center', 'capacity', 'booked')
     list_display_links = ["id", "datetime_formatted"]
     list_filter = ['center', ('datetime', CustomDateFieldListFilter)]
     ordering = ['-datetime']
@@ -294,3 +299,87 @@ class VaccinationTimeslotAdmin(admin.ModelAdmin):
                 return qs.filter(center=account.assigned_vaccination_center)
 
         return qs
+
+
+@ admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'started_datetime_formatted', 'duration_formatted', 'rows_read',
+                    'rows_written', 'upstream_requests', 'upstream_latency_p95', 'succeeded']
+    list_display_links = ['id', 'name']
+    list_filter = ['name']
+    ordering = ['-started_datetime']
+
+    # Runs per job in the duration trend charts
+    TREND_RUNS = 30
+    TREND_WIDTH = 300
+    TREND_HEIGHT = 60
+
+    @ admin.display(description='Started datetime', ordering='started_datetime')
+    def started_datetime_formatted(self, obj):
+        return timezone.make_naive(obj.started_datetime).strftime("%Y-%m-%d_%H:%M:%S")
+
+    @ admin.display(description='Duration', ordering='duration')
+    def duration_formatted(self, obj):
+        if obj.duration is None:
+            return 'Running'
+        return f'{obj.duration:.1f}s'
+
+    @ admin.display(description='Succeeded', boolean=True)
+    def succeeded(self, obj):
+        if obj.finished_datetime is None:
+            return None
+        return obj.exception == ''
+
+    def get_duration_trends(self):
+        """Duration sparkline (SVG polyline points) of the latest runs of every job"""
+        trends = []
+        for name in JobRun.objects.order_by('name').values_list('name', flat=True).distinct():
+            durations = list(JobRun.objects.filter(name=name, duration__isnull=False).order_by(
+                '-started_datetime').values_list('duration', flat=True)[:self.TREND_RUNS])[::-1]
+            if not durations:
+                continue
+
+            longest = max(durations) or 1
+            step = self.TREND_WIDTH / max(len(durations) - 1, 1)
+            trends.append({
+                'name': name,
+                'points': ' '.join(f'{index * step:.1f},{self.TREND_HEIGHT - duration / longest * self.TREND_HEIGHT:.1f}'
+                                   for index, duration in enumerate(durations)),
+                'last': durations[-1],
+                'longest': longest,
+                'runs': len(durations),
+            })
+
+        return trends
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['duration_trends'] = self.get_duration_trends()
+        extra_context['trend_width'] = self.TREND_WIDTH
+        extra_context['trend_height'] = self.TREND_HEIGHT
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@ admin.register(PushNotification)
+class PushNotificationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'title', 'status', 'attempts',
+                    'created_datetime_formatted', 'sent_datetime', 'receipt_checked', 'last_error']
+    list_display_links = ['id', 'title']
+    list_filter = ['status']
+    ordering = ['-created_datetime']
+
+    @ admin.display(description='Created datetime', ordering='created_datetime')
+    def created_datetime_formatted(self, obj):
+        return timezone.make_naive(obj.created_datetime).strftime("%Y-%m-%d_%H:%M:%S")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
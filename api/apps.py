@@ -1,6 +1,4 @@
 from django.apps import AppConfig
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
 
 
 class ApiConfig(AppConfig):
@@ -8,13 +6,6 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self) -> None:
-        import api.scheduled_jobs as scheduled_jobs
         import api.signals.handlers
 
-        # Schedule tasks to run on 12a.m. every day
-        scheduler = BackgroundScheduler()
-        trigger = CronTrigger(hour=0, minute=0, second=0)
-        scheduler.add_job(scheduled_jobs.update_statistic_data, trigger)
-        scheduler.add_job(scheduled_jobs.update_appointment_status, trigger)
-        scheduler.add_job(scheduled_jobs.update_centers_hotspot_case, trigger)
-        scheduler.start()
+        # Scheduled jobs run in their own process, see `python manage.py run_scheduler`
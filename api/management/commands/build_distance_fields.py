@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from api.utils.update_center_distance_fields import update_center_distance_fields
+
+
+class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+
+    help = "Precompute shortest path trees rooted at every center's OSM vertex (This may take a while)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every center instead of only new or changed ones')
+
+    def handle(self, *args, **options):
+        roots = update_center_distance_fields(full=options['full'])
+
+        self.stdout.write(f"Computed distance fields for {len(roots)} vertices")
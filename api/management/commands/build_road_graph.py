@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from api.models import Osm22Po4Pgr
+from api.utils.road_graph import write_snapshot
+
+
+class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+
+    help = "Build the road graph snapshot used by the in-process routing engine (This may take a while)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directed', action='store_true',
+                            help='Use reverse_cost for reverse arcs instead of routing undirected')
+
+    def handle(self, *args, **options):
+        rows = Osm22Po4Pgr.objects.using('osm').values_list(
+            'id', 'source', 'target', 'cost', 'reverse_cost').iterator(chunk_size=10000)
+
+        num_vertices, num_arcs = write_snapshot(
+            settings.ROUTING_GRAPH_SNAPSHOT, rows, directed=options['directed'])
+
+        self.stdout.write(
+            f"Written {settings.ROUTING_GRAPH_SNAPSHOT} with {num_vertices} vertices and {num_arcs} arcs")
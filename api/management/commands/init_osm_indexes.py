@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+from django.db import connections
+
+
+class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+
+    help = "Create indexes on the OSM routing table (This may take a while)"
+
+    def handle(self, *args, **options):
+        with connections['osm'].cursor() as cursor:
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS osm2_2po_4pgr_geom_way_gist
+                ON osm2_2po_4pgr USING GIST (geom_way)''')
+            cursor.execute('ANALYZE osm2_2po_4pgr')
+
+        self.stdout.write("Created OSM routing table indexes")
@@ -3,10 +3,10 @@ import json
 import requests
 from django.contrib.gis.geos import Point
 from django.core.management import BaseCommand
-from django.contrib.gis.db.models.functions import Distance
 
-from api.models import VaccinationCenter, Osm22Po4Pgr
+from api.models import VaccinationCenter
 from api.utils.get_nearby_hotspot_cases import get_nearby_hotspot_cases
+from api.utils.vertex_index import get_vertex_index
 
 
 class Command(BaseCommand):
@@ -54,10 +54,7 @@ class Command(BaseCommand):
                     new_center.location = Point(lng, lat, srid=4326)
 
                     # Find the nearest PPV's vertex id of OSM database for caching
-                    vertex = Osm22Po4Pgr.objects.using('osm').filter(x1__range=[lng-0.1, lng+0.1]).annotate(
-                        distance=Distance("geom_way", new_center.location)).order_by("distance")[0]
-
-                    new_center.gid = vertex.target
+                    new_center.gid, _, _ = get_vertex_index(wait=True).nearest(lng, lat)
 
                     # Update nearby cases
                     new_center.num_cases = get_nearby_hotspot_cases(lat, lng)
@@ -0,0 +1,78 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+import api.scheduled_jobs as scheduled_jobs
+from api.utils.get_shortest_paths import ROUTING_ENGINE_PRECOMPUTED
+from api.utils.leader_election import LeaderElection
+
+
+class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+
+    help = "Run the scheduled jobs process, only the instance holding the scheduler lock runs the jobs"
+
+    def handle(self, *args, **options):
+        election = LeaderElection(settings.SCHEDULER_LOCK_ID)
+
+        # Role of this instance at the last run, logged only when it changes rather than on every run
+        role = None
+
+        def log_role(new_role, stream, message):
+            nonlocal role
+            if new_role != role:
+                role = new_role
+                stream.write(message)
+
+        def run_if_leader(job):
+            def run():
+                if election.is_leader():
+                    log_role('leader', self.stdout, "Running the scheduled jobs, this instance is the leader")
+                    # Worker threads keep their connections between runs a day apart
+                    close_old_connections()
+                    try:
+                        job()
+                    finally:
+                        close_old_connections()
+                elif election.error is not None:
+                    log_role('unreachable', self.stderr,
+                             f"Skipping the scheduled jobs, could not reach the database for the scheduler lock: {election.error}")
+                else:
+                    log_role('standby', self.stdout, "Skipping the scheduled jobs, another scheduler instance is the leader")
+            return run
+
+        # Schedule tasks to run on 12a.m. every day
+        scheduler = BlockingScheduler()
+        trigger = CronTrigger(hour=0, minute=0, second=0)
+        for job in (scheduled_jobs.update_statistic_data,
+                    scheduled_jobs.update_appointment_status,
+                    scheduled_jobs.update_centers_hotspot_case):
+            scheduler.add_job(run_if_leader(job), trigger, name=job.__name__)
+
+        # Drain the push notification outbox every few seconds, check its receipts every few minutes
+        scheduler.add_job(run_if_leader(scheduled_jobs.send_push_notifications),
+                          IntervalTrigger(seconds=settings.PUSH_DISPATCH_INTERVAL),
+                          name=scheduled_jobs.send_push_notifications.__name__)
+        scheduler.add_job(run_if_leader(scheduled_jobs.update_push_receipts),
+                          IntervalTrigger(seconds=settings.PUSH_RECEIPT_INTERVAL),
+                          name=scheduled_jobs.update_push_receipts.__name__)
+
+        # Distance fields of new or moved centers, kept out of the requests saving them
+        if settings.ROUTING_ENGINE == ROUTING_ENGINE_PRECOMPUTED:
+            scheduler.add_job(run_if_leader(scheduled_jobs.update_distance_fields),
+                              IntervalTrigger(seconds=settings.DISTANCE_FIELD_UPDATE_INTERVAL),
+                              name=scheduled_jobs.update_distance_fields.__name__)
+
+        if election.is_leader():
+            self.stdout.write("Scheduler started as the leader")
+        else:
+            self.stdout.write("Scheduler started as a standby instance")
+
+        try:
+            scheduler.start()
+        finally:
+            election.close()
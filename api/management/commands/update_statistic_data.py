@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+import api.scheduled_jobs as scheduled_jobs
+
+
+class Command(BaseCommand):
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+
+    help = "Fetch new vaccination statistic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full-resync', action='store_true',
+                            help='Rewrite every date instead of only dates after the latest stored one')
+
+    def handle(self, *args, **options):
+        scheduled_jobs.update_statistic_data(
+            full_resync=options['full_resync'])
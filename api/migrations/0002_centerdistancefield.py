@@ -0,0 +1,32 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CenterDistanceField',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root', models.IntegerField()),
+                ('vertex', models.IntegerField()),
+                ('cost', models.FloatField()),
+                ('predecessor', models.IntegerField(null=True)),
+                ('edge', models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='centerdistancefield',
+            index=models.Index(fields=['vertex'], name='center_distance_vertex_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='centerdistancefield',
+            constraint=models.UniqueConstraint(fields=('root', 'vertex'), name='unique_center_distance_field_vertex'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.4 on 2026-10-18 10:30
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_booked_seats(apps, schema_editor):
+    """Count the seats already held by pending, approved and attended appointments"""
+    VaccinationTimeslot = apps.get_model('api', 'VaccinationTimeslot')
+
+    timeslots = VaccinationTimeslot.objects.annotate(num_booked=Count(
+        'appointment', filter=Q(appointment__appointment_status__in=[1, 2, 3])))
+
+    for timeslot in timeslots:
+        if timeslot.num_booked:
+            timeslot.booked = timeslot.num_booked
+            timeslot.capacity = max(timeslot.capacity, timeslot.num_booked)
+            timeslot.save(update_fields=['booked', 'capacity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_centerdistancefield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vaccinationtimeslot',
+            name='booked',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='vaccinationtimeslot',
+            name='capacity',
+            field=models.PositiveIntegerField(default=100),
+        ),
+        migrations.RunPython(count_booked_seats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vaccinationtimeslot',
+            constraint=models.CheckConstraint(check=models.Q(('booked__lte', models.F('capacity'))), name='timeslot_booked_within_capacity'),
+        ),
+    ]
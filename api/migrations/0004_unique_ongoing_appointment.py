@@ -0,0 +1,37 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:00
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+
+
+def reject_duplicate_ongoing_appointments(apps, schema_editor):
+    """Keep the newest pending/approved appointment of each account, reject the others and release their seats"""
+    Appointment = apps.get_model('api', 'Appointment')
+    VaccinationTimeslot = apps.get_model('api', 'VaccinationTimeslot')
+
+    ongoing = Appointment.objects.filter(appointment_status__in=[1, 2])
+    newest = ongoing.filter(account=OuterRef('account')).order_by('-id').values('id')[:1]
+    duplicates = ongoing.exclude(id=Subquery(newest))
+
+    for row in duplicates.order_by().values('timeslot').annotate(count=Count('id')):
+        VaccinationTimeslot.objects.filter(id=row['timeslot']).update(
+            booked=Greatest(F('booked') - row['count'], 0))
+
+    Appointment.objects.filter(id__in=list(duplicates.values_list('id', flat=True))).update(
+        appointment_status=-2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_timeslot_capacity'),
+    ]
+
+    operations = [
+        migrations.RunPython(reject_duplicate_ongoing_appointments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('appointment_status__in', [1, 2])), fields=('account',), name='unique_ongoing_appointment_per_account'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+POPULATE_ROLLUPS_SQL = '''
+INSERT INTO api_vaxmalaysiarollup (granularity, date, daily_partial, daily_full, daily_booster, daily,
+                                   cumul_partial, cumul_full, cumul_booster, cumul)
+SELECT granularity, date_trunc(unit, date)::date AS period,
+       SUM(daily_partial), SUM(daily_full), SUM(daily_booster), SUM(daily),
+       MAX(cumul_partial), MAX(cumul_full), MAX(cumul_booster), MAX(cumul)
+FROM api_vaxmalaysia, (VALUES ('weekly', 'week'), ('monthly', 'month')) AS granularities (granularity, unit)
+GROUP BY granularity, period
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_unique_ongoing_appointment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VaxMalaysiaRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=7)),
+                ('date', models.DateField()),
+                ('daily_partial', models.IntegerField()),
+                ('daily_full', models.IntegerField()),
+                ('daily_booster', models.IntegerField()),
+                ('daily', models.IntegerField()),
+                ('cumul_partial', models.IntegerField()),
+                ('cumul_full', models.IntegerField()),
+                ('cumul_booster', models.IntegerField()),
+                ('cumul', models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vaxmalaysiarollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'date'), name='unique_vax_malaysia_rollup_period'),
+        ),
+        migrations.RunSQL(POPULATE_ROLLUPS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.4 on 2026-10-18 16:00
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_vaxmalaysiarollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotspotCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('radius', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vaccinationcenter',
+            name='hotspot_cluster',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.hotspotcluster'),
+        ),
+    ]
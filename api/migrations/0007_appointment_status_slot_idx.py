@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_hotspotcluster'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['appointment_status', 'timeslot'], name='appointment_status_slot_idx'),
+        ),
+    ]
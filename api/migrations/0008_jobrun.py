@@ -0,0 +1,34 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_appointment_status_slot_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('started_datetime', models.DateTimeField()),
+                ('finished_datetime', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('rows_read', models.IntegerField(default=0)),
+                ('rows_written', models.IntegerField(default=0)),
+                ('upstream_requests', models.IntegerField(default=0)),
+                ('upstream_latency_p50', models.FloatField(blank=True, null=True)),
+                ('upstream_latency_p95', models.FloatField(blank=True, null=True)),
+                ('upstream_latency_p99', models.FloatField(blank=True, null=True)),
+                ('exception', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='jobrun',
+            index=models.Index(fields=['name', '-started_datetime'], name='job_run_name_started_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_jobrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=50)),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Sent'), (-1, 'Dead')], default=1)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_datetime', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_datetime', models.DateTimeField(auto_now_add=True)),
+                ('sent_datetime', models.DateTimeField(blank=True, null=True)),
+                ('ticket_id', models.CharField(blank=True, max_length=100)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(fields=['status', 'next_attempt_datetime'], name='push_status_next_attempt_idx'),
+        ),
+    ]
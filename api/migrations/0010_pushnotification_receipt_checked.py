@@ -0,0 +1,22 @@
+# Generated by Django 4.0.4 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_pushnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='receipt_checked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(condition=models.Q(('receipt_checked', False), ('status', 2)), fields=['sent_datetime'], name='push_receipt_unchecked_idx'),
+        ),
+    ]
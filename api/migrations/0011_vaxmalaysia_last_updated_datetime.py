@@ -0,0 +1,20 @@
+# Generated by Django 4.0.4 on 2026-10-18 21:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_pushnotification_receipt_checked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vaxmalaysia',
+            name='last_updated_datetime',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.4 on 2026-10-18 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_vaxmalaysia_last_updated_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VaxMalaysiaSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=255)),
+                ('last_updated_datetime', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
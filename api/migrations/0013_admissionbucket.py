@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2026-10-18 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_vaxmalaysiasource'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdmissionBucket',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('refilled_datetime', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.4 on 2026-10-19 00:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_admissionbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vaccinationtimeslot',
+            name='last_updated_datetime',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='vaccinationrecord',
+            name='last_updated_datetime',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2026-10-19 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_timeslot_record_last_updated_datetime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='admissionbucket',
+            name='admitted',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='admissionbucket',
+            name='shed',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
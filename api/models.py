@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.contrib.gis.db import models
+from django.db import transaction
 from django.forms import ValidationError
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -71,6 +72,12 @@ class Account(models.Model):
         return self.user.email
 
 
+class HotspotCluster(models.Model):
+    """Centers within radius metres of location, sharing one hotspot API query"""
+    location = models.PointField()
+    radius = models.FloatField()
+
+
 class VaccinationCenter(models.Model):
     """Vaccination Center model"""
     name = models.CharField(max_length=255)
@@ -80,6 +87,8 @@ class VaccinationCenter(models.Model):
     num_cases = models.IntegerField(default=0)
     gid = models.IntegerField(default=0)
     last_updated_datetime = models.DateTimeField(auto_now=True)
+    hotspot_cluster = models.ForeignKey(
+        HotspotCluster, on_delete=models.SET_NULL, null=True, blank=True, editable=False)
 
     def __str__(self):
         return f'{self.name}'
@@ -93,6 +102,16 @@ class VaccinationTimeslot(models.Model):
 
     datetime = models.DateTimeField(validators=[validate_datetime_future])
     center = models.ForeignKey(VaccinationCenter, on_delete=models.CASCADE)
+    capacity = models.PositiveIntegerField(default=100)
+    booked = models.PositiveIntegerField(default=0, editable=False)
+    # Also set by the booked counter updates, which bypass auto_now
+    last_updated_datetime = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(booked__lte=models.F('capacity')), name='timeslot_booked_within_capacity'),
+        ]
 
     def __str__(self):
         return f'{self.center}_{timezone.make_naive(self.datetime).strftime("%Y-%m-%d_%H:%M")}'
@@ -126,12 +145,56 @@ class Appointment(models.Model):
         (DOSE_TYPE_BOOSTER, 'Booster'),
     ]
 
+    # Statuses of an ongoing appointment, an account can only have one at a time
+    ONGOING_STATUSES = [
+        APPOINTMENT_STATUS_PENDING,
+        APPOINTMENT_STATUS_APPROVED,
+    ]
+
+    # Statuses holding a seat of the timeslot
+    SEAT_HOLDING_STATUSES = [
+        APPOINTMENT_STATUS_PENDING,
+        APPOINTMENT_STATUS_APPROVED,
+        APPOINTMENT_STATUS_ATTENDED,
+    ]
+
     dose_type = models.IntegerField(choices=DOSE_TYPE_CHOICES)
     last_updated_datetime = models.DateTimeField(auto_now=True)
     account = models.ForeignKey(Account, on_delete=models.PROTECT)
     timeslot = models.ForeignKey(
         VaccinationTimeslot, on_delete=models.PROTECT)
 
+    class Meta:
+        constraints = [
+            # At most one PENDING or APPROVED (ONGOING_STATUSES) appointment per account
+            models.UniqueConstraint(
+                fields=['account'], condition=models.Q(appointment_status__in=[1, 2]),
+                name='unique_ongoing_appointment_per_account'),
+        ]
+        indexes = [
+            # Overdue appointment sweep
+            models.Index(fields=['appointment_status', 'timeslot'],
+                         name='appointment_status_slot_idx'),
+        ]
+
+    def clean(self):
+        """Reject taking a seat of a fully booked timeslot, e.g. from the admin"""
+        if self.timeslot_id is None or self.appointment_status not in self.SEAT_HOLDING_STATUSES:
+            return
+
+        previous = Appointment.objects.filter(id=self.id).values_list(
+            'appointment_status', 'timeslot_id').first() if self.id else None
+        if previous is not None and previous[0] in self.SEAT_HOLDING_STATUSES and previous[1] == self.timeslot_id:
+            return
+
+        if not VaccinationTimeslot.objects.filter(id=self.timeslot_id, booked__lt=models.F('capacity')).exists():
+            raise ValidationError({'timeslot': 'Timeslot is fully booked.'})
+
+    def save(self, *args, **kwargs):
+        # The pre_save seat handler locks the previous row until the save commits
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f'{self.account}_{dict(self.APPOINTMENT_STATUS_CHOICES)[self.appointment_status]}_{dict(self.DOSE_TYPE_CHOICES)[self.dose_type]} Dose'
 
@@ -152,6 +215,7 @@ class VaccinationRecord(models.Model):
     dose_receive_datetime = models.DateTimeField(auto_now_add=True)
     vaccine_brand = models.IntegerField(choices=VACCINE_BRAND_CHOICES)
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE)
+    last_updated_datetime = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.appointment} {dict(self.VACCINE_BRAND_CHOICES)[self.vaccine_brand]}'
@@ -184,6 +248,25 @@ class Osm22Po4Pgr(models.Model):
         db_table = 'osm2_2po_4pgr'
 
 
+class CenterDistanceField(models.Model):
+    """Precomputed shortest path tree rooted at a vaccination center's OSM vertex"""
+    root = models.IntegerField()
+    vertex = models.IntegerField()
+    cost = models.FloatField()
+    predecessor = models.IntegerField(null=True)
+    edge = models.IntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['root', 'vertex'], name='unique_center_distance_field_vertex'),
+        ]
+        indexes = [
+            models.Index(fields=['vertex'],
+                         name='center_distance_vertex_idx'),
+        ]
+
+
 class VaxMalaysia(models.Model):
     """Vaccination Center model"""
     date = models.DateField(primary_key=True)
@@ -195,3 +278,122 @@ class VaxMalaysia(models.Model):
     cumul_full = models.IntegerField()
     cumul_booster = models.IntegerField()
     cumul = models.IntegerField()
+    # Set on every upsert, so rewritten rows change the statistic ETag
+    last_updated_datetime = models.DateTimeField(auto_now=True)
+
+
+class VaxMalaysiaSource(models.Model):
+    """Validators of the last fully ingested upstream vax_malaysia.csv, a single row"""
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=255, blank=True)
+    last_updated_datetime = models.DateTimeField(auto_now=True)
+
+
+class VaxMalaysiaRollup(models.Model):
+    """Weekly/monthly VaxMalaysia totals, maintained by the statistic ingestion"""
+    GRANULARITY_WEEKLY = 'weekly'
+    GRANULARITY_MONTHLY = 'monthly'
+    GRANULARITY_CHOICES = [
+        (GRANULARITY_WEEKLY, 'Weekly'),
+        (GRANULARITY_MONTHLY, 'Monthly'),
+    ]
+
+    granularity = models.CharField(
+        max_length=7, choices=GRANULARITY_CHOICES)
+    # First day of the week (Monday) or month
+    date = models.DateField()
+    # Daily counts summed over the period, cumulative counts at the end of the period
+    daily_partial = models.IntegerField()
+    daily_full = models.IntegerField()
+    daily_booster = models.IntegerField()
+    daily = models.IntegerField()
+    cumul_partial = models.IntegerField()
+    cumul_full = models.IntegerField()
+    cumul_booster = models.IntegerField()
+    cumul = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'date'], name='unique_vax_malaysia_rollup_period'),
+        ]
+
+
+class JobRun(models.Model):
+    """Run of a scheduled job, recorded by api.utils.job_runs.record_job_run"""
+    name = models.CharField(max_length=100)
+    started_datetime = models.DateTimeField()
+    finished_datetime = models.DateTimeField(null=True, blank=True)
+    # Seconds
+    duration = models.FloatField(null=True, blank=True)
+    rows_read = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    upstream_requests = models.IntegerField(default=0)
+    # Seconds
+    upstream_latency_p50 = models.FloatField(null=True, blank=True)
+    upstream_latency_p95 = models.FloatField(null=True, blank=True)
+    upstream_latency_p99 = models.FloatField(null=True, blank=True)
+    exception = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', '-started_datetime'],
+                         name='job_run_name_started_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}_{timezone.localtime(self.started_datetime).strftime("%Y-%m-%d_%H:%M")}'
+
+
+class PushNotification(models.Model):
+    """Outbox of Expo push notifications, written with the change they notify about and sent in batches"""
+    STATUS_PENDING = 1
+    STATUS_SENT = 2
+    STATUS_DEAD = -1
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    token = models.CharField(max_length=50)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(null=True, blank=True)
+    status = models.IntegerField(
+        choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_datetime = models.DateTimeField(default=timezone.now)
+    created_datetime = models.DateTimeField(auto_now_add=True)
+    sent_datetime = models.DateTimeField(null=True, blank=True)
+    # Expo push ticket id of a sent notification, for fetching its receipt
+    ticket_id = models.CharField(max_length=100, blank=True)
+    receipt_checked = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_datetime'],
+                         name='push_status_next_attempt_idx'),
+            models.Index(fields=['sent_datetime'], condition=models.Q(status=2, receipt_checked=False),
+                         name='push_receipt_unchecked_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.title}_{dict(self.STATUS_CHOICES)[self.status]}'
+
+
+class AdmissionBucket(models.Model):
+    """Booking admission token bucket, refilled from refilled_datetime by api.utils.admission_control"""
+    name = models.CharField(max_length=50, primary_key=True)
+    tokens = models.FloatField()
+    refilled_datetime = models.DateTimeField()
+    # Bookings admitted by this bucket as the last one consulted and shed by it
+    admitted = models.BigIntegerField(default=0)
+    shed = models.BigIntegerField(default=0)
+
+
+class CacheGeneration(models.Model):
+    """Generation of a group of cache entries, bumped by every worker to invalidate them all, see api.utils.cache_utils"""
+    key = models.CharField(max_length=100, primary_key=True)
+    generation = models.BigIntegerField()
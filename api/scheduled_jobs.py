@@ -1,84 +1,159 @@
-import csv
-import requests
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Greatest
 from django.utils import timezone
-from .models import Appointment, VaxMalaysia, VaccinationCenter
-from .utils.get_nearby_hotspot_cases import get_nearby_hotspot_cases
-
-
-def update_statistic_data():
+from .models import Appointment, PushNotification, VaccinationCenter, VaccinationTimeslot
+from .utils.fetch_hotspot_cases import fetch_hotspot_cases
+from .utils.hotspot_clusters import assign_hotspot_clusters
+from .utils.ingest_vax_malaysia import ingest_vax_malaysia
+from .utils.job_runs import record_job_run, record_rows
+from .utils.nearby_cache import invalidate_nearby_cache
+from .utils.push_outbox import APPOINTMENT_NOTIFICATIONS, check_push_receipts, dispatch_push_notifications, get_appointment_notification
+from .utils.update_center_distance_fields import update_center_distance_fields
+
+
+@record_job_run
+def update_statistic_data(full_resync=False):
     """Update vaccination statistic data by fetching from GitHub repo"""
     print("Updating vaccination statistic data from GitHub")
-    download = requests.get(
-        'https://raw.githubusercontent.com/CITF-Malaysia/citf-public/main/vaccination/vax_malaysia.csv')
-
-    decoded_content = download.content.decode('utf-8')
-
-    cr = csv.reader(decoded_content.splitlines(), delimiter=',')
-    next(cr)
-    for row in cr:
-        _, created = VaxMalaysia.objects.update_or_create(
-            date=row[0],
-            defaults={
-                'daily_partial': row[1],
-                'daily_full': row[2],
-                'daily_booster': row[3],
-                'daily': row[4],
-                'cumul_partial': row[9],
-                'cumul_full': row[10],
-                'cumul_booster': row[11],
-                'cumul': row[12], }
-        )
-
-    print("Updated vaccination statistic data")
 
+    stats = ingest_vax_malaysia(full_resync=full_resync)
+    record_rows(read=stats['rows_read'], written=stats['rows_written'])
+
+    if stats['not_modified']:
+        print("Vaccination statistic data not modified")
+        return
 
+    print(
+        f"Updated vaccination statistic data ({stats['rows_written']} of {stats['rows_read']} rows written)")
+
+
+@record_job_run
 def update_centers_hotspot_case():
     """Update vaccination center hotspot cases data by fetching from MySj API"""
     print("Updating vaccination centers hotspot data")
 
-    vaccination_centers = VaccinationCenter.objects.all()
+    assign_hotspot_clusters()
+
+    now = timezone.now()
+    vaccination_centers = list(VaccinationCenter.objects.filter(
+        last_updated_datetime__lt=now - timedelta(seconds=settings.HOTSPOT_REFRESH_MAX_AGE),
+        hotspot_cluster__isnull=False).select_related('hotspot_cluster').only('id', 'hotspot_cluster', 'hotspot_cluster__location'))
 
+    # One query per cluster of nearby centers, fanned out to its members
+    results = fetch_hotspot_cases({center.hotspot_cluster_id: (center.hotspot_cluster.location.y, center.hotspot_cluster.location.x)
+                                   for center in vaccination_centers})
+
+    updated_centers = []
     for center in vaccination_centers:
-        id = center.id
-        lat = center.location.coords[1]
-        lng = center.location.coords[0]
-        last_updated = center.last_updated_datetime
+        if results[center.hotspot_cluster_id] is not None:
+            center.num_cases = results[center.hotspot_cluster_id]
+            # bulk_update skips auto_now
+            center.last_updated_datetime = now
+            updated_centers.append(center)
+
+    VaccinationCenter.objects.bulk_update(
+        updated_centers, ['num_cases', 'last_updated_datetime'], batch_size=1000)
+
+    record_rows(read=len(vaccination_centers), written=len(updated_centers))
+
+    # bulk_update sends no post_save signals
+    invalidate_nearby_cache()
+
+    print(
+        f"Updated vaccination centers hotspot data ({len(updated_centers)} of {len(vaccination_centers)} centers, {len(results)} queries)")
+
 
-        if (datetime.now(timezone.utc) - last_updated) > timedelta(hours=24):
-            num_cases = get_nearby_hotspot_cases(lat, lng)
+def _sweep_overdue_appointments(from_status, to_status, now):
+    """Move appointments of timeslots at or before now from from_status to to_status in batches
 
-            VaccinationCenter.objects.update_or_create(
-                id=id, defaults={'num_cases': num_cases})
+    Each batch is one indexed SELECT and two UPDATEs, releasing the batch's timeslot seats
+    (no pre_save signals are sent), rejected appointments are notified through the push
+    outbox. Returns the number of appointments changed.
+    """
+    batch_size = settings.APPOINTMENT_SWEEP_BATCH_SIZE
+    changed = 0
 
-    print("Updated vaccination centers hotspot data")
+    while True:
+        with transaction.atomic():
+            ids = list(Appointment.objects.filter(
+                appointment_status=from_status, timeslot__datetime__lte=now).select_for_update(
+                of=('self',), skip_locked=True).values_list('id', flat=True)[:batch_size])
 
+            if not ids:
+                return changed
 
+            if from_status in Appointment.SEAT_HOLDING_STATUSES and to_status not in Appointment.SEAT_HOLDING_STATUSES:
+                released = Appointment.objects.filter(id__in=ids, timeslot=OuterRef('pk')).order_by().values(
+                    'timeslot').annotate(count=Count('id')).values('count')
+                VaccinationTimeslot.objects.filter(appointment__id__in=ids).update(
+                    booked=Greatest(F('booked') - Subquery(released), 0), last_updated_datetime=now)
+
+            batch_changed = Appointment.objects.filter(id__in=ids).update(
+                appointment_status=to_status, last_updated_datetime=now)
+
+            if to_status in APPOINTMENT_NOTIFICATIONS:
+                # No pre_save signals, notify the accounts through the outbox in the same transaction
+                notifications = []
+                for appointment in Appointment.objects.filter(id__in=ids).exclude(
+                        account__expo_notification_token='').select_related('account', 'timeslot__center'):
+                    title, body, data = get_appointment_notification(appointment)
+                    notifications.append(PushNotification(
+                        token=appointment.account.expo_notification_token, title=title, body=body, data=data))
+                PushNotification.objects.bulk_create(notifications)
+            record_rows(read=len(ids), written=batch_changed)
+            changed += batch_changed
+
+        if len(ids) < batch_size:
+            return changed
+
+
+@record_job_run
 def update_appointment_status():
     """Update appointment status for overdue appointments"""
     print("Updating appointment status")
 
-    appointments = Appointment.objects.filter(
-        appointment_status__gte=Appointment.APPOINTMENT_STATUS_PENDING)
+    now = timezone.now()
+    counts = {
+        # Appointment expired - Update state to MISSED
+        'missed': _sweep_overdue_appointments(
+            Appointment.APPOINTMENT_STATUS_APPROVED, Appointment.APPOINTMENT_STATUS_MISSED, now),
+        # Appointment expired - Update state to REJECTED for pending appointment
+        'rejected': _sweep_overdue_appointments(
+            Appointment.APPOINTMENT_STATUS_PENDING, Appointment.APPOINTMENT_STATUS_REJECTED, now),
+    }
 
-    for appointment in appointments:
-        id = appointment.id
-        status = appointment.appointment_status
-        appointment_datetime = timezone.make_naive(
-            appointment.timeslot.datetime)
-        now_datetime = datetime.now()
+    print(
+        f"Updated appointment status ({counts['missed']} missed, {counts['rejected']} rejected)")
 
-        if appointment_datetime <= now_datetime:
-            if status == Appointment.APPOINTMENT_STATUS_APPROVED:
-                """Appointment expired - Update state to MISSED"""
-                Appointment.objects.update_or_create(
-                    id=id, defaults={'appointment_status': Appointment.APPOINTMENT_STATUS_MISSED})
+    return counts
 
-            elif status == Appointment.APPOINTMENT_STATUS_PENDING:
-                """Appointment expired - Update state to REJECTED for pending appointment"""
-                Appointment.objects.update_or_create(
-                    id=id, defaults={'appointment_status': Appointment.APPOINTMENT_STATUS_REJECTED})
 
-        return
+def send_push_notifications():
+    """Send the push notifications waiting in the outbox, run every few seconds so not recorded as a JobRun"""
+    stats = dispatch_push_notifications()
+
+    if any(stats.values()):
+        print(
+            f"Sent push notifications ({stats['sent']} sent, {stats['retried']} retried, {stats['dead']} dead)")
+
+
+def update_distance_fields():
+    """Compute the distance fields of centers added or moved to another OSM vertex, run every few minutes so not recorded as a JobRun"""
+    roots = update_center_distance_fields()
+
+    if roots:
+        print(f"Computed distance fields for {len(roots)} vertices")
+
+
+@record_job_run
+def update_push_receipts():
+    """Check the Expo receipts of sent push notifications and prune the tokens of unregistered devices"""
+    print("Checking push notification receipts")
+
+    stats = check_push_receipts()
 
-    print("Updated appointment status")
+    print(
+        f"Checked push notification receipts ({stats['checked']} checked, {stats['failed']} failed, {stats['pending']} pending, {stats['tokens_pruned']} tokens pruned)")
@@ -1,7 +1,10 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
-from .models import Account, Appointment, VaccinationCenter, VaccinationTimeslot, VaccinationRecord, VaxMalaysia
+from .models import Account, Appointment, VaccinationCenter, VaccinationTimeslot, VaccinationRecord, VaxMalaysia, VaxMalaysiaRollup
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -50,7 +53,7 @@ class VaccinationTimeslotSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = VaccinationTimeslot
-        fields = ['id', 'datetime', 'center']
+        fields = ['id', 'datetime', 'capacity', 'booked', 'center']
 
 
 class AppointmentSerializer(serializers.ModelSerializer):
@@ -70,8 +73,22 @@ class MakeAppointmentSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         account = Account.objects.get(user_id=self.context['user_id'])
-        return Appointment.objects.create(
-            account=account, **validated_data)
+
+        with transaction.atomic():
+            # Take a seat with a single conditional UPDATE, safe under concurrent bookings
+            reserved = VaccinationTimeslot.objects.filter(
+                id=validated_data['timeslot'].id,
+                booked__lt=F('capacity')).update(booked=F('booked') + 1, last_updated_datetime=Now())
+
+            if not reserved:
+                raise serializers.ValidationError(
+                    {'timeslot': 'Timeslot is fully booked.'})
+
+            appointment = Appointment(account=account, **validated_data)
+            appointment._seat_reserved = True
+            appointment.save()
+
+            return appointment
 
 
 class UpdateAppointmentSerializer(serializers.ModelSerializer):
@@ -94,3 +111,10 @@ class VaxMalaysiaSerializer(serializers.ModelSerializer):
         model = VaxMalaysia
         fields = ['date', 'daily_partial', 'daily_full', 'daily_booster',
                   'daily', 'cumul_partial', 'cumul_full', 'cumul_booster', 'cumul']
+
+
+class VaxMalaysiaRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VaxMalaysiaRollup
+        fields = ['date', 'daily_partial', 'daily_full', 'daily_booster',
+                  'daily', 'cumul_partial', 'cumul_full', 'cumul_booster', 'cumul']
@@ -1,11 +1,15 @@
-import json
 from django.conf import settings
-from django.db.models.signals import pre_save, post_save
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, pre_save, post_save
 from django.dispatch import receiver
 
-from api.models import Account, Appointment, VaccinationRecord
-from api.serializers import AppointmentSerializer
-from api.utils.send_push_message import send_push_message
+from api.models import Account, Appointment, CenterDistanceField, VaccinationCenter, VaccinationRecord, VaccinationTimeslot
+from api.utils.availability_calendar import invalidate_center_calendar
+from api.utils.district_index import invalidate_district_index
+from api.utils.nearby_cache import invalidate_nearby_cache
+from api.utils.push_outbox import APPOINTMENT_NOTIFICATIONS, enqueue_push_message, get_appointment_notification
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -16,7 +20,9 @@ def create_account_for_new_user(sender, **kwargs):
 
 @receiver(pre_save, sender=Appointment)
 def push_notification_after_appointment_approved_or_rejected(sender, instance,  **kwargs):
-    """Push notification whenever an appointment is approved or rejected"""
+    """Push notification whenever an appointment is approved or rejected, written to the outbox by the post_save handler"""
+    instance._push_notification = None
+
     if instance.id is None:
         pass
     else:
@@ -26,29 +32,79 @@ def push_notification_after_appointment_approved_or_rejected(sender, instance,
         if token == '':
             return
 
-        body = 'Appointment Notification'
-        title = 'Appointment Notification Body'
+        if previous.appointment_status == Appointment.APPOINTMENT_STATUS_PENDING and instance.appointment_status in APPOINTMENT_NOTIFICATIONS:
+            instance._push_notification = (
+                token, *get_appointment_notification(instance))
 
-        appointment_obj = AppointmentSerializer(instance).data
-        serialized_appointment_obj = json.dumps(appointment_obj, default=str)
 
-        if previous.appointment_status == Appointment.APPOINTMENT_STATUS_PENDING and instance.appointment_status == Appointment.APPOINTMENT_STATUS_APPROVED:
-            title = 'Appointment APPROVED!'
-            body = 'Congratulation, your appointment is approved. Please click here to view your appointment details.'
+def _take_timeslot_seat(timeslot_id):
+    """Take a seat with a conditional UPDATE, like the booking API"""
+    taken = VaccinationTimeslot.objects.filter(
+        id=timeslot_id, booked__lt=F('capacity')).update(booked=F('booked') + 1, last_updated_datetime=Now())
 
-        elif previous.appointment_status == Appointment.APPOINTMENT_STATUS_PENDING and instance.appointment_status == Appointment.APPOINTMENT_STATUS_REJECTED:
-            title = 'Appointment REJECTED!'
-            body = 'Sorry, your appointment is rejected. You may submit a new appointment again.'
+    if not taken:
+        raise ValidationError({'timeslot': 'Timeslot is fully booked.'})
 
-        else:
-            return
 
-        send_push_message(token, title, body, serialized_appointment_obj)
+@receiver(pre_save, sender=Appointment)
+def release_timeslot_seat_after_appointment_ended(sender, instance, **kwargs):
+    """Keep the timeslot's booked counter in step with appointments created or changed outside the booking API
+
+    The seat is released whenever an appointment is cancelled, rejected or missed and
+    moved when the timeslot changes. The previous row is locked until the save
+    commits (Appointment.save is atomic), so concurrent saves see each other's status.
+    """
+    if instance.id is None:
+        # Booking API reserves the seat itself with a conditional UPDATE
+        if not getattr(instance, '_seat_reserved', False) and instance.appointment_status in Appointment.SEAT_HOLDING_STATUSES:
+            _take_timeslot_seat(instance.timeslot_id)
+        return
+
+    previous = Appointment.objects.select_for_update().filter(id=instance.id).values_list(
+        'appointment_status', 'timeslot_id').first()
+    if previous is None:
+        return
+
+    previous_status, previous_timeslot_id = previous
+    held = previous_status in Appointment.SEAT_HOLDING_STATUSES
+    holds = instance.appointment_status in Appointment.SEAT_HOLDING_STATUSES
+
+    # The previous center's calendar is invalidated by the post_save handler
+    instance._previous_timeslot_id = previous_timeslot_id if previous_timeslot_id != instance.timeslot_id else None
+
+    if held and (not holds or previous_timeslot_id != instance.timeslot_id):
+        VaccinationTimeslot.objects.filter(id=previous_timeslot_id, booked__gt=0).update(
+            booked=F('booked') - 1, last_updated_datetime=Now())
+
+    if holds and (not held or previous_timeslot_id != instance.timeslot_id):
+        _take_timeslot_seat(instance.timeslot_id)
+
+
+@receiver(post_save, sender=Appointment)
+def invalidate_calendar_after_appointment_changed(sender, instance, **kwargs):
+    """Drop the cached calendar of the appointment's center, its remaining seats may have changed"""
+    invalidate_center_calendar(instance.timeslot.center_id)
+
+    previous_timeslot_id = getattr(instance, '_previous_timeslot_id', None)
+    if previous_timeslot_id is not None:
+        previous_center_id = VaccinationTimeslot.objects.filter(
+            id=previous_timeslot_id).values_list('center_id', flat=True).first()
+        if previous_center_id not in (None, instance.timeslot.center_id):
+            invalidate_center_calendar(previous_center_id)
+
+
+@receiver(post_save, sender=VaccinationTimeslot)
+@receiver(post_delete, sender=VaccinationTimeslot)
+def invalidate_calendar_after_timeslot_changed(sender, instance, **kwargs):
+    """Drop the cached calendar of the timeslot's center whenever a timeslot is saved or deleted"""
+    invalidate_center_calendar(instance.center_id)
 
 
 @receiver(pre_save, sender=VaccinationRecord)
 def push_notification_after_record_added(sender, instance,  **kwargs):
-    """Push notification whenever a vaccination record is inserted"""
+    """Push notification whenever a vaccination record is inserted, written to the outbox by the post_save handler"""
+    instance._push_notification = None
+
     if instance.id is None:
         token = instance.appointment.account.expo_notification_token
 
@@ -58,8 +114,18 @@ def push_notification_after_record_added(sender, instance,  **kwargs):
         dose_type_string = dict(Appointment.DOSE_TYPE_CHOICES)[
             instance.appointment.dose_type].upper()
 
-        send_push_message(token, f'{dose_type_string} dose received!',
-                          f'Congratulation, you have received your {dose_type_string} vaccination dose. Please click here to view your vaccination details.')
+        instance._push_notification = (token, f'{dose_type_string} dose received!',
+                                       f'Congratulation, you have received your {dose_type_string} vaccination dose. Please click here to view your vaccination details.')
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=VaccinationRecord)
+def enqueue_push_notification_after_saved(sender, instance, **kwargs):
+    """Write the push notification of the saved change to the outbox, committed with it in the same transaction"""
+    notification = getattr(instance, '_push_notification', None)
+    if notification is not None:
+        enqueue_push_message(*notification)
+        instance._push_notification = None
 
 
 @receiver(pre_save, sender=VaccinationRecord)
@@ -70,3 +136,40 @@ def update_appointment_status_after_record_added(sender, instance,  **kwargs):
             updated_appointment = instance.appointment
             updated_appointment.appointment_status = Appointment.APPOINTMENT_STATUS_ATTENDED
             Appointment.save(updated_appointment, force_update=True)
+
+
+@receiver(pre_save, sender=VaccinationCenter)
+def reset_hotspot_cluster_after_center_moved(sender, instance, **kwargs):
+    """Reset the hotspot cluster of a moved center, clustered again by the next hotspot refresh
+
+    Distance fields of new or moved centers' OSM vertices are computed by the
+    scheduler's update_distance_fields job.
+    """
+    if instance.id is None or instance.hotspot_cluster_id is None:
+        return
+
+    previous_location = VaccinationCenter.objects.filter(
+        id=instance.id).values_list('location', flat=True).first()
+    if previous_location != instance.location:
+        instance.hotspot_cluster = None
+
+
+@receiver(post_delete, sender=VaccinationCenter)
+def delete_distance_field_after_center_deleted(sender, instance, **kwargs):
+    """Delete the distance field of a deleted center's OSM vertex unless another center shares it"""
+    if instance.gid >= 0 and not VaccinationCenter.objects.filter(gid=instance.gid).exists():
+        CenterDistanceField.objects.filter(root=instance.gid).delete()
+
+
+@receiver(post_save, sender=VaccinationCenter)
+@receiver(post_delete, sender=VaccinationCenter)
+def invalidate_nearby_cache_after_center_changed(sender, **kwargs):
+    """Drop cached nearby responses whenever a center is saved or deleted"""
+    invalidate_nearby_cache()
+
+
+@receiver(post_save, sender=VaccinationCenter)
+@receiver(post_delete, sender=VaccinationCenter)
+def invalidate_district_index_after_center_changed(sender, **kwargs):
+    """Rebuild the district index whenever a center is saved or deleted"""
+    invalidate_district_index()
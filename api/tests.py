@@ -1,3 +1,1390 @@
-from django.test import TestCase
+import datetime
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from exponent_server_sdk import PushReceipt, PushServerError, PushTicket
+from rest_framework.test import APIClient
+
+from .models import Account, AdmissionBucket, Appointment, CenterDistanceField, HotspotCluster, JobRun, PushNotification, User, VaccinationCenter, VaccinationRecord, VaccinationTimeslot, VaxMalaysia, VaxMalaysiaRollup, VaxMalaysiaSource
+from .scheduled_jobs import update_appointment_status, update_centers_hotspot_case, update_push_receipts
+from .utils.admission_control import get_admission_stats
+from .utils.hotspot_clusters import assign_hotspot_clusters
+from .utils.district_index import DistrictIndex, STRtree
+from .utils.format_path import PATH_FORMAT_NONE, PATH_FORMAT_POLYLINE, encode_polyline, format_path, simplify_coords
+from .utils.get_shortest_paths import ROUTING_ENGINE_PGROUTING_BBOX, ROUTING_ENGINE_PRECOMPUTED, get_shortest_paths
+from .utils.job_runs import record_job_run, record_rows, record_upstream_request
+from .utils.leader_election import LeaderElection
+from .utils.push_outbox import dispatch_push_notifications
+from .utils.road_graph import RoadGraph, write_snapshot
+from .utils.update_center_distance_fields import update_center_distance_fields
+from .utils.vertex_index import VertexIndex
+from .utils.ingest_vax_malaysia import ingest_vax_malaysia, update_vax_malaysia_rollups
+
+# Fixture sizes, query counts must not grow with the amount of data
+FIXTURE_SIZES = [1, 10, 50]
+
+# Wall-clock budget in seconds for a single request
+LATENCY_BUDGET = 1.0
+
+# Wall-clock timings of every measured request, printed after each test case
+# when the REPORT_TIMINGS environment variable is set
+TIMINGS = {}
+
+
+class QueryBudgetTestCase(TestCase):
+    """Base test case asserting the number of queries per database alias and recording timings"""
+    databases = {'default', 'osm'}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if os.environ.get('REPORT_TIMINGS'):
+            for name, timings in sorted(TIMINGS.items()):
+                print(f'{name}: ' + ', '.join(
+                    f'size {size} {seconds * 1000:.1f}ms' for size, seconds in timings))
+        TIMINGS.clear()
+
+    def setUp(self):
+        caches['routes'].clear()
+        caches['nearby'].clear()
+        caches['admission'].clear()
+        caches['calendar'].clear()
+        self.district_counter = 0
+
+    def assertQueryBudget(self, name, size, budgets, request):
+        """Run request, assert the queries per alias are within budgets and record the timing"""
+        contexts = {alias: CaptureQueriesContext(connections[alias])
+                    for alias in self.databases}
+
+        for context in contexts.values():
+            context.__enter__()
+        start = time.perf_counter()
+        try:
+            response = request()
+        finally:
+            elapsed = time.perf_counter() - start
+            for context in contexts.values():
+                context.__exit__(None, None, None)
+
+        TIMINGS.setdefault(name, []).append((size, elapsed))
+
+        for alias, context in contexts.items():
+            queries = '\n'.join(query['sql']
+                                for query in context.captured_queries)
+            self.assertLessEqual(
+                len(context), budgets.get(alias, 0),
+                f'{name} (size {size}) ran {len(context)} queries on {alias}:\n{queries}')
+
+        self.assertLessEqual(elapsed, LATENCY_BUDGET,
+                             f'{name} (size {size}) took {elapsed:.3f}s')
+
+        return response
+
+    def create_fixtures(self, size):
+        """Create a user with size of each related object, return (client, user, center)"""
+        self.district_counter += 1
+        district = f'District {self.district_counter}'
+
+        user = User.objects.create_user(
+            f'user{self.district_counter}@example.com', 'password')
+        account = Account.objects.get(user=user)
+
+        centers = [VaccinationCenter.objects.create(
+            name=f'Center {index}', location=Point(101.6 + index * 0.001, 2.9 + self.district_counter, srid=4326),
+            state='Selangor', district=district, gid=index + 1) for index in range(size)]
+        center = centers[0]
+
+        now = timezone.now()
+        for index in range(size):
+            VaccinationTimeslot.objects.create(
+                center=center, datetime=now + datetime.timedelta(hours=index + 1))
+
+        past_timeslot = VaccinationTimeslot.objects.create(
+            center=center, datetime=now - datetime.timedelta(days=1))
+        for index in range(size):
+            appointment = Appointment.objects.create(
+                account=account, timeslot=past_timeslot, dose_type=Appointment.DOSE_TYPE_FIRST,
+                appointment_status=Appointment.APPOINTMENT_STATUS_CANCELLED)
+            VaccinationRecord.objects.create(
+                appointment=appointment, vaccine_brand=VaccinationRecord.VACCINE_BRAND_PFIZER)
+
+        today = datetime.date.today()
+        for index in range(size):
+            date = today - datetime.timedelta(days=self.district_counter * 1000 + index)
+            VaxMalaysia.objects.create(
+                date=date, daily_partial=1, daily_full=1, daily_booster=1, daily=3,
+                cumul_partial=1, cumul_full=1, cumul_booster=1, cumul=3)
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        return client, user, center
+
+
+class AccountViewSetTests(QueryBudgetTestCase):
+    def test_me(self):
+        for size in FIXTURE_SIZES:
+            client, _, _ = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET accounts/me', size, {'default': 1},
+                lambda: client.get('/api/accounts/me/'))
+            self.assertEqual(response.status_code, 200)
+
+            response = self.assertQueryBudget(
+                'PUT accounts/me', size, {'default': 2},
+                lambda: client.put('/api/accounts/me/', {'name': 'Name'}, format='json'))
+            self.assertEqual(response.status_code, 200)
+
+
+class AppointmentViewSetTests(QueryBudgetTestCase):
+    def test_list(self):
+        for size in FIXTURE_SIZES:
+            client, _, _ = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET appointments', size, {'default': 3},
+                lambda: client.get('/api/appointments/'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), size)
+
+            etag = response['ETag']
+            response = self.assertQueryBudget(
+                'GET appointments not modified', size, {'default': 1},
+                lambda: client.get('/api/appointments/', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 304)
+
+    def test_retrieve(self):
+        for size in FIXTURE_SIZES:
+            client, user, _ = self.create_fixtures(size)
+            appointment = Appointment.objects.filter(
+                account__user=user).first()
+
+            response = self.assertQueryBudget(
+                'GET appointments/{id}', size, {'default': 3},
+                lambda: client.get(f'/api/appointments/{appointment.id}/'))
+            self.assertEqual(response.status_code, 200)
+
+            etag = response['ETag']
+            response = self.assertQueryBudget(
+                'GET appointments/{id} not modified', size, {'default': 1},
+                lambda: client.get(f'/api/appointments/{appointment.id}/', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 304)
+
+    def test_create(self):
+        for size in FIXTURE_SIZES:
+            client, _, center = self.create_fixtures(size)
+            timeslot = VaccinationTimeslot.objects.filter(
+                center=center, datetime__gte=timezone.now()).first()
+
+            # Including the admission buckets, created by their first booking
+            response = self.assertQueryBudget(
+                'POST appointments', size, {'default': 14},
+                lambda: client.post('/api/appointments/', {'timeslot': timeslot.id}, format='json'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_partial_update(self):
+        for size in FIXTURE_SIZES:
+            client, user, center = self.create_fixtures(size)
+            appointment = Appointment.objects.create(
+                account=Account.objects.get(user=user), dose_type=Appointment.DOSE_TYPE_SECOND,
+                timeslot=VaccinationTimeslot.objects.filter(center=center).first())
+
+            response = self.assertQueryBudget(
+                'PATCH appointments/{id}', size, {'default': 9},
+                lambda: client.patch(f'/api/appointments/{appointment.id}/', {
+                    'appointment_status': Appointment.APPOINTMENT_STATUS_CANCELLED}, format='json'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_create_with_ongoing_appointment(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['dose_type'], Appointment.DOSE_TYPE_SECOND)
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_other_integrity_error(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        # Only the one ongoing appointment constraint is reported as a booking error
+        with mock.patch('api.views.MakeAppointmentSerializer.save', side_effect=IntegrityError('other')), \
+                self.assertRaises(IntegrityError):
+            client.post('/api/appointments/', {'timeslot': timeslot.id}, format='json')
+
+    def test_create_fully_booked(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+        VaccinationTimeslot.objects.filter(id=timeslot.id).update(capacity=0)
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        timeslot.refresh_from_db()
+        self.assertEqual(timeslot.booked, 0)
+
+    def test_booking_and_cancellation_update_seats(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        timeslot.refresh_from_db()
+        self.assertEqual(timeslot.booked, 1)
+
+        client.patch(f'/api/appointments/{response.data["id"]}/', {
+            'appointment_status': Appointment.APPOINTMENT_STATUS_CANCELLED}, format='json')
+        timeslot.refresh_from_db()
+        self.assertEqual(timeslot.booked, 0)
+
+    @override_settings(ADMISSION_CENTER_RATE=1 / 3600, ADMISSION_CENTER_BURST=1)
+    def test_create_over_admission_rate(self):
+        client, user, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        user.is_staff = True
+        user.save()
+        response = client.get('/api/appointments/admission/')
+        self.assertEqual(response.data, {'admitted': 1, 'shed': 1})
+
+    @override_settings(ADMISSION_CENTER_RATE=1 / 3600, ADMISSION_CENTER_BURST=2,
+                       ADMISSION_GLOBAL_RATE=1 / 3600, ADMISSION_GLOBAL_BURST=1)
+    def test_create_over_global_admission_rate(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+        # The center token of the shed booking is refunded
+        self.assertAlmostEqual(AdmissionBucket.objects.get(
+            name=f'center:{center.id}').tokens, 1, places=2)
+        self.assertEqual(get_admission_stats(), {'admitted': 1, 'shed': 1})
+
+    @override_settings(ADMISSION_CENTER_RATE=1, ADMISSION_CENTER_BURST=1)
+    def test_create_after_admission_refill(self):
+        client, _, center = self.create_fixtures(1)
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        Appointment.objects.all().delete()
+
+        # A second later the bucket holds a token again
+        AdmissionBucket.objects.filter(name=f'center:{center.id}').update(
+            refilled_datetime=timezone.now() - datetime.timedelta(seconds=1))
+        response = client.post(
+            '/api/appointments/', {'timeslot': timeslot.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class SeatAccountingTests(TestCase):
+    def setUp(self):
+        center = VaccinationCenter.objects.create(
+            name='Center', location=Point(101.6, 2.9, srid=4326), state='Selangor', district='District')
+        now = timezone.now()
+        self.timeslots = [VaccinationTimeslot.objects.create(
+            center=center, datetime=now + datetime.timedelta(hours=index + 1), capacity=1) for index in range(2)]
+        user = User.objects.create_user('seats@example.com', 'password')
+        self.appointment = Appointment.objects.create(
+            account=Account.objects.get(user=user), timeslot=self.timeslots[0], dose_type=Appointment.DOSE_TYPE_FIRST)
+
+    def assertBooked(self, booked):
+        self.assertEqual([VaccinationTimeslot.objects.get(id=timeslot.id).booked for timeslot in self.timeslots], booked)
+
+    def test_reject_releases_seat(self):
+        stale = Appointment.objects.get(id=self.appointment.id)
+        self.assertBooked([1, 0])
+        self.appointment.appointment_status = Appointment.APPOINTMENT_STATUS_REJECTED
+        self.appointment.save()
+        self.assertBooked([0, 0])
+
+        # A stale copy saved afterwards does not release the seat twice
+        stale.appointment_status = Appointment.APPOINTMENT_STATUS_CANCELLED
+        stale.save()
+        self.assertBooked([0, 0])
+
+    def test_timeslot_move_moves_seat(self):
+        self.appointment.timeslot = self.timeslots[1]
+        self.appointment.save()
+        self.assertBooked([0, 1])
+
+    def test_move_to_fully_booked_timeslot(self):
+        VaccinationTimeslot.objects.filter(id=self.timeslots[1].id).update(booked=1)
+        self.appointment.timeslot = self.timeslots[1]
+
+        with self.assertRaises(ValidationError):
+            self.appointment.full_clean()
+        with self.assertRaises(ValidationError):
+            self.appointment.save()
+        self.assertBooked([1, 1])
+
+
+@override_settings(NEARBY_CONCURRENT_LOOKUPS=False)
+class VaccinationCenterViewSetTests(QueryBudgetTestCase):
+    """Lookups run on the test thread, fixtures are only visible to the test's own connections"""
+
+    def mock_routing(self, center):
+        """Fake the OSM vertex index and routing of the center's district, the OSM routing database is not available to tests"""
+        vertex_index = mock.Mock()
+        vertex_index.nearest.return_value = (
+            0, center.location.x, center.location.y)
+        routes = [{'gid': other.gid, 'agg_cost': other.gid * 0.1,
+                   'path_geom': f'LINESTRING({center.location.x} {center.location.y}, {other.location.x} {other.location.y})'}
+                  for other in VaccinationCenter.objects.filter(district=center.district)]
+
+        return vertex_index, routes
+
+    def test_nearby(self):
+        for size in FIXTURE_SIZES:
+            client, _, center = self.create_fixtures(size)
+            url = f'/api/centers/nearby/{center.location.y},{center.location.x}/'
+            vertex_index, routes = self.mock_routing(center)
+
+            with mock.patch('api.views.get_vertex_index', return_value=vertex_index), \
+                    mock.patch('api.utils.route_cache.get_shortest_paths', return_value=routes):
+                response = self.assertQueryBudget(
+                    'GET centers/nearby', size, {'default': 4, 'osm': 0},
+                    lambda: client.get(url))
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()), size)
+
+                # Users snapped to the same vertex are served from the nearby response cache
+                cached_response = self.assertQueryBudget(
+                    'GET centers/nearby (cached)', size, {'default': 2, 'osm': 0},
+                    lambda: client.get(url))
+
+                self.assertEqual(cached_response.json(), response.json())
+
+                # Saving a center invalidates the cached responses
+                center.num_cases = 10
+                center.save()
+                response = client.get(url)
+
+                self.assertEqual(response.json()[0]['cases'], 10)
+
+    @override_settings(NEARBY_TIMEOUT=0.01)
+    def test_nearby_routing_timeout(self):
+        client, _, center = self.create_fixtures(10)
+        vertex_index, routes = self.mock_routing(center)
+
+        def slow_routing(*args):
+            time.sleep(0.1)
+            return routes
+
+        with mock.patch('api.views.get_vertex_index', return_value=vertex_index), \
+                mock.patch('api.utils.route_cache.get_shortest_paths', side_effect=slow_routing):
+            response = client.get(
+                f'/api/centers/nearby/{center.location.y},{center.location.x}/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Nearby-Degraded'], 'straight-line')
+        self.assertEqual(len(response.json()), 10)
+        self.assertEqual(response.json()[0]['id'], center.id)
+
+    @override_settings(NEARBY_TIMEOUT=0.01)
+    def test_nearby_lookup_timeout(self):
+        client, _, center = self.create_fixtures(1)
+        vertex_index, _ = self.mock_routing(center)
+
+        def slow_district_centers(*args):
+            time.sleep(0.1)
+            return {}
+
+        with mock.patch('api.views.get_vertex_index', return_value=vertex_index), \
+                mock.patch('api.views.get_district_centers', side_effect=slow_district_centers):
+            response = client.get(
+                f'/api/centers/nearby/{center.location.y},{center.location.x}/')
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_nearby_out_of_range(self):
+        client, _, center = self.create_fixtures(1)
+        vertex_index = VertexIndex([(1, center.location.x, center.location.y)], 0.01)
+
+        with mock.patch('api.views.get_vertex_index', return_value=vertex_index):
+            response = client.get('/api/centers/nearby/99.9,999.9/')
+            self.assertEqual(response.status_code, 400)
+
+            response = client.get(
+                f'/api/centers/nearby/{center.location.y + 5},{center.location.x}/')
+            self.assertEqual(response.status_code, 400)
+
+    def test_nearby_path_format(self):
+        client, _, center = self.create_fixtures(10)
+        url = f'/api/centers/nearby/{center.location.y},{center.location.x}/'
+        vertex_index, routes = self.mock_routing(center)
+
+        with mock.patch('api.views.get_vertex_index', return_value=vertex_index), \
+                mock.patch('api.utils.route_cache.get_shortest_paths', return_value=routes):
+            response = client.get(url, {'path_format': 'none'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), 10)
+            self.assertTrue(all('path' not in result for result in response.json()))
+
+            response = client.get(url, {'path_format': 'polyline', 'simplify': 0.0001})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(all(isinstance(result['path'], str) for result in response.json()))
+
+            response = client.get(url, {'path_format': 'geojson'})
+            self.assertEqual(response.status_code, 400)
+
+            response = client.get(url, {'simplify': -1})
+            self.assertEqual(response.status_code, 400)
+
+    def test_nearby_unauthenticated(self):
+        response = APIClient().get('/api/centers/nearby/2.9,101.6/')
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_nearby_cache(self):
+        for size in FIXTURE_SIZES:
+            client, user, _ = self.create_fixtures(size)
+            user.is_staff = True
+            user.save()
+
+            response = self.assertQueryBudget(
+                'GET centers/nearby/cache', size, {},
+                lambda: client.get('/api/centers/nearby/cache/'))
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(CALENDAR_PAGE_SIZE=20)
+    def test_calendar(self):
+        for size in FIXTURE_SIZES:
+            client, _, center = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET centers/{id}/calendar', size, {'default': 3},
+                lambda: client.get(f'/api/centers/{center.id}/calendar/'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['center']['id'], center.id)
+            self.assertEqual(sum(len(day['slots']) for day in response.data['days']), min(size, 20))
+            self.assertEqual(response.data['next'] is not None, size > 20)
+
+            response = self.assertQueryBudget(
+                'GET centers/{id}/calendar cached', size, {'default': 1},
+                lambda: client.get(f'/api/centers/{center.id}/calendar/'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_calendar_after_booking(self):
+        client, _, center = self.create_fixtures(1)
+        client.get(f'/api/centers/{center.id}/calendar/')
+
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+        client.post('/api/appointments/', {'timeslot': timeslot.id}, format='json')
+
+        response = client.get(f'/api/centers/{center.id}/calendar/')
+        slot = response.data['days'][0]['slots'][0]
+        self.assertEqual(slot['id'], timeslot.id)
+        self.assertEqual(slot['remaining'], 99)
+
+    def test_delete_removes_distance_field(self):
+        _, _, center = self.create_fixtures(1)
+        CenterDistanceField.objects.create(
+            root=center.gid, vertex=center.gid, cost=0)
+
+        center.delete()
+        self.assertFalse(CenterDistanceField.objects.filter(
+            root=center.gid).exists())
+
+
+
+def random_edge_rows(num_vertices, num_edges, seed):
+    """Random (id, source, target, cost, reverse_cost) osm2po edge rows, some of them one-way"""
+    rng = random.Random(seed)
+    rows = [(0, None, 1, 1.0, 1.0)]
+    for edge in range(1, num_edges + 1):
+        source, target = rng.sample(range(num_vertices), 2)
+        cost = rng.uniform(0.1, 5)
+        rows.append((edge, source, target, cost, -1 if rng.random() < 0.3 else cost))
+
+    return rows
+
+
+def brute_force_costs(rows, source, directed):
+    """Bellman-Ford costs from source over the edge rows, {vertex: cost} of the reachable vertices"""
+    arcs = []
+    for _, tail, head, cost, reverse_cost in rows:
+        if tail is None or head is None:
+            continue
+        arcs.append((tail, head, cost))
+        arcs.append((head, tail, reverse_cost if directed else cost))
+
+    costs = {source: 0.0}
+    changed = True
+    while changed:
+        changed = False
+        for tail, head, cost in arcs:
+            if cost >= 0 and tail in costs and costs[tail] + cost < costs.get(head, float('inf')):
+                costs[head] = costs[tail] + cost
+                changed = True
+
+    return costs
+
+
+def follow_path(rows, source, steps, directed):
+    """Follow (node, edge) path steps from source over the edge rows, return (last vertex, total cost)
+
+    Raises AssertionError when a step does not start at the previous step's end.
+    """
+    edges = {row[0]: row for row in rows}
+    vertex = source
+    total = 0
+    for node, edge in steps:
+        assert node == vertex, f'step ({node}, {edge}) does not start at {vertex}'
+        _, tail, head, cost, reverse_cost = edges[edge]
+        if tail == node:
+            vertex = head
+            total += cost
+        else:
+            vertex = tail
+            total += reverse_cost if directed else cost
+
+    return vertex, total
+
+
+class RoadGraphTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'road_graph.snapshot')
+        self.rows = random_edge_rows(30, 60, seed=1)
+
+    def test_shortest_paths(self):
+        for directed in (False, True):
+            num_vertices, num_arcs = write_snapshot(self.path, self.rows, directed)
+            graph = RoadGraph(self.path)
+            self.assertEqual((graph.directed, graph.num_vertices, graph.num_arcs),
+                             (directed, num_vertices, num_arcs))
+            # Every edge both ways, less the skipped row and the one-way edges' reverse arcs when directed
+            self.assertEqual(num_arcs, sum(
+                1 + (not directed or reverse_cost >= 0) for _, source, _, _, reverse_cost in self.rows if source is not None))
+
+            for source in range(0, 30, 3):
+                expected = brute_force_costs(self.rows, source, directed)
+                paths = graph.shortest_paths(source, list(range(30)) + [999])
+
+                self.assertEqual(set(paths), set(expected))
+                for target, (agg_cost, steps) in paths.items():
+                    self.assertAlmostEqual(agg_cost, expected[target])
+                    vertex, cost = follow_path(self.rows, source, steps, directed)
+                    self.assertEqual(vertex, target)
+                    self.assertAlmostEqual(cost, agg_cost)
+
+    def test_shortest_path_tree(self):
+        write_snapshot(self.path, self.rows)
+        graph = RoadGraph(self.path)
+        expected = brute_force_costs(self.rows, 5, directed=False)
+        costs = {edge: cost for edge, _, _, cost, _ in self.rows}
+
+        tree = {vertex: (cost, predecessor, edge)
+                for vertex, cost, predecessor, edge in graph.shortest_path_tree(5, 4)}
+
+        self.assertEqual(set(tree), {vertex for vertex, cost in expected.items() if cost <= 4})
+        self.assertEqual(tree[5], (0, None, None))
+        for vertex, (cost, predecessor, edge) in tree.items():
+            self.assertAlmostEqual(cost, expected[vertex])
+            if predecessor is not None:
+                self.assertAlmostEqual(cost, tree[predecessor][0] + costs[edge])
+
+    def test_invalid_snapshot(self):
+        with open(self.path, 'wb') as file:
+            file.write(bytes(64))
+
+        with self.assertRaises(ValueError):
+            RoadGraph(self.path)
+
+
+class VertexIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(3)
+        # Dense clusters of vertices with sparse ones in between, like towns along roads
+        self.vertices = []
+        for cluster in range(5):
+            cx, cy = rng.uniform(100, 104), rng.uniform(1, 6)
+            for _ in range(300):
+                self.vertices.append((len(self.vertices), cx + rng.gauss(0, 0.05), cy + rng.gauss(0, 0.05)))
+        for _ in range(100):
+            self.vertices.append((len(self.vertices), rng.uniform(100, 104), rng.uniform(1, 6)))
+        self.index = VertexIndex(self.vertices, 0.01)
+        self.rng = rng
+
+    def distance(self, x, y, vx, vy):
+        return ((vx - x) * math.cos(math.radians(y))) ** 2 + (vy - y) ** 2
+
+    def test_nearest(self):
+        queries = [(self.rng.uniform(100, 104), self.rng.uniform(1, 6)) for _ in range(200)]
+        # Right on vertices and far outside the indexed extent
+        queries += [(x, y) for _, x, y in self.vertices[::250]]
+        queries += [(90.0, 3.0), (110.0, -10.0), (102.0, 40.0)]
+
+        for x, y in queries:
+            vertex, vx, vy = self.index.nearest(x, y)
+            self.assertEqual(self.vertices[vertex], (vertex, vx, vy))
+            self.assertAlmostEqual(self.distance(x, y, vx, vy), min(
+                self.distance(x, y, px, py) for _, px, py in self.vertices))
+
+    def test_covers(self):
+        xmin = min(x for _, x, _ in self.vertices)
+        ymax = max(y for _, _, y in self.vertices)
+
+        self.assertTrue(self.index.covers(102, 3, 0.5))
+        self.assertTrue(self.index.covers(xmin - 0.4, ymax + 0.4, 0.5))
+        self.assertFalse(self.index.covers(xmin - 0.6, 3, 0.5))
+        self.assertFalse(self.index.covers(102, ymax + 0.6, 0.5))
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            VertexIndex([], 0.01)
+
+
+@override_settings(ROUTING_BBOX_BUFFER=0.05, ROUTING_BBOX_GROWTH=4, ROUTING_BBOX_MAX_ATTEMPTS=3)
+class BoundedRoutingTests(SimpleTestCase):
+    bounds = (101.0, 3.0, 101.1, 3.1)
+
+    def route(self, found):
+        """Route with pgr_dijkstra faked to find the given rows attempt by attempt, return (rows, calls)"""
+        calls = []
+
+        def pgrouting_shortest_paths(user_gid, center_gids, edges_sql):
+            envelope = re.search(r'ST_MakeEnvelope\(([^)]*), 4326\)', edges_sql).group(1)
+            calls.append((set(center_gids), [float(value) for value in envelope.split(',')]))
+            return found[len(calls) - 1]
+
+        with mock.patch('api.utils.get_shortest_paths._pgrouting_shortest_paths', side_effect=pgrouting_shortest_paths):
+            rows = get_shortest_paths(1, [10, 20, 30], self.bounds, engine=ROUTING_ENGINE_PGROUTING_BBOX)
+
+        return rows, calls
+
+    def test_retry_unreachable_centers(self):
+        rows, calls = self.route([
+            [{'gid': 20, 'agg_cost': 3.0}],
+            [{'gid': 10, 'agg_cost': 2.0}],
+            [],
+        ])
+
+        # Only the centers not reached yet are routed again, in a box growing by ROUTING_BBOX_GROWTH
+        self.assertEqual([center_gids for center_gids, _ in calls], [{10, 20, 30}, {10, 30}, {30}])
+        for (_, envelope), buffer in zip(calls, (0.05, 0.2, 0.8)):
+            for value, expected in zip(envelope, (101.0 - buffer, 3.0 - buffer, 101.1 + buffer, 3.1 + buffer)):
+                self.assertAlmostEqual(value, expected)
+        # Unreachable after ROUTING_BBOX_MAX_ATTEMPTS, left out
+        self.assertEqual([row['gid'] for row in rows], [10, 20])
+
+    def test_all_reached(self):
+        rows, calls = self.route([
+            [{'gid': 30, 'agg_cost': 1.0}, {'gid': 10, 'agg_cost': 4.0}, {'gid': 20, 'agg_cost': 2.0}],
+        ])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([row['gid'] for row in rows], [30, 20, 10])
+
+    def test_without_bounds(self):
+        with mock.patch('api.utils.get_shortest_paths._pgrouting_shortest_paths', return_value=[]) as pgrouting:
+            get_shortest_paths(1, [10], engine=ROUTING_ENGINE_PGROUTING_BBOX)
+
+        pgrouting.assert_called_once_with(1, [10])
+
+
+@override_settings(ROUTING_DISTANCE_FIELD_MAX_COST=100, ROUTING_PRECOMPUTED_FALLBACK='pgrouting')
+class PrecomputedRoutingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'road_graph.snapshot')
+        self.rows = random_edge_rows(30, 60, seed=2)
+        write_snapshot(path, self.rows)
+
+        settings_override = override_settings(ROUTING_GRAPH_SNAPSHOT=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # Centers on three vertices reachable from user's vertex
+        self.roots = [vertex for vertex in sorted(brute_force_costs(self.rows, 4, directed=False)) if vertex != 4][:3]
+        for index, root in enumerate(self.roots):
+            VaccinationCenter.objects.create(
+                name=f'Center {index}', location=Point(101.6, 2.9, srid=4326),
+                state='Selangor', district='District', gid=root)
+
+    def route(self, user_gid, center_gids):
+        """Route with path geometries and the fallback engine faked, return (rows, fallback mock)"""
+        def with_path_geometries(paths):
+            return [{'gid': gid, 'agg_cost': agg_cost, 'steps': steps} for gid, (agg_cost, steps) in paths.items()]
+
+        with mock.patch('api.utils.get_shortest_paths._with_path_geometries', side_effect=with_path_geometries), \
+                mock.patch('api.utils.get_shortest_paths.get_shortest_paths',
+                           return_value=[{'gid': -1, 'agg_cost': 0.0, 'steps': None}]) as fallback:
+            rows = get_shortest_paths(user_gid, center_gids, engine=ROUTING_ENGINE_PRECOMPUTED)
+
+        return rows, fallback
+
+    def test_walk(self):
+        self.assertEqual(update_center_distance_fields(), set(self.roots))
+        user_gid = 4
+
+        rows, fallback = self.route(user_gid, self.roots)
+
+        fallback.assert_not_called()
+        self.assertEqual(len(rows), len(self.roots))
+        self.assertEqual([row['agg_cost'] for row in rows], sorted(row['agg_cost'] for row in rows))
+        for row in rows:
+            # The predecessor chain leads from user's vertex to the center's root vertex
+            vertex, cost = follow_path(self.rows, user_gid, row['steps'], directed=False)
+            self.assertEqual(vertex, row['gid'])
+            self.assertAlmostEqual(cost, row['agg_cost'])
+            self.assertAlmostEqual(row['agg_cost'], brute_force_costs(self.rows, row['gid'], directed=False)[user_gid])
+
+    def test_fallback(self):
+        update_center_distance_fields(gids=self.roots[:2])
+        user_gid = 4
+
+        rows, fallback = self.route(user_gid, self.roots)
+
+        # Centers without a field are routed by ROUTING_PRECOMPUTED_FALLBACK
+        fallback.assert_called_once_with(user_gid, {self.roots[2]}, None, engine='pgrouting')
+        self.assertEqual(rows[0]['gid'], -1)
+        self.assertEqual({row['gid'] for row in rows[1:]}, set(self.roots[:2]))
+
+    def test_user_at_center_vertex(self):
+        update_center_distance_fields()
+
+        rows, fallback = self.route(self.roots[0], self.roots)
+
+        fallback.assert_not_called()
+        self.assertEqual({row['gid'] for row in rows}, set(self.roots[1:]))
+
+
+class FormatPathTests(SimpleTestCase):
+    def test_encode_polyline(self):
+        # Reference example of Google's encoded polyline algorithm format
+        coords = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+
+        self.assertEqual(encode_polyline(coords), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(encode_polyline([]), '')
+
+    def test_simplify_coords(self):
+        coords = ((0.0, 0.0), (1.0, 0.00001), (2.0, 0.0), (3.0, 1.0))
+
+        self.assertEqual(tuple(simplify_coords(coords, 0.001)), ((0.0, 0.0), (2.0, 0.0), (3.0, 1.0)))
+        self.assertEqual(tuple(simplify_coords(coords, 0.000001)), coords)
+        self.assertEqual(simplify_coords(((1.0, 1.0),), 0.001), ((1.0, 1.0),))
+
+        parts = simplify_coords((coords, ((5.0, 5.0), (5.5, 5.0), (6.0, 5.0))), 0.001)
+        self.assertEqual([tuple(part) for part in parts], [
+            ((0.0, 0.0), (2.0, 0.0), (3.0, 1.0)), ((5.0, 5.0), (6.0, 5.0))])
+
+    def test_format_path(self):
+        coords = ((101.6, 2.9), (101.61, 2.91))
+        multi = (coords, ((101.7, 3.0), (101.71, 3.01)))
+
+        self.assertIsNone(format_path(coords, PATH_FORMAT_NONE))
+        self.assertEqual(format_path(coords), coords)
+        self.assertEqual(format_path(coords, PATH_FORMAT_POLYLINE), encode_polyline(coords))
+        self.assertEqual(format_path(multi, PATH_FORMAT_POLYLINE), [encode_polyline(part) for part in multi])
+
+
+class DistrictIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Two districts whose hulls overlap in [1.5, 2] x [1.5, 2] and a lone center far away
+        centers = [('A', 0, 0), ('A', 2, 0), ('A', 0, 2), ('A', 2, 2),
+                   ('B', 1.5, 1.5), ('B', 3.5, 1.5), ('B', 1.5, 3.5), ('B', 3.5, 3.5),
+                   ('C', 10, 10)]
+        self.index = DistrictIndex(centers, 0.02, 0.5)
+
+    def test_inside_one_hull(self):
+        self.assertEqual(self.index.get_district(0.5, 0.5), 'A')
+        self.assertEqual(self.index.get_district(3, 3), 'B')
+        self.assertEqual(self.index.get_district(10.01, 10), 'C')
+
+    def test_overlapping_hulls(self):
+        # The district of the nearest center among the overlapping hulls
+        self.assertEqual(self.index.get_district(1.6, 1.6), 'B')
+        self.assertEqual(self.index.get_district(1.95, 1.95), 'A')
+
+    def test_outside_every_hull(self):
+        # The district of the nearest center
+        self.assertEqual(self.index.get_district(-1, 1), 'A')
+        self.assertEqual(self.index.get_district(5, 0.5), 'B')
+        self.assertEqual(self.index.get_district(8, 8.5), 'C')
+
+    def test_strtree(self):
+        rng = random.Random(4)
+        entries = []
+        for item in range(500):
+            x, y = rng.uniform(0, 10), rng.uniform(0, 10)
+            entries.append(((x, y, x + rng.uniform(0, 1), y + rng.uniform(0, 1)), item))
+        tree = STRtree(entries)
+
+        for _ in range(100):
+            x, y = rng.uniform(-1, 11), rng.uniform(-1, 11)
+            self.assertEqual(sorted(tree.query(x, y)), [
+                item for (xmin, ymin, xmax, ymax), item in entries if xmin <= x <= xmax and ymin <= y <= ymax])
+
+class VaccinationTimeslotViewSetTests(QueryBudgetTestCase):
+    def test_list(self):
+        for size in FIXTURE_SIZES:
+            client, _, center = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET centers/{id}/timeslots', size, {'default': 2},
+                lambda: client.get(f'/api/centers/{center.id}/timeslots/'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), size)
+
+            etag = response['ETag']
+            response = self.assertQueryBudget(
+                'GET centers/{id}/timeslots not modified', size, {'default': 1},
+                lambda: client.get(f'/api/centers/{center.id}/timeslots/', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_modified_after_booking(self):
+        client, _, center = self.create_fixtures(1)
+        etag = client.get(f'/api/centers/{center.id}/timeslots/')['ETag']
+
+        timeslot = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).first()
+        client.post('/api/appointments/', {'timeslot': timeslot.id}, format='json')
+
+        response = client.get(
+            f'/api/centers/{center.id}/timeslots/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['booked'], 1)
+
+    def test_list_modified_after_seat_moved(self):
+        client, user, center = self.create_fixtures(2)
+        first, second = VaccinationTimeslot.objects.filter(
+            center=center, datetime__gte=timezone.now()).order_by('datetime')[:2]
+        appointment = Appointment.objects.create(
+            account=Account.objects.get(user=user), dose_type=Appointment.DOSE_TYPE_FIRST, timeslot=first)
+        etag = client.get(f'/api/centers/{center.id}/timeslots/')['ETag']
+
+        # Seats booked and offered in total are unchanged
+        appointment.timeslot = second
+        appointment.save()
+
+        response = client.get(
+            f'/api/centers/{center.id}/timeslots/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class VaccinationRecordViewSetTests(QueryBudgetTestCase):
+    def test_list(self):
+        for size in FIXTURE_SIZES:
+            client, _, _ = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET records', size, {'default': 3},
+                lambda: client.get('/api/records/'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), size)
+
+            etag = response['ETag']
+            response = self.assertQueryBudget(
+                'GET records not modified', size, {'default': 1},
+                lambda: client.get('/api/records/', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 304)
+
+
+class VaxMalaysiaViewSetTests(QueryBudgetTestCase):
+    def test_list(self):
+        for size in FIXTURE_SIZES:
+            client, _, _ = self.create_fixtures(size)
+
+            response = self.assertQueryBudget(
+                'GET statistic', size, {'default': 2},
+                lambda: client.get('/api/statistic/'))
+            self.assertEqual(response.status_code, 200)
+
+            etag = response['ETag']
+            response = self.assertQueryBudget(
+                'GET statistic not modified', size, {'default': 1},
+                lambda: client.get('/api/statistic/', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_rollups(self):
+        client, _, _ = self.create_fixtures(1)
+        VaxMalaysia.objects.all().delete()
+        # 2021-03-01 is a Monday, two full weeks of March
+        for day in range(1, 15):
+            VaxMalaysia.objects.create(
+                date=datetime.date(2021, 3, day), daily_partial=1, daily_full=1, daily_booster=1, daily=3,
+                cumul_partial=day, cumul_full=day, cumul_booster=day, cumul=3 * day)
+        update_vax_malaysia_rollups()
+
+        response = client.get('/api/statistic/?granularity=weekly')
+        self.assertEqual([(row['date'], row['daily'], row['cumul']) for row in response.data],
+                         [('2021-03-08', 21, 42), ('2021-03-01', 21, 21)])
+
+        response = client.get(
+            '/api/statistic/?granularity=monthly&from=2021-03-01&to=2021-03-31')
+        self.assertEqual([(row['date'], row['daily']) for row in response.data], [('2021-03-01', 42)])
+
+        response = client.get('/api/statistic/?from=2021-03-10&to=2021-03-11')
+        self.assertEqual(len(response.data), 2)
+
+        response = client.get('/api/statistic/?granularity=yearly')
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_modified_after_correction(self):
+        client, _, _ = self.create_fixtures(1)
+        etag = client.get('/api/statistic/')['ETag']
+
+        # Upstream correction of an existing date, count and last date unchanged
+        statistic = VaxMalaysia.objects.order_by('-date').first()
+        statistic.cumul += 1
+        statistic.save()
+
+        response = client.get('/api/statistic/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_streamed(self):
+        client, _, _ = self.create_fixtures(2)
+        dates = [date.isoformat() for date in VaxMalaysia.objects.order_by(
+            '-date').values_list('date', flat=True)]
+
+        response = self.assertQueryBudget(
+            'GET statistic?format=columns', 2, {'default': 2},
+            lambda: b''.join(client.get('/api/statistic/?format=columns').streaming_content))
+        columns = json.loads(response)
+        self.assertEqual(columns['date'], dates)
+        self.assertEqual(columns['cumul'], [3] * len(dates))
+
+        response = self.assertQueryBudget(
+            'GET statistic?format=csv', 2, {'default': 2},
+            lambda: b''.join(client.get('/api/statistic/?format=csv').streaming_content))
+        lines = response.decode().splitlines()
+        self.assertEqual(lines[0], 'date,daily_partial,daily_full,daily_booster,daily,cumul_partial,cumul_full,cumul_booster,cumul')
+        self.assertEqual(len(lines), len(dates) + 1)
+
+
+class IngestVaxMalaysiaTests(TestCase):
+    HEADER = 'date,daily_partial,daily_full,daily_booster,daily,daily_partial_adol,cumul_partial,cumul_full,cumul_booster,cumul\n'
+
+    def write_csv(self, *dates):
+        with open(self.path, 'w') as file:
+            file.write(self.HEADER)
+            for index, date in enumerate(dates):
+                file.write(f'{date},1,2,3,6,0,{index + 1},{2 * (index + 1)},{3 * (index + 1)},{6 * (index + 1)}\n')
+
+    def setUp(self):
+        file, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(file)
+        self.addCleanup(os.remove, self.path)
+
+    def test_incremental(self):
+        with override_settings(VAX_MALAYSIA_CSV_URL=self.path):
+            self.write_csv('2021-02-24', '2021-02-25')
+            stats = ingest_vax_malaysia()
+            self.assertEqual(stats['rows_written'], 2)
+
+            self.write_csv('2021-02-24', '2021-02-25', '2021-02-26')
+            stats = ingest_vax_malaysia()
+            self.assertEqual(stats, {'rows_read': 3, 'rows_written': 1, 'not_modified': False})
+
+            stats = ingest_vax_malaysia(full_resync=True)
+            self.assertEqual(stats['rows_written'], 3)
+
+        self.assertEqual(VaxMalaysia.objects.count(), 3)
+        self.assertEqual(VaxMalaysia.objects.get(date='2021-02-26').cumul, 18)
+
+        rollup = VaxMalaysiaRollup.objects.get(
+            granularity=VaxMalaysiaRollup.GRANULARITY_MONTHLY, date='2021-02-01')
+        self.assertEqual((rollup.daily, rollup.cumul), (18, 18))
+
+    def test_conditional_download(self):
+        self.write_csv('2021-02-24', '2021-02-25')
+        with open(self.path, 'rb') as file:
+            VaxMalaysiaStubHandler.content = file.read()
+        VaxMalaysiaStubHandler.requests = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), VaxMalaysiaStubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with override_settings(VAX_MALAYSIA_CSV_URL=f'http://127.0.0.1:{server.server_port}/vax_malaysia.csv'):
+            stats = ingest_vax_malaysia()
+            self.assertEqual(stats['rows_written'], 2)
+            self.assertEqual(VaxMalaysiaSource.objects.get().etag, VaxMalaysiaStubHandler.ETAG)
+
+            stats = ingest_vax_malaysia()
+            self.assertEqual(stats, {'rows_read': 0, 'rows_written': 0, 'not_modified': True})
+
+        self.assertEqual(VaxMalaysiaStubHandler.requests, [None, VaxMalaysiaStubHandler.ETAG])
+
+
+class VaxMalaysiaStubHandler(BaseHTTPRequestHandler):
+    """Stub vax_malaysia.csv source answering conditional requests"""
+    ETAG = '"vax-malaysia-1"'
+    content = b''
+    requests = []
+
+    def do_GET(self):
+        etag = self.headers.get('If-None-Match')
+        self.requests.append(etag)
+
+        if etag == self.ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(self.content)))
+        self.send_header('ETag', self.ETAG)
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class HotspotStubHandler(BaseHTTPRequestHandler):
+    """Stub MySj hotspot API, failing the first request to exercise retries"""
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(body[0])
+
+        if len(self.requests) == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        content = json.dumps({'messages': {'en_US': 'There have been 5 reported case(s) of COVID-19 within a 1km radius from your searched location in the last 14 days.'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class HotspotRefreshTests(TestCase):
+    def setUp(self):
+        HotspotStubHandler.requests = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), HotspotStubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f'http://127.0.0.1:{server.server_port}/hotspots'
+
+    def test_update_stale_centers(self):
+        centers = [VaccinationCenter.objects.create(
+            name=f'Center {index}', location=Point(101.6 + index * 0.01, 2.9, srid=4326),
+            state='Selangor', district='District') for index in range(3)]
+        VaccinationCenter.objects.filter(id__in=[centers[0].id, centers[1].id]).update(
+            last_updated_datetime=timezone.now() - datetime.timedelta(days=2))
+
+        with override_settings(HOTSPOT_API_URL=self.url, HOTSPOT_RETRY_BACKOFF=0):
+            update_centers_hotspot_case()
+
+        self.assertEqual(len(HotspotStubHandler.requests), 3)
+        self.assertEqual([VaccinationCenter.objects.get(id=center.id).num_cases for center in centers],
+                         [5, 5, 0])
+
+    def test_update_clustered_centers(self):
+        # About 100m apart, one query for both
+        centers = [VaccinationCenter.objects.create(
+            name=f'Center {index}', location=Point(101.6 + index * 0.0009, 2.9, srid=4326),
+            state='Selangor', district='District') for index in range(2)]
+        VaccinationCenter.objects.update(
+            last_updated_datetime=timezone.now() - datetime.timedelta(days=2))
+
+        with override_settings(HOTSPOT_API_URL=self.url, HOTSPOT_RETRY_BACKOFF=0):
+            update_centers_hotspot_case()
+
+        self.assertEqual(len(HotspotStubHandler.requests), 2)
+        self.assertEqual(HotspotCluster.objects.count(), 1)
+        self.assertEqual([VaccinationCenter.objects.get(id=center.id).num_cases for center in centers],
+                         [5, 5])
+
+        # Clusters are persisted, only moved centers are clustered again
+        self.assertEqual(assign_hotspot_clusters(), 0)
+        centers[1].location = Point(101.7, 2.9, srid=4326)
+        centers[1].save()
+        self.assertEqual(assign_hotspot_clusters(), 1)
+        self.assertEqual(HotspotCluster.objects.count(), 2)
+
+
+class UpdateAppointmentStatusTests(TestCase):
+    @override_settings(APPOINTMENT_SWEEP_BATCH_SIZE=2)
+    def test_sweep_overdue_appointments(self):
+        center = VaccinationCenter.objects.create(
+            name='Center', location=Point(101.6, 2.9, srid=4326), state='Selangor', district='District')
+        now = timezone.now()
+        past_timeslot = VaccinationTimeslot.objects.create(
+            center=center, datetime=now - datetime.timedelta(hours=1))
+        future_timeslot = VaccinationTimeslot.objects.create(
+            center=center, datetime=now + datetime.timedelta(hours=1))
+
+        statuses = [
+            (past_timeslot, Appointment.APPOINTMENT_STATUS_APPROVED),
+            (past_timeslot, Appointment.APPOINTMENT_STATUS_APPROVED),
+            (past_timeslot, Appointment.APPOINTMENT_STATUS_PENDING),
+            (past_timeslot, Appointment.APPOINTMENT_STATUS_ATTENDED),
+            (future_timeslot, Appointment.APPOINTMENT_STATUS_PENDING),
+        ]
+        appointments = []
+        for index, (timeslot, appointment_status) in enumerate(statuses):
+            user = User.objects.create_user(f'sweep{index}@example.com', 'password')
+            appointments.append(Appointment.objects.create(
+                account=Account.objects.get(user=user), timeslot=timeslot,
+                dose_type=Appointment.DOSE_TYPE_FIRST, appointment_status=appointment_status))
+
+        Account.objects.filter(id__in=[appointment.account_id for appointment in appointments]).update(
+            expo_notification_token='ExponentPushToken[sweep]')
+
+        self.assertEqual(update_appointment_status(), {'missed': 2, 'rejected': 1})
+        # Only the rejection is notified
+        notification = PushNotification.objects.get()
+        self.assertEqual(notification.title, 'Appointment REJECTED!')
+        self.assertEqual(json.loads(notification.data)['id'], appointments[2].id)
+        job_run = JobRun.objects.get(name='update_appointment_status')
+        self.assertEqual((job_run.rows_read, job_run.rows_written), (3, 3))
+
+        self.assertEqual([Appointment.objects.get(id=appointment.id).appointment_status for appointment in appointments], [
+            Appointment.APPOINTMENT_STATUS_MISSED, Appointment.APPOINTMENT_STATUS_MISSED,
+            Appointment.APPOINTMENT_STATUS_REJECTED, Appointment.APPOINTMENT_STATUS_ATTENDED,
+            Appointment.APPOINTMENT_STATUS_PENDING])
+        past_timeslot.refresh_from_db()
+        future_timeslot.refresh_from_db()
+        self.assertEqual((past_timeslot.booked, future_timeslot.booked), (1, 1))
+
+
+class LeaderElectionTests(TestCase):
+    def test_single_leader(self):
+        first = LeaderElection(1)
+        second = LeaderElection(1)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+
+        self.assertTrue(first.is_leader())
+        self.assertFalse(second.is_leader())
+        self.assertTrue(first.is_leader())
+
+        # The lock is released with the leader's connection
+        first.close()
+        self.assertTrue(second.is_leader())
+        self.assertFalse(first.is_leader())
+
+    def test_reconnect_after_lost_connection(self):
+        election = LeaderElection(2)
+        self.addCleanup(election.close)
+        self.assertTrue(election.is_leader())
+
+        # The server dropped the idle lock connection, the lock went with it
+        with election.connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [2])
+        election.connection.cursor = mock.Mock(
+            side_effect=OperationalError('server closed the connection unexpectedly'))
+
+        self.assertTrue(election.is_leader())
+        self.assertIsNone(election.error)
+
+
+class JobRunTests(TestCase):
+    def test_record_job_run(self):
+        @record_job_run
+        def job():
+            record_rows(read=10, written=4)
+            for latency in (0.1, 0.2, 0.3, 0.4):
+                record_upstream_request(latency)
+            return 'done'
+
+        @record_job_run
+        def failing_job():
+            raise ValueError('upstream broke')
+
+        self.assertEqual(job(), 'done')
+        with self.assertRaises(ValueError):
+            failing_job()
+
+        job_run = JobRun.objects.get(name='job')
+        self.assertEqual((job_run.rows_read, job_run.rows_written, job_run.upstream_requests), (10, 4, 4))
+        self.assertEqual((job_run.upstream_latency_p50, job_run.upstream_latency_p99), (0.2, 0.4))
+        self.assertEqual(job_run.exception, '')
+        self.assertIsNotNone(job_run.duration)
+        self.assertIn('upstream broke', JobRun.objects.get(name='failing_job').exception)
+
+    @override_settings(JOB_RUN_RETENTION=60 * 60)
+    def test_prune_old_job_runs(self):
+        @record_job_run
+        def job():
+            pass
+
+        JobRun.objects.create(name='job', started_datetime=timezone.now() - datetime.timedelta(hours=2))
+        JobRun.objects.create(name='other_job', started_datetime=timezone.now() - datetime.timedelta(hours=2))
+        job()
+
+        self.assertEqual(JobRun.objects.filter(name='job').count(), 1)
+        self.assertEqual(JobRun.objects.filter(name='other_job').count(), 1)
+
+        user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('admin:api_jobrun_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<polyline')
+
+
+class PushOutboxTests(TestCase):
+    def publish_multiple(self, messages):
+        self.published.append([message.to for message in messages])
+        if any(message.to == 'ExponentPushToken[poison]' for message in messages):
+            raise PushServerError('Request failed', mock.Mock(), errors=[
+                {'code': 'VALIDATION_ERROR', 'message': 'Invalid message'}])
+
+        return [PushTicket(push_message=message, status=PushTicket.ERROR_STATUS, message='Not registered',
+                           details={'error': PushTicket.ERROR_DEVICE_NOT_REGISTERED}, id=None)
+                if message.to == 'ExponentPushToken[dead]' else
+                PushTicket(push_message=message, status=PushTicket.SUCCESS_STATUS, message='',
+                           details=None, id=f'ticket-{message.to}')
+                for message in messages]
+
+    def test_enqueue_after_approved(self):
+        center = VaccinationCenter.objects.create(
+            name='Center', location=Point(101.6, 2.9, srid=4326), state='Selangor', district='District')
+        timeslot = VaccinationTimeslot.objects.create(
+            center=center, datetime=timezone.now() + datetime.timedelta(days=1))
+        user = User.objects.create_user('push@example.com', 'password')
+        Account.objects.filter(user=user).update(
+            expo_notification_token='ExponentPushToken[live]')
+        appointment = Appointment.objects.create(
+            account=Account.objects.get(user=user), timeslot=timeslot, dose_type=Appointment.DOSE_TYPE_FIRST)
+        self.assertEqual(PushNotification.objects.count(), 0)
+
+        with mock.patch('api.utils.push_outbox.PushClient.publish_multiple') as publish_multiple:
+            appointment.appointment_status = Appointment.APPOINTMENT_STATUS_APPROVED
+            appointment.save()
+            publish_multiple.assert_not_called()
+
+        notification = PushNotification.objects.get()
+        self.assertEqual((notification.token, notification.title, notification.status),
+                         ('ExponentPushToken[live]', 'Appointment APPROVED!', PushNotification.STATUS_PENDING))
+
+    @override_settings(PUSH_BATCH_SIZE=2, PUSH_MAX_ATTEMPTS=2)
+    def test_dispatch(self):
+        self.published = []
+        for token in ('live', 'dead', 'poison', 'other'):
+            PushNotification.objects.create(
+                token=f'ExponentPushToken[{token}]', title='Title', body='Body')
+
+        with mock.patch('api.utils.push_outbox.PushClient.publish_multiple', side_effect=self.publish_multiple):
+            self.assertEqual(dispatch_push_notifications(), {'sent': 2, 'retried': 1, 'dead': 1})
+
+        # Batches of two, the rejected batch is sent again one message at a time
+        self.assertEqual(len(self.published), 4)
+        statuses = dict(PushNotification.objects.values_list('token', 'status'))
+        self.assertEqual(statuses, {
+            'ExponentPushToken[live]': PushNotification.STATUS_SENT,
+            'ExponentPushToken[dead]': PushNotification.STATUS_DEAD,
+            'ExponentPushToken[poison]': PushNotification.STATUS_PENDING,
+            'ExponentPushToken[other]': PushNotification.STATUS_SENT,
+        })
+        self.assertEqual(PushNotification.objects.get(token='ExponentPushToken[live]').ticket_id,
+                         'ticket-ExponentPushToken[live]')
+
+        # Retried with backoff, dead-lettered after PUSH_MAX_ATTEMPTS
+        PushNotification.objects.filter(status=PushNotification.STATUS_PENDING).update(
+            next_attempt_datetime=timezone.now())
+        with mock.patch('api.utils.push_outbox.PushClient.publish_multiple', side_effect=self.publish_multiple):
+            self.assertEqual(dispatch_push_notifications(), {'sent': 0, 'retried': 0, 'dead': 1})
+        self.assertIn('Invalid message', PushNotification.objects.get(
+            token='ExponentPushToken[poison]').last_error)
+
+    @override_settings(PUSH_BATCH_SIZE=2)
+    def test_dispatch_rate_limited(self):
+        for token in ('live', 'other', 'poison'):
+            PushNotification.objects.create(
+                token=f'ExponentPushToken[{token}]', title='Title', body='Body')
+
+        error = PushServerError('Request failed', mock.Mock(), errors=[
+            {'code': 'TOO_MANY_REQUESTS', 'message': 'Rate limit exceeded'}])
+        with mock.patch('api.utils.push_outbox.PushClient.publish_multiple', side_effect=error) as publish_multiple:
+            self.assertEqual(dispatch_push_notifications(), {'sent': 0, 'retried': 2, 'dead': 0})
+
+        # The batch is not split and the run ends, the next batch waits for the next run
+        self.assertEqual(publish_multiple.call_count, 1)
+        retried = PushNotification.objects.filter(attempts=1)
+        self.assertEqual(retried.count(), 2)
+        self.assertTrue(all('TOO_MANY_REQUESTS' in notification.last_error for notification in retried))
+        self.assertEqual(PushNotification.objects.filter(attempts=0).count(), 1)
+
+    def test_check_receipts(self):
+        user = User.objects.create_user('receipts@example.com', 'password')
+        Account.objects.filter(user=user).update(
+            expo_notification_token='ExponentPushToken[dead]')
+        sent_datetime = timezone.now() - datetime.timedelta(hours=1)
+        for token, ticket_id in (('live', 'ok'), ('dead', 'not-registered'), ('live', 'not-ready')):
+            PushNotification.objects.create(
+                token=f'ExponentPushToken[{token}]', title='Title', body='Body', status=PushNotification.STATUS_SENT,
+                sent_datetime=sent_datetime, ticket_id=ticket_id)
+        queued = PushNotification.objects.create(
+            token='ExponentPushToken[dead]', title='Title', body='Body')
+
+        receipts = [
+            PushReceipt(id='ok', status=PushReceipt.SUCCESS_STATUS, message='', details=None),
+            PushReceipt(id='not-registered', status=PushReceipt.ERROR_STATUS, message='Not registered',
+                        details={'error': PushReceipt.ERROR_DEVICE_NOT_REGISTERED}),
+        ]
+        with mock.patch('api.utils.push_outbox.PushClient.check_receipts_multiple', return_value=receipts) as check_receipts_multiple:
+            update_push_receipts()
+
+        self.assertEqual(len(check_receipts_multiple.call_args.args[0]), 3)
+        self.assertEqual(Account.objects.get(user=user).expo_notification_token, '')
+        self.assertEqual(PushNotification.objects.get(ticket_id='not-registered').status, PushNotification.STATUS_DEAD)
+        self.assertEqual(PushNotification.objects.get(id=queued.id).status, PushNotification.STATUS_DEAD)
+        self.assertEqual(list(PushNotification.objects.filter(receipt_checked=False, status=PushNotification.STATUS_SENT).values_list(
+            'ticket_id', flat=True)), ['not-ready'])
+
+        job_run = JobRun.objects.get(name='update_push_receipts')
+        self.assertEqual((job_run.rows_read, job_run.rows_written, job_run.upstream_requests), (3, 3, 1))
@@ -1,5 +1,5 @@
 from . import views
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework_nested import routers
 
 router = routers.DefaultRouter()
@@ -15,7 +15,10 @@ centers_router = routers.NestedDefaultRouter(
 centers_router.register(
     'timeslots', views.VaccinationTimeslotViewSet, basename='center-timeslots')
 
-urlpatterns = router.urls + centers_router.urls
+urlpatterns = [re_path(r'^centers/nearby/(?P<latitude>\d+\.\d+),(?P<longitude>\d+\.\d+)/$', views.NearbyCentersView.as_view(),
+                       name='center-nearby')]
+
+urlpatterns += router.urls + centers_router.urls
 
 urlpatterns += [path('auth/jwt/create', views.CustomTokenObtainPairView.as_view(),
                      name='token_obtain_pair'),
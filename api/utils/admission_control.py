@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.models.functions import Least
+from rest_framework.throttling import BaseThrottle
+
+from api.models import AdmissionBucket, VaccinationTimeslot
+
+
+def _get_cache():
+    return caches[settings.ADMISSION_CACHE_ALIAS]
+
+
+def _take_token(bucket, rate, burst, last):
+    """Take a token from a bucket holding up to burst tokens, refilled with rate tokens per second
+
+    Returns None when a token was taken, otherwise the seconds until one is refilled.
+    The bucket row is locked, refilled and drained in one statement, so every worker
+    drains the same bucket. The statement also counts the booking as shed, or as
+    admitted when last is set, i.e. no other bucket is consulted after this one.
+    """
+    if rate is None:
+        return None
+
+    table = connection.ops.quote_name(AdmissionBucket._meta.db_table)
+    with connection.cursor() as cursor:
+        for _ in range(2):
+            cursor.execute(
+                f'WITH bucket AS ('
+                f'SELECT name, LEAST(%s, tokens + %s * EXTRACT(EPOCH FROM statement_timestamp() - refilled_datetime)::float) AS tokens '
+                f'FROM {table} WHERE name = %s FOR UPDATE) '
+                f'UPDATE {table} SET '
+                f'tokens = bucket.tokens - CASE WHEN bucket.tokens >= 1 THEN 1 ELSE 0 END, '
+                f'refilled_datetime = statement_timestamp(), '
+                f'admitted = {table}.admitted + CASE WHEN %s AND bucket.tokens >= 1 THEN 1 ELSE 0 END, '
+                f'shed = {table}.shed + CASE WHEN bucket.tokens < 1 THEN 1 ELSE 0 END '
+                f'FROM bucket WHERE {table}.name = bucket.name RETURNING bucket.tokens',
+                [burst, rate, bucket, last])
+            row = cursor.fetchone()
+            if row is not None:
+                tokens, = row
+                return None if tokens >= 1 else (1 - tokens) / rate
+
+            # First token of a new bucket, raced inserts fall back to the update
+            cursor.execute(
+                f'INSERT INTO {table} (name, tokens, refilled_datetime, admitted, shed) '
+                f'VALUES (%s, %s, statement_timestamp(), %s, 0) ON CONFLICT (name) DO NOTHING',
+                [bucket, burst - 1, int(last)])
+            if cursor.rowcount:
+                return None
+
+
+def _refund_token(bucket, burst):
+    """Put back a token taken from a bucket for a request shed by another bucket"""
+    AdmissionBucket.objects.filter(name=bucket).update(
+        tokens=Least(F('tokens') + 1, burst))
+
+
+def _get_center_id(cache, timeslot_id):
+    """Center of a timeslot, cached since a timeslot never moves to another center"""
+    key = f'admission:timeslot:{timeslot_id}'
+    center_id = cache.get(key)
+
+    if center_id is None:
+        center_id = VaccinationTimeslot.objects.filter(
+            id=timeslot_id).values_list('center_id', flat=True).first()
+        if center_id is not None:
+            cache.set(key, center_id)
+
+    return center_id
+
+
+def admit_booking(timeslot_id):
+    """Take a token from the booking timeslot's center bucket and the global bucket
+
+    The center token is refunded when the global bucket sheds the booking.
+    Returns None when the booking is admitted, otherwise the seconds to wait before retrying.
+    """
+    cache = _get_cache()
+    global_rate = settings.ADMISSION_GLOBAL_RATE
+
+    wait = None
+    center_id = None
+    try:
+        center_id = _get_center_id(cache, int(timeslot_id))
+    except (TypeError, ValueError):
+        # Invalid timeslots only take a global token, the serializer rejects them
+        pass
+
+    if center_id is not None:
+        wait = _take_token(f'center:{center_id}', settings.ADMISSION_CENTER_RATE,
+                           settings.ADMISSION_CENTER_BURST, last=global_rate is None)
+
+    if wait is None:
+        wait = _take_token('global', global_rate,
+                           settings.ADMISSION_GLOBAL_BURST, last=True)
+        if wait is not None and center_id is not None and settings.ADMISSION_CENTER_RATE is not None:
+            _refund_token(f'center:{center_id}', settings.ADMISSION_CENTER_BURST)
+
+    return wait
+
+
+def get_admission_stats():
+    """Return the admitted/shed booking counters of every worker, kept with the buckets"""
+    counters = AdmissionBucket.objects.aggregate(
+        admitted=Sum('admitted'), shed=Sum('shed'))
+
+    return {
+        'admitted': counters['admitted'] or 0,
+        'shed': counters['shed'] or 0,
+    }
+
+
+class BookingAdmissionThrottle(BaseThrottle):
+    """Shed booking requests over the center or global rate with 429 and Retry-After"""
+
+    def allow_request(self, request, view):
+        self.wait_seconds = admit_booking(request.data.get('timeslot'))
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
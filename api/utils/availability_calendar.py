@@ -0,0 +1,62 @@
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.pagination import CursorPagination
+
+from .cache_utils import bump_generation, get_generation
+
+
+class CalendarPagination(CursorPagination):
+    """Keyset pagination over a center's timeslots ordered by datetime"""
+    ordering = ('datetime', 'id')
+
+    def __init__(self):
+        self.page_size = settings.CALENDAR_PAGE_SIZE
+
+
+def group_by_day(timeslots):
+    """Group timeslots ordered by datetime into [{'date', 'slots': [{'id', 'time', 'remaining'}]}] local days"""
+    days = []
+    for timeslot in timeslots:
+        local_datetime = timezone.localtime(timeslot.datetime)
+        date = local_datetime.date().isoformat()
+
+        if not days or days[-1]['date'] != date:
+            days.append({'date': date, 'slots': []})
+
+        days[-1]['slots'].append({
+            'id': timeslot.id,
+            'time': local_datetime.time().isoformat(timespec='minutes'),
+            'remaining': max(timeslot.capacity - timeslot.booked, 0),
+        })
+
+    return days
+
+
+def _get_cache():
+    return caches[settings.CALENDAR_CACHE_ALIAS]
+
+
+def _generation_key(center_id):
+    return f'calendar:{center_id}:generation'
+
+
+def get_calendar_cache_key(center_id, cursor):
+    """Return the calendar page cache key of a center and pagination cursor"""
+    generation = get_generation(_generation_key(center_id))
+    return f'calendar:{center_id}:{generation}:{quote(cursor or "")}'
+
+
+def get_cached_calendar(key):
+    return _get_cache().get(key)
+
+
+def set_cached_calendar(key, calendar):
+    _get_cache().set(key, calendar)
+
+
+def invalidate_center_calendar(center_id):
+    """Invalidate every cached calendar page of a center, e.g. after its timeslots or bookings changed"""
+    bump_generation(_generation_key(center_id))
@@ -0,0 +1,28 @@
+from django.db import connection
+
+from api.models import CacheGeneration
+
+
+def get_generation(key):
+    """Return the generation stored under key, part of the keys of the entries it invalidates
+
+    Generations are kept in the database, so a bump by any process, e.g. the
+    scheduler, reaches every worker whatever the cache backend.
+    """
+    return CacheGeneration.objects.filter(key=key).values_list('generation', flat=True).first() or 0
+
+
+def bump_generation(key):
+    """Start a new generation under key, invalidating every entry keyed with the previous one"""
+    table = connection.ops.quote_name(CacheGeneration._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (key, generation) VALUES (%s, 1) '
+            f'ON CONFLICT (key) DO UPDATE SET generation = {table}.generation + 1', [key])
+
+
+def increment(cache, key, delta=1):
+    """Add delta to a never expiring counter, created at 0"""
+    if delta:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import tempfile
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+
+class ColumnsRenderer(JSONRenderer):
+    """?format=columns, {field: [values]} streamed by ColumnarListMixin, other responses as JSON"""
+    format = 'columns'
+
+
+class CSVRenderer(BaseRenderer):
+    """?format=csv, rows streamed by ColumnarListMixin, other responses (e.g. errors) as CSV too"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return ''
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+        return buffer.getvalue()
+
+
+class _Echo:
+    """File-like object for csv.writer returning each written row instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _spool():
+    return tempfile.SpooledTemporaryFile(max_size=settings.STREAM_SPOOL_MAX_SIZE)
+
+
+def _read_spooled(parts, block_size=64 * 1024):
+    """Yield bytes parts and the contents of spooled files in order, closing the files"""
+    try:
+        for part in parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+
+            part.seek(0)
+            while block := part.read(block_size):
+                yield block
+    finally:
+        for part in parts:
+            if not isinstance(part, bytes):
+                part.close()
+
+
+def spool_csv(rows, fields, chunk_size):
+    """Encode CSV lines of the rows into a spooled file, chunk_size rows at a time
+
+    Returns the parts of the response for _read_spooled.
+    """
+    writer = csv.writer(_Echo())
+    file = _spool()
+    file.write(writer.writerow(fields).encode())
+
+    for chunk in _chunks(rows, chunk_size):
+        file.write(''.join(writer.writerow(row) for row in chunk).encode())
+
+    return [file]
+
+
+def spool_columns(rows, fields, chunk_size):
+    """Encode a {field: [values]} JSON object of the rows in one pass, each column into its own spooled file
+
+    Returns the parts of the response for _read_spooled.
+    """
+    columns = [_spool() for _ in fields]
+
+    for chunk_index, chunk in enumerate(_chunks(rows, chunk_size)):
+        separator = ', ' if chunk_index else ''
+        for index, column in enumerate(columns):
+            column.write((separator + ', '.join(
+                json.dumps(row[index], cls=DjangoJSONEncoder) for row in chunk)).encode())
+
+    parts = [b'{']
+    for index, (field, column) in enumerate(zip(fields, columns)):
+        parts += [f'{", " if index else ""}{json.dumps(field)}: ['.encode(), column, b']']
+    parts.append(b'}')
+
+    return parts
+
+
+class ColumnarListMixin:
+    """Stream list responses as columns or CSV from one values_list query, skipping the serializer
+
+    The streamed fields are the serializer's Meta.fields, which must all be model fields.
+    """
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + \
+        [ColumnsRenderer, CSVRenderer]
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, (ColumnsRenderer, CSVRenderer)):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        fields = list(self.get_serializer_class().Meta.fields)
+        spool = spool_columns if isinstance(renderer, ColumnsRenderer) else spool_csv
+
+        # One server-side cursor pass in the view, so every column comes from the same
+        # snapshot and the ORM never runs in the response iterator, which is iterated
+        # on the event loop under ASGI. Encoded output past STREAM_SPOOL_MAX_SIZE bytes
+        # is spooled to disk rather than held in memory
+        parts = spool(queryset.values_list(*fields).iterator(chunk_size=settings.STREAM_CHUNK_SIZE),
+                      fields, settings.STREAM_CHUNK_SIZE)
+
+        return StreamingHttpResponse(
+            _read_spooled(parts),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
@@ -0,0 +1,37 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+
+
+class ConditionalGetMixin:
+    """Answer list/retrieve requests with 304 Not Modified when the client's ETag still matches
+
+    Views implement get_etag_validator() returning a cheap value, e.g. from a MAX/COUNT
+    aggregate, which changes whenever the serialized response would change.
+    """
+
+    def get_etag_validator(self):
+        raise NotImplementedError
+
+    def _get_etag(self, request):
+        validator = repr((request.get_full_path(), self.get_etag_validator()))
+        return quote_etag(hashlib.md5(validator.encode()).hexdigest())
+
+    def _conditional_response(self, render, request, *args, **kwargs):
+        etag = self._get_etag(request)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = render(request, *args, **kwargs)
+
+        response['ETag'] = etag
+        # Clients always revalidate, responses are per user
+        patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.geos import MultiPoint, Point
+from django.db.models import Count, Max
+
+from api.models import VaccinationCenter
+from .vertex_index import VertexIndex
+
+
+class STRtree:
+    """Sort-Tile-Recursive packed R-tree over (envelope, item) pairs for point queries"""
+
+    def __init__(self, entries, node_capacity=10):
+        """entries is a list of ((xmin, ymin, xmax, ymax), item)"""
+        self.node_capacity = node_capacity
+        level = [(envelope, item, None) for envelope, item in entries]
+
+        while len(level) > node_capacity:
+            level = self._pack(level)
+        self.root = level
+
+    def _pack(self, nodes):
+        capacity = self.node_capacity
+        num_slices = math.ceil(math.sqrt(math.ceil(len(nodes) / capacity)))
+        slice_size = num_slices * capacity
+
+        parents = []
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+        for start in range(0, len(nodes), slice_size):
+            column = sorted(nodes[start:start + slice_size],
+                            key=lambda node: node[0][1] + node[0][3])
+            for offset in range(0, len(column), capacity):
+                children = column[offset:offset + capacity]
+                envelope = (min(child[0][0] for child in children), min(child[0][1] for child in children),
+                            max(child[0][2] for child in children), max(child[0][3] for child in children))
+                parents.append((envelope, None, children))
+
+        return parents
+
+    def query(self, x, y):
+        """Return the items whose envelope contains the point"""
+        items = []
+        stack = [self.root]
+        while stack:
+            for (xmin, ymin, xmax, ymax), item, children in stack.pop():
+                if not (xmin <= x <= xmax and ymin <= y <= ymax):
+                    continue
+                if children is None:
+                    items.append(item)
+                else:
+                    stack.append(children)
+
+        return items
+
+
+class DistrictIndex:
+    """Resolve a point to a district using the buffered convex hulls of each district's centers"""
+
+    def __init__(self, centers, hull_buffer, cell_size):
+        """centers is a list of (district, x, y)"""
+        self.districts = [district for district, _, _ in centers]
+
+        points_by_district = {}
+        for district, x, y in centers:
+            points_by_district.setdefault(district, []).append((x, y))
+
+        entries = []
+        self.hulls = []
+        for district, points in points_by_district.items():
+            hull = MultiPoint([Point(point) for point in points]).convex_hull.buffer(hull_buffer)
+            entries.append((hull.extent, (district, len(self.hulls))))
+            self.hulls.append(hull)
+        self.tree = STRtree(entries)
+        # GEOS prepared geometries build their index lazily and are not thread-safe
+        self.local = threading.local()
+
+        # Nearest center decides for points outside every hull or inside overlapping hulls
+        self.centers = VertexIndex(
+            ((index, x, y) for index, (_, x, y) in enumerate(centers)), cell_size)
+        self.points_by_district = points_by_district
+
+    def _get_prepared_hulls(self):
+        """Prepared hulls of the calling thread"""
+        prepared_hulls = getattr(self.local, 'prepared_hulls', None)
+        if prepared_hulls is None:
+            prepared_hulls = self.local.prepared_hulls = [
+                hull.prepared for hull in self.hulls]
+        return prepared_hulls
+
+    def get_district(self, x, y):
+        point = Point(x, y)
+        prepared_hulls = self._get_prepared_hulls()
+        candidates = [district for district, hull_index in self.tree.query(x, y)
+                      if prepared_hulls[hull_index].contains(point)]
+
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if len(candidates) > 1:
+            scale = math.cos(math.radians(y))
+            return min(candidates, key=lambda district: min(
+                ((px - x) * scale) ** 2 + (py - y) ** 2 for px, py in self.points_by_district[district]))
+
+        index, _, _ = self.centers.nearest(x, y)
+        return self.districts[index]
+
+
+def _get_signature():
+    return VaccinationCenter.objects.filter(location__isnull=False).aggregate(
+        count=Count('id'), last_updated=Max('last_updated_datetime'))
+
+
+_district_index = None
+_district_index_signature = None
+_district_index_checked = 0
+
+
+def get_district_index():
+    """Return the process-wide district index, rebuilt when the centers table changed
+
+    Other processes' changes are noticed within DISTRICT_INDEX_MAX_AGE seconds.
+    """
+    global _district_index, _district_index_signature, _district_index_checked
+
+    now = time.monotonic()
+    if _district_index is not None and now - _district_index_checked < settings.DISTRICT_INDEX_MAX_AGE:
+        return _district_index
+
+    if _district_index is None or _get_signature() != _district_index_signature:
+        rows = VaccinationCenter.objects.filter(location__isnull=False).values_list(
+            'district', 'location', 'last_updated_datetime')
+        centers = [(district, location.x, location.y)
+                   for district, location, _ in rows]
+
+        _district_index = DistrictIndex(
+            centers, settings.DISTRICT_INDEX_HULL_BUFFER, settings.DISTRICT_INDEX_CELL_SIZE) if centers else None
+        _district_index_signature = {
+            'count': len(rows),
+            'last_updated': max((last_updated for _, _, last_updated in rows), default=None),
+        }
+
+    _district_index_checked = now
+
+    return _district_index
+
+
+def invalidate_district_index():
+    """Rebuild the district index of this process on next use"""
+    global _district_index
+
+    _district_index = None
+
+
+def get_district(longitude, latitude):
+    """Function for resolving a coordinate to its district, None when there is no center"""
+    district_index = get_district_index()
+
+    if district_index is None:
+        return None
+
+    return district_index.get_district(longitude, latitude)
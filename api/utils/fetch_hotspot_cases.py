@@ -0,0 +1,73 @@
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .get_nearby_hotspot_cases import get_nearby_hotspot_cases
+from .job_runs import record_upstream_request
+
+
+class RateLimiter:
+    """Space out calls shared by many threads to at most rate per second"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _fetch_with_retries(session, rate_limiter, lat, lng):
+    for attempt in range(settings.HOTSPOT_MAX_RETRIES + 1):
+        rate_limiter.wait()
+        start = time.perf_counter()
+        try:
+            return get_nearby_hotspot_cases(lat, lng, session=session)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            error = e
+        finally:
+            record_upstream_request(time.perf_counter() - start)
+
+        if attempt == settings.HOTSPOT_MAX_RETRIES:
+            print(f"Failed to fetch hotspot cases at ({lat}, {lng}): {error}")
+            return None
+
+        # Exponential backoff with full jitter
+        time.sleep(random.uniform(
+            0, settings.HOTSPOT_RETRY_BACKOFF * 2 ** attempt))
+
+
+def fetch_hotspot_cases(coordinates):
+    """Fetch hotspot cases of {key: (lat, lng)} concurrently over pooled connections
+
+    Returns {key: num_cases}, None for coordinates still failing after HOTSPOT_MAX_RETRIES.
+    """
+    concurrency = settings.HOTSPOT_CONCURRENCY
+    # The hotspot API is a single host, rate limited as a whole
+    rate_limiter = RateLimiter(settings.HOTSPOT_RATE_LIMIT)
+
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount(f'{urlparse(settings.HOTSPOT_API_URL).scheme}://', adapter)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Each task runs in a copy of this context to record into the running JobRun
+            futures = {key: executor.submit(contextvars.copy_context().run, _fetch_with_retries,
+                                            session, rate_limiter, lat, lng)
+                       for key, (lat, lng) in coordinates.items()}
+
+            return {key: future.result() for key, future in futures.items()}
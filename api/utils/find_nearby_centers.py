@@ -0,0 +1,84 @@
+import math
+
+from django.conf import settings
+
+from api.models import VaccinationCenter
+from .format_path import PATH_FORMAT_NONE, format_path
+from .get_shortest_paths import ROUTING_ENGINE_PGROUTING_BBOX
+from .route_cache import get_cached_shortest_paths
+
+
+def get_district_centers(district):
+    """Find all centers which are same district as user's location grouped by OSM vertex id, centers may share a vertex"""
+    centers_by_gid = {}
+    for center in VaccinationCenter.objects.filter(district=district).filter(gid__gte=0):
+        centers_by_gid.setdefault(center.gid, []).append(center)
+
+    return centers_by_gid
+
+
+def _center_result(center, distance, path, path_format):
+    result = {
+        'id': center.id,
+        'distance': round(distance, 3),
+        'cases': center.num_cases,
+        'name': center.name,
+        'district': center.district,
+        'state': center.state,
+        'lat': round(center.location.coords[1], 5),
+        'lng': round(center.location.coords[0], 5),
+    }
+    if path_format != PATH_FORMAT_NONE:
+        result['path'] = path
+
+    return result
+
+
+def find_nearby_centers(user_gid, vertex_x, vertex_y, centers_by_gid, path_format, tolerance):
+    """Find nearby vaccination center list with paths sorted by shortest path distance from user's OSM vertex"""
+    bounds = None
+    if centers_by_gid and ROUTING_ENGINE_PGROUTING_BBOX in (settings.ROUTING_ENGINE, settings.ROUTING_PRECOMPUTED_FALLBACK):
+        # Bounding box of user's vertex and the district's centers for the bounded subgraph
+        xs = [vertex_x] + [center.location.x for centers in centers_by_gid.values()
+                           for center in centers]
+        ys = [vertex_y] + [center.location.y for centers in centers_by_gid.values()
+                           for center in centers]
+        bounds = (min(xs), min(ys), max(xs), max(ys))
+
+    rows = get_cached_shortest_paths(user_gid, centers_by_gid.keys(), bounds)
+
+    # Post-processing json data for client's response
+    results = []
+    for row in rows:
+        path = None
+        if path_format != PATH_FORMAT_NONE:
+            path = format_path(row['coords'], path_format, tolerance)
+
+        for center in centers_by_gid[row['gid']]:
+            results.append(_center_result(
+                center, row['agg_cost'], path, path_format))
+
+    return results
+
+
+def rank_by_straight_line(longitude, latitude, centers_by_gid, path_format, tolerance):
+    """Degraded nearby center list sorted by straight-line (haversine) distance in km, paths are straight lines"""
+    results = []
+    for centers in centers_by_gid.values():
+        for center in centers:
+            center_lng, center_lat = center.location.coords
+            delta_lat = math.radians(center_lat - latitude)
+            delta_lng = math.radians(center_lng - longitude)
+            a = math.sin(delta_lat / 2) ** 2 + math.cos(math.radians(latitude)) * \
+                math.cos(math.radians(center_lat)) * math.sin(delta_lng / 2) ** 2
+            distance = 6371.0088 * 2 * math.asin(math.sqrt(a))
+
+            path = None
+            if path_format != PATH_FORMAT_NONE:
+                path = format_path(
+                    ((longitude, latitude), (center_lng, center_lat)), path_format, tolerance)
+
+            results.append(_center_result(
+                center, distance, path, path_format))
+
+    return sorted(results, key=lambda result: result['distance'])
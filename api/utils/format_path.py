@@ -0,0 +1,64 @@
+from django.contrib.gis.geos import LineString, MultiLineString
+
+PATH_FORMAT_COORDS = 'coords'
+PATH_FORMAT_POLYLINE = 'polyline'
+PATH_FORMAT_NONE = 'none'
+PATH_FORMATS = [PATH_FORMAT_COORDS, PATH_FORMAT_POLYLINE, PATH_FORMAT_NONE]
+
+
+def encode_polyline(coords, precision=5):
+    """Encode (lng, lat) coordinates with Google's encoded polyline algorithm"""
+    factor = 10 ** precision
+    result = []
+    previous_lat = previous_lng = 0
+
+    for lng, lat in coords:
+        lat = round(lat * factor)
+        lng = round(lng * factor)
+
+        for delta in (lat - previous_lat, lng - previous_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+
+        previous_lat, previous_lng = lat, lng
+
+    return ''.join(result)
+
+
+def _is_multi(coords):
+    return bool(coords) and isinstance(coords[0][0], (list, tuple))
+
+
+def simplify_coords(coords, tolerance):
+    """Simplify path coordinates with a tolerance in degrees (Douglas-Peucker, same as ST_SimplifyPreserveTopology)"""
+    if _is_multi(coords):
+        geom = MultiLineString(*[LineString(part) for part in coords if len(part) > 1])
+    elif len(coords) > 1:
+        geom = LineString(coords)
+    else:
+        return coords
+
+    return geom.simplify(tolerance, preserve_topology=True).coords
+
+
+def format_path(coords, path_format=PATH_FORMAT_COORDS, tolerance=None):
+    """Format path coordinates for client's response
+
+    Returns the coordinates, an encoded polyline (a list of them for a
+    multi-part path) or None.
+    """
+    if path_format == PATH_FORMAT_NONE:
+        return None
+
+    if tolerance:
+        coords = simplify_coords(coords, tolerance)
+
+    if path_format == PATH_FORMAT_POLYLINE:
+        if _is_multi(coords):
+            return [encode_polyline(part) for part in coords]
+        return encode_polyline(coords)
+
+    return coords
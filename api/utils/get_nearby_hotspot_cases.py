@@ -1,10 +1,11 @@
 import json
 import re
 import requests
+from django.conf import settings
 
 
-def get_nearby_hotspot_cases(lat, lng):
-    """Function for performing HTTP request to MySj hotspot API"""
+def get_nearby_hotspot_cases(lat, lng, session=requests):
+    """Function for performing HTTP request to MySj hotspot API, pass a requests.Session to reuse connections"""
     body = [{
         "lat": lat,
         "lng": lng,
@@ -16,11 +17,13 @@ def get_nearby_hotspot_cases(lat, lng):
     params = (('type', 'search'),)
 
     # POST request to MySj hotspot API
-    response = requests.post(
-        'https://mysejahtera.malaysia.gov.my/register/api/nearby/hotspots',
+    response = session.post(
+        settings.HOTSPOT_API_URL,
         headers=headers,
         json=body,
-        params=params)
+        params=params,
+        timeout=settings.HOTSPOT_TIMEOUT)
+    response.raise_for_status()
 
     # Retrieve msg from response
     data = json.loads(response.text)
@@ -32,4 +35,4 @@ def get_nearby_hotspot_cases(lat, lng):
     if(result == None):
         return 0
 
-    return result.group(1)
+    return int(result.group(1))
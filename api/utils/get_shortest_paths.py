@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from api.models import CenterDistanceField
+from .road_graph import get_road_graph
+
+ROUTING_ENGINE_PGROUTING = 'pgrouting'
+ROUTING_ENGINE_PGROUTING_BBOX = 'pgrouting_bbox'
+ROUTING_ENGINE_INPROCESS = 'inprocess'
+ROUTING_ENGINE_PRECOMPUTED = 'precomputed'
+
+EDGES_SQL = 'SELECT id, source, target, cost FROM osm2_2po_4pgr'
+
+
+def dictfetchall(cursor):
+    """Return all rows from a cursor as a dict"""
+    columns = [col[0] for col in cursor.description]
+    return [
+        dict(zip(columns, row))
+        for row in cursor.fetchall()
+    ]
+
+
+@contextmanager
+def _routing_cursor(using):
+    """Cursor whose queries are cancelled after ROUTING_STATEMENT_TIMEOUT milliseconds"""
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # Only lasts until the end of the transaction
+        cursor.execute('SET LOCAL statement_timeout = %s', [
+                       settings.ROUTING_STATEMENT_TIMEOUT])
+        yield cursor
+
+
+def get_shortest_paths(user_gid, center_gids, bounds=None, engine=None):
+    """Function for finding shortest paths from user's OSM vertex to each center's OSM vertex
+
+    Returns a list of {'gid', 'agg_cost', 'path_geom'} rows sorted by agg_cost,
+    unreachable centers are left out. bounds is the (xmin, ymin, xmax, ymax) extent
+    of the user's vertex and the centers, used by the bounded subgraph engine.
+    """
+    engine = engine or settings.ROUTING_ENGINE
+
+    if engine == ROUTING_ENGINE_PRECOMPUTED:
+        return _precomputed_shortest_paths(user_gid, center_gids, bounds)
+
+    if engine == ROUTING_ENGINE_INPROCESS:
+        return _inprocess_shortest_paths(user_gid, center_gids)
+
+    if engine == ROUTING_ENGINE_PGROUTING_BBOX and bounds is not None:
+        return _bounded_pgrouting_shortest_paths(user_gid, center_gids, bounds)
+
+    return _pgrouting_shortest_paths(user_gid, center_gids)
+
+
+def _bounded_pgrouting_shortest_paths(user_gid, center_gids, bounds):
+    """Run pgr_dijkstra on the edges inside a buffered bounding box, retry unreachable centers with a larger box"""
+    xmin, ymin, xmax, ymax = (float(value) for value in bounds)
+    buffer = float(settings.ROUTING_BBOX_BUFFER)
+    remaining = set(center_gids)
+    rows = []
+
+    for _ in range(settings.ROUTING_BBOX_MAX_ATTEMPTS):
+        # Uses the GiST index on geom_way (see init_osm_indexes command)
+        edges_sql = f'''{EDGES_SQL} WHERE geom_way && ST_MakeEnvelope(
+            {xmin - buffer}, {ymin - buffer}, {xmax + buffer}, {ymax + buffer}, 4326)'''
+
+        found = _pgrouting_shortest_paths(user_gid, remaining, edges_sql)
+        rows += found
+        remaining -= {row['gid'] for row in found}
+
+        if not remaining:
+            break
+
+        buffer *= settings.ROUTING_BBOX_GROWTH
+
+    return sorted(rows, key=lambda row: row['agg_cost'])
+
+
+def _pgrouting_shortest_paths(user_gid, center_gids, edges_sql=EDGES_SQL):
+    """Run pgr_dijkstra inside the OSM database"""
+    with _routing_cursor('osm') as cursor:
+        cursor.execute('''
+        WITH result AS (
+            SELECT seq,
+                '(' || start_vid || ',' || end_vid || ')' AS path_name,
+                path_seq, start_vid, end_vid, node, edge, cost,
+                lead(agg_cost) over() AS agg_cost
+            FROM pgr_dijkstra(%s,
+                %s,
+                %s,
+                directed := FALSE)),
+
+            with_geom AS
+                (SELECT seq, result.path_name, CASE
+                    WHEN result.node = osm2_2po_4pgr.source
+                        THEN osm2_2po_4pgr.geom_way
+                    ELSE ST_Reverse(osm2_2po_4pgr.geom_way)
+                    END AS path_geom
+                FROM osm2_2po_4pgr
+                    JOIN result ON osm2_2po_4pgr.id = result.edge),
+
+            one_geom AS
+                (SELECT path_name, ST_LineMerge(ST_Union(path_geom)) AS path_geom
+                    FROM with_geom GROUP BY path_name ORDER BY path_name),
+
+            aggregates AS
+                (SELECT path_name, start_vid, end_vid, SUM(cost) AS agg_cost
+                    FROM result GROUP BY path_name, start_vid, end_vid
+                    ORDER BY start_vid, end_vid)
+
+        SELECT end_vid AS gid, agg_cost, path_geom
+            FROM aggregates JOIN one_geom USING (path_name) ORDER BY agg_cost''',
+                       [edges_sql, [user_gid], list(center_gids)])
+
+        return dictfetchall(cursor)
+
+
+def _precomputed_shortest_paths(user_gid, center_gids, bounds):
+    """Look up user's vertex in the center distance fields, centers without a field fall back to live routing"""
+    table = CenterDistanceField._meta.db_table
+
+    with _routing_cursor('default') as cursor:
+        # Follow the predecessor chain from user's vertex back to each center's root vertex
+        cursor.execute(f'''
+        WITH RECURSIVE walk AS (
+            SELECT root, vertex, predecessor, edge, cost, 0 AS seq
+                FROM {table} WHERE vertex = %s AND root = ANY(%s)
+            UNION ALL
+            SELECT field.root, field.vertex, field.predecessor, field.edge, walk.cost, walk.seq + 1
+                FROM {table} field
+                    JOIN walk ON field.root = walk.root AND field.vertex = walk.predecessor)
+
+        SELECT root, cost, vertex AS node, edge
+            FROM walk WHERE edge IS NOT NULL ORDER BY root, seq''',
+                       [user_gid, list(center_gids)])
+
+        paths = {}
+        for root, cost, node, edge in cursor.fetchall():
+            paths.setdefault(root, (cost, []))[1].append((node, edge))
+
+    rows = _with_path_geometries(paths)
+
+    missing = set(center_gids) - set(paths) - {user_gid}
+    if missing:
+        rows += get_shortest_paths(user_gid, missing, bounds,
+                                   engine=settings.ROUTING_PRECOMPUTED_FALLBACK)
+
+    return sorted(rows, key=lambda row: row['agg_cost'])
+
+
+def _inprocess_shortest_paths(user_gid, center_gids):
+    """Run Dijkstra on the shared road graph snapshot, only path geometries are read from the OSM database"""
+    graph = get_road_graph(settings.ROUTING_GRAPH_SNAPSHOT)
+    paths = graph.shortest_paths(user_gid, list(center_gids))
+
+    return sorted(_with_path_geometries(paths), key=lambda row: row['agg_cost'])
+
+
+def _with_path_geometries(paths):
+    """Build result rows from {gid: (agg_cost, [(node, edge), ...])} with merged path geometry from the OSM database"""
+    end_vids, seqs, nodes, edges = [], [], [], []
+    for gid, (_, steps) in paths.items():
+        for seq, (node, edge) in enumerate(steps):
+            end_vids.append(gid)
+            seqs.append(seq)
+            nodes.append(node)
+            edges.append(edge)
+
+    geoms = {}
+    if edges:
+        with _routing_cursor('osm') as cursor:
+            cursor.execute('''
+            WITH result AS (
+                SELECT * FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[])
+                    AS t(end_vid, seq, node, edge)),
+
+                with_geom AS
+                    (SELECT seq, result.end_vid, CASE
+                        WHEN result.node = osm2_2po_4pgr.source
+                            THEN osm2_2po_4pgr.geom_way
+                        ELSE ST_Reverse(osm2_2po_4pgr.geom_way)
+                        END AS path_geom
+                    FROM osm2_2po_4pgr
+                        JOIN result ON osm2_2po_4pgr.id = result.edge)
+
+            SELECT end_vid AS gid, ST_LineMerge(ST_Union(path_geom)) AS path_geom
+                FROM with_geom GROUP BY end_vid''',
+                           [end_vids, seqs, nodes, edges])
+
+            geoms = {row['gid']: row['path_geom']
+                     for row in dictfetchall(cursor)}
+
+    return [{'gid': gid, 'agg_cost': agg_cost, 'path_geom': geoms[gid]}
+            for gid, (agg_cost, _) in paths.items() if gid in geoms]
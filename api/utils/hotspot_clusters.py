@@ -0,0 +1,87 @@
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import transaction
+
+from api.models import HotspotCluster, VaccinationCenter
+
+EARTH_RADIUS = 6371008.8
+
+
+def _project(lng, lat):
+    """Equirectangular projection to metres, accurate over a cluster radius"""
+    return (EARTH_RADIUS * math.radians(lng) * math.cos(math.radians(lat)),
+            EARTH_RADIUS * math.radians(lat))
+
+
+class _ClusterGrid:
+    """Grid of cluster representatives with cells of radius metres, for leader clustering"""
+
+    def __init__(self, radius):
+        self.radius = radius
+        self.cell_size = max(radius, 1)
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, cluster):
+        x, y = _project(*cluster.location.coords)
+        self.cells.setdefault(self._cell(x, y), []).append((x, y, cluster))
+
+    def nearest(self, lng, lat):
+        """Return the nearest cluster within radius, None when there is none"""
+        x, y = _project(lng, lat)
+        column, row = self._cell(x, y)
+
+        best = None
+        best_distance = self.radius
+        for cell in ((column + i, row + j) for i in (-1, 0, 1) for j in (-1, 0, 1)):
+            for cluster_x, cluster_y, cluster in self.cells.get(cell, ()):
+                distance = math.hypot(cluster_x - x, cluster_y - y)
+                if distance <= best_distance:
+                    best = cluster
+                    best_distance = distance
+
+        return best
+
+
+@transaction.atomic
+def assign_hotspot_clusters():
+    """Assign every located center without a cluster to the nearest cluster within HOTSPOT_CLUSTER_RADIUS
+
+    Centers further than the radius from every cluster lead a new cluster at their
+    location. Clusters of another radius are dropped first, so changing the setting
+    reclusters every center. Returns the number of newly assigned centers.
+    """
+    radius = settings.HOTSPOT_CLUSTER_RADIUS
+    HotspotCluster.objects.exclude(radius=radius).delete()
+
+    grid = _ClusterGrid(radius)
+    for cluster in HotspotCluster.objects.all():
+        grid.add(cluster)
+
+    centers = list(VaccinationCenter.objects.filter(
+        hotspot_cluster__isnull=True, location__isnull=False).only('id', 'location').order_by('id'))
+
+    new_clusters = []
+    for center in centers:
+        cluster = grid.nearest(*center.location.coords)
+        if cluster is None:
+            cluster = HotspotCluster(location=Point(
+                center.location.coords, srid=4326), radius=radius)
+            grid.add(cluster)
+            new_clusters.append(cluster)
+        center.hotspot_cluster = cluster
+
+    HotspotCluster.objects.bulk_create(new_clusters)
+    # Assign the created clusters' ids to the centers
+    for center in centers:
+        center.hotspot_cluster = center.hotspot_cluster
+
+    VaccinationCenter.objects.bulk_update(
+        centers, ['hotspot_cluster'], batch_size=1000)
+    HotspotCluster.objects.filter(vaccinationcenter__isnull=True).delete()
+
+    return len(centers)
@@ -0,0 +1,155 @@
+import csv
+import datetime
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import VaxMalaysia, VaxMalaysiaRollup, VaxMalaysiaSource
+from .job_runs import record_upstream_request
+
+# PostgreSQL date_trunc unit of each rollup granularity
+ROLLUP_UNITS = {
+    VaxMalaysiaRollup.GRANULARITY_WEEKLY: 'week',
+    VaxMalaysiaRollup.GRANULARITY_MONTHLY: 'month',
+}
+
+# Primary key of the VaxMalaysiaSource row
+VAX_MALAYSIA_SOURCE_ID = 1
+
+
+@contextmanager
+def _open_source(url, conditional):
+    """Yield the source's lines, None when the upstream file did not change since the last download
+
+    url is an http(s) URL or a local file path (file:// URLs included).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https'):
+        path = parsed.path if parsed.scheme == 'file' else url
+        with open(path, encoding='utf-8', newline='') as file:
+            yield file
+        return
+
+    # Validators of the last downloaded file, sent back as conditional request headers.
+    # Kept in the database so every worker and the scheduler share them
+    headers = {}
+    source = VaxMalaysiaSource.objects.filter(
+        id=VAX_MALAYSIA_SOURCE_ID).first() if conditional else None
+    if source is not None and source.etag:
+        headers['If-None-Match'] = source.etag
+    if source is not None and source.last_modified:
+        headers['If-Modified-Since'] = source.last_modified
+
+    start = time.perf_counter()
+    with requests.get(url, headers=headers, stream=True, timeout=settings.VAX_MALAYSIA_TIMEOUT) as response:
+        # Time to the response headers, the body is streamed while ingesting
+        record_upstream_request(time.perf_counter() - start)
+        if response.status_code == requests.codes.not_modified:
+            yield None
+            return
+
+        response.raise_for_status()
+        yield (line.decode('utf-8') for line in response.iter_lines())
+
+        # Only remember the validators once the whole file was ingested
+        VaxMalaysiaSource.objects.update_or_create(id=VAX_MALAYSIA_SOURCE_ID, defaults={
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', '')})
+
+
+def _upsert(rows):
+    """INSERT ... ON CONFLICT (date) DO UPDATE a batch of rows, one statement per batch"""
+    fields = VaxMalaysia._meta.concrete_fields
+    quote_name = connection.ops.quote_name
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    updates = ', '.join(f'{quote_name(field.column)} = EXCLUDED.{quote_name(field.column)}'
+                        for field in fields if not field.primary_key)
+    values = ', '.join(
+        ['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(rows))
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote_name(VaxMalaysia._meta.db_table)} ({columns}) VALUES {values} '
+            f'ON CONFLICT ({quote_name(VaxMalaysia._meta.pk.column)}) DO UPDATE SET {updates}',
+            [row[field.attname] for row in rows for field in fields])
+
+
+def update_vax_malaysia_rollups(since=None):
+    """Recompute the weekly/monthly rollups of every period from the one containing since (all when None)"""
+    quote_name = connection.ops.quote_name
+    daily_columns = ['daily_partial', 'daily_full', 'daily_booster', 'daily']
+    cumul_columns = ['cumul_partial', 'cumul_full', 'cumul_booster', 'cumul']
+    columns = daily_columns + cumul_columns
+    aggregates = [f'SUM({column})' for column in daily_columns] + \
+        [f'MAX({column})' for column in cumul_columns]
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+
+    with connection.cursor() as cursor:
+        for granularity, unit in ROLLUP_UNITS.items():
+            cursor.execute(
+                f'INSERT INTO {quote_name(VaxMalaysiaRollup._meta.db_table)} (granularity, date, {", ".join(columns)}) '
+                f'SELECT %s, date_trunc(%s, date)::date AS period, {", ".join(aggregates)} '
+                f'FROM {quote_name(VaxMalaysia._meta.db_table)} '
+                f'WHERE %s::date IS NULL OR date >= date_trunc(%s, %s::date) '
+                f'GROUP BY period '
+                f'ON CONFLICT (granularity, date) DO UPDATE SET {updates}',
+                [granularity, unit, since, unit, since])
+
+
+def ingest_vax_malaysia(full_resync=False):
+    """Stream the vax_malaysia.csv source into VaxMalaysia, upserting rows in batches
+
+    Only dates after the stored MAX(date) are written unless full_resync is set, then
+    the rollups of the written periods are recomputed.
+    Returns {'rows_read', 'rows_written', 'not_modified'}.
+    """
+    stats = {'rows_read': 0, 'rows_written': 0, 'not_modified': False}
+
+    last_date = None
+    if not full_resync:
+        last_date = VaxMalaysia.objects.aggregate(
+            last_date=Max('date'))['last_date']
+
+    field_names = [field.attname for field in VaxMalaysia._meta.concrete_fields
+                   if field.attname != 'last_updated_datetime']
+    now = timezone.now()
+
+    with _open_source(settings.VAX_MALAYSIA_CSV_URL, conditional=not full_resync) as lines:
+        if lines is None:
+            stats['not_modified'] = True
+            return stats
+
+        batch = []
+        first_date = None
+        with transaction.atomic():
+            for record in csv.DictReader(lines):
+                stats['rows_read'] += 1
+                date = datetime.date.fromisoformat(record['date'])
+                if last_date is not None and date <= last_date:
+                    continue
+
+                if first_date is None or date < first_date:
+                    first_date = date
+                row = {name: date if name == 'date' else int(record[name])
+                       for name in field_names}
+                row['last_updated_datetime'] = now
+                batch.append(row)
+                if len(batch) >= settings.VAX_MALAYSIA_BATCH_SIZE:
+                    _upsert(batch)
+                    stats['rows_written'] += len(batch)
+                    batch = []
+
+            if batch:
+                _upsert(batch)
+                stats['rows_written'] += len(batch)
+
+            if first_date is not None:
+                update_vax_malaysia_rollups(since=first_date)
+
+    return stats
@@ -0,0 +1,87 @@
+import contextvars
+import datetime
+import functools
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.models import JobRun
+
+_current_run = contextvars.ContextVar('current_job_run', default=None)
+
+
+class _RunStats:
+    """Counters of the running job, shared with threads started through copy_context()"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_written = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+
+def record_rows(read=0, written=0):
+    """Add to the rows read/written of the running job, no-op outside record_job_run"""
+    stats = _current_run.get()
+    if stats is not None:
+        with stats.lock:
+            stats.rows_read += read
+            stats.rows_written += written
+
+
+def record_upstream_request(seconds):
+    """Record an upstream request's latency for the running job, no-op outside record_job_run"""
+    stats = _current_run.get()
+    if stats is not None:
+        with stats.lock:
+            stats.latencies.append(seconds)
+
+
+def _percentile(values, percentile):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, -(-len(values) * percentile // 100) - 1)]
+
+
+def record_job_run(job):
+    """Decorator recording every run of a scheduled job as a JobRun
+
+    The run is saved when it starts and completed with its duration, counters and
+    exception, if any, when it ends. Runs of the job older than JOB_RUN_RETENTION
+    seconds are deleted then.
+    """
+    @functools.wraps(job)
+    def wrapper(*args, **kwargs):
+        run = JobRun.objects.create(
+            name=job.__name__, started_datetime=timezone.now())
+        stats = _RunStats()
+        token = _current_run.set(stats)
+        start = time.perf_counter()
+
+        try:
+            return job(*args, **kwargs)
+        except Exception:
+            run.exception = traceback.format_exc()
+            raise
+        finally:
+            _current_run.reset(token)
+            latencies = sorted(stats.latencies)
+
+            run.finished_datetime = timezone.now()
+            run.duration = time.perf_counter() - start
+            run.rows_read = stats.rows_read
+            run.rows_written = stats.rows_written
+            run.upstream_requests = len(latencies)
+            run.upstream_latency_p50 = _percentile(latencies, 50)
+            run.upstream_latency_p95 = _percentile(latencies, 95)
+            run.upstream_latency_p99 = _percentile(latencies, 99)
+            run.save()
+
+            JobRun.objects.filter(name=run.name, started_datetime__lt=run.started_datetime - datetime.timedelta(
+                seconds=settings.JOB_RUN_RETENTION)).delete()
+
+    return wrapper
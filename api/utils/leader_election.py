@@ -0,0 +1,64 @@
+import threading
+
+from django.db import Error, connections
+
+
+class LeaderElection:
+    """Leader election over a PostgreSQL session-level advisory lock
+
+    The lock is held by a dedicated database connection for as long as the process
+    lives, it is released by PostgreSQL when the process or its connection dies and
+    another instance takes over on its next is_leader() call.
+    """
+
+    def __init__(self, lock_id, using='default'):
+        self.lock_id = lock_id
+        self.using = using
+        self.connection = None
+        self.leader = False
+        self.error = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self.connection = connections.create_connection(self.using)
+        # Called from the scheduler's worker threads
+        self.connection.inc_thread_sharing()
+
+    def is_leader(self):
+        """Return whether this process holds the lock, trying to take it when it does not
+
+        A lost connection is reopened and the lock tried again in the same call, the
+        lock went away with the connection. error is the last error when both fail.
+        """
+        with self.lock:
+            for _ in range(2):
+                try:
+                    if self.connection is None:
+                        self._connect()
+
+                    with self.connection.cursor() as cursor:
+                        if self.leader:
+                            # Raises when the connection holding the lock was lost
+                            cursor.execute('SELECT 1')
+                        else:
+                            cursor.execute(
+                                'SELECT pg_try_advisory_lock(%s)', [self.lock_id])
+                            self.leader = cursor.fetchone()[0]
+
+                    self.error = None
+                    return self.leader
+                except Error as e:
+                    self.error = e
+                    self.close()
+
+            return False
+
+    def close(self):
+        """Close the lock's connection, releasing the lock"""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Error:
+                pass
+        self.connection = None
+        self.leader = False
@@ -0,0 +1,36 @@
+import pickle
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache_utils import bump_generation, get_generation
+
+NEARBY_CACHE_GENERATION_KEY = 'nearby:generation'
+
+
+def _get_cache():
+    return caches[settings.NEARBY_CACHE_ALIAS]
+
+
+def get_nearby_cache_key(district, user_gid, path_format, tolerance):
+    """Return the nearby response cache key of a district, OSM vertex and response format"""
+    generation = get_generation(NEARBY_CACHE_GENERATION_KEY)
+    return f'nearby:{generation}:{quote(str(district))}:{user_gid}:{path_format}:{tolerance}'
+
+
+def get_cached_nearby_results(key):
+    return _get_cache().get(key)
+
+
+def set_cached_nearby_results(key, results):
+    """Cache nearby results unless they are larger than NEARBY_CACHE_MAX_ENTRY_BYTES"""
+    if len(pickle.dumps(results)) > settings.NEARBY_CACHE_MAX_ENTRY_BYTES:
+        return
+
+    _get_cache().set(key, results)
+
+
+def invalidate_nearby_cache():
+    """Invalidate every cached nearby response, e.g. after centers or their cases changed"""
+    bump_generation(NEARBY_CACHE_GENERATION_KEY)
@@ -0,0 +1,245 @@
+import datetime
+import json
+import random
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from exponent_server_sdk import PushClient, PushMessage, PushReceipt, PushServerError, PushTicket
+from requests.exceptions import RequestException
+
+from api.models import Account, Appointment, PushNotification
+from api.serializers import AppointmentSerializer
+from api.utils.job_runs import record_rows, record_upstream_request
+
+# Ticket errors not worth retrying, the notification is dead-lettered at once
+PERMANENT_TICKET_ERRORS = {
+    PushTicket.ERROR_DEVICE_NOT_REGISTERED,
+    PushTicket.ERROR_MESSAGE_TOO_BIG,
+}
+
+# Request errors caused by some of the messages, the batch is sent again one message at a time to find them
+MESSAGE_ERROR_CODES = {'VALIDATION_ERROR', 'PUSH_TOO_MANY_EXPERIENCE_IDS'}
+
+
+# Title and body of the notification of an appointment moved to the status
+APPOINTMENT_NOTIFICATIONS = {
+    Appointment.APPOINTMENT_STATUS_APPROVED: (
+        'Appointment APPROVED!',
+        'Congratulation, your appointment is approved. Please click here to view your appointment details.'),
+    Appointment.APPOINTMENT_STATUS_REJECTED: (
+        'Appointment REJECTED!',
+        'Sorry, your appointment is rejected. You may submit a new appointment again.'),
+}
+
+
+def get_appointment_notification(appointment):
+    """Return the (title, body, data) of the notification of an approved or rejected appointment"""
+    title, body = APPOINTMENT_NOTIFICATIONS[appointment.appointment_status]
+    return title, body, json.dumps(AppointmentSerializer(appointment).data, default=str)
+
+
+def enqueue_push_message(token, title, message, extra=None):
+    """Write a push notification to the outbox, sent by dispatch_push_notifications once committed"""
+    return PushNotification.objects.create(token=token, title=title, body=message, data=extra)
+
+
+def prune_dead_tokens(tokens):
+    """Clear the Expo tokens no longer registered from their accounts and dead-letter their pending notifications
+
+    Returns the number of accounts cleared.
+    """
+    if not tokens:
+        return 0
+
+    PushNotification.objects.filter(status=PushNotification.STATUS_PENDING, token__in=tokens).update(
+        status=PushNotification.STATUS_DEAD, last_error=f'{PushTicket.ERROR_DEVICE_NOT_REGISTERED}: token pruned')
+
+    return Account.objects.filter(expo_notification_token__in=tokens).update(expo_notification_token='')
+
+
+def _schedule_retry(notification, error, now):
+    notification.attempts += 1
+    notification.last_error = error
+
+    if notification.attempts >= settings.PUSH_MAX_ATTEMPTS:
+        notification.status = PushNotification.STATUS_DEAD
+        return
+
+    # Exponential backoff with equal jitter, never retried within the same run
+    delay = settings.PUSH_RETRY_BACKOFF * 2 ** notification.attempts * random.uniform(0.5, 1)
+    notification.next_attempt_datetime = now + datetime.timedelta(seconds=delay)
+
+
+def _claim_batch(now):
+    """Lease the next due notifications so another dispatcher skips them while they are sent"""
+    with transaction.atomic():
+        batch = list(PushNotification.objects.filter(
+            status=PushNotification.STATUS_PENDING, next_attempt_datetime__lte=now).select_for_update(
+            skip_locked=True).order_by('next_attempt_datetime', 'id')[:settings.PUSH_BATCH_SIZE])
+
+        PushNotification.objects.filter(id__in=[notification.id for notification in batch]).update(
+            next_attempt_datetime=now + datetime.timedelta(seconds=settings.PUSH_DISPATCH_LEASE))
+
+    return batch
+
+
+def _is_message_error(e):
+    """Return whether Expo rejected the request because of some of its messages rather than the request itself"""
+    codes = {error.get('code') for error in e.errors or []}
+    return bool(codes) and codes <= MESSAGE_ERROR_CODES
+
+
+def _publish(client, batch):
+    """Publish a batch, one by one when a bad message makes Expo reject the whole request so it cannot fail the others
+
+    Returns (results, failed), results being a list of (notification, ticket or None, error) and
+    failed whether Expo was unreachable or rejected the request itself, the rest of the batch then
+    being retried with the error.
+    """
+    messages = [PushMessage(to=notification.token, title=notification.title,
+                            body=notification.body, data=notification.data) for notification in batch]
+    try:
+        tickets = client.publish_multiple(messages)
+        return [(notification, ticket, None) for notification, ticket in zip(batch, tickets)], False
+    except PushServerError as e:
+        if not _is_message_error(e):
+            return [(notification, None, f'{e}: {e.errors}') for notification in batch], True
+        if len(batch) == 1:
+            return [(batch[0], None, f'{e}: {e.errors}')], False
+    except RequestException as e:
+        return [(notification, None, str(e)) for notification in batch], True
+
+    results = []
+    for i, notification in enumerate(batch):
+        published, failed = _publish(client, [notification])
+        results.extend(published)
+        if failed:
+            error = published[0][2]
+            results.extend((rest, None, error) for rest in batch[i + 1:])
+            return results, True
+
+    return results, False
+
+
+def dispatch_push_notifications():
+    """Send due outbox notifications in batches of up to PUSH_BATCH_SIZE (Expo's limit is 100)
+
+    Failed notifications are retried with backoff and dead-lettered after PUSH_MAX_ATTEMPTS
+    or a permanent ticket error. Returns {'sent', 'retried', 'dead'}.
+    """
+    stats = {'sent': 0, 'retried': 0, 'dead': 0}
+    client = PushClient()
+
+    while True:
+        now = timezone.now()
+        batch = _claim_batch(now)
+        if not batch:
+            return stats
+
+        results, failed = _publish(client, batch)
+
+        dead_tokens = set()
+        for notification, ticket, error in results:
+            if ticket is not None and ticket.is_success():
+                notification.status = PushNotification.STATUS_SENT
+                notification.ticket_id = ticket.id or ''
+                notification.receipt_checked = False
+                notification.sent_datetime = now
+                notification.attempts += 1
+                stats['sent'] += 1
+                continue
+
+            if ticket is not None:
+                ticket_error = (ticket.details or {}).get('error')
+                error = f'{ticket_error or "Error"}: {ticket.message}'
+                if ticket_error in PERMANENT_TICKET_ERRORS:
+                    notification.attempts = settings.PUSH_MAX_ATTEMPTS - 1
+                if ticket_error == PushTicket.ERROR_DEVICE_NOT_REGISTERED:
+                    dead_tokens.add(notification.token)
+
+            _schedule_retry(notification, error, now)
+            stats['dead' if notification.status == PushNotification.STATUS_DEAD else 'retried'] += 1
+
+        PushNotification.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_datetime', 'sent_datetime', 'ticket_id', 'receipt_checked', 'last_error'])
+        prune_dead_tokens(dead_tokens)
+
+        if failed:
+            # Expo unreachable or rejecting requests, the rest waits for the next run
+            return stats
+
+
+def check_push_receipts():
+    """Fetch the Expo receipts of sent notifications, up to PUSH_RECEIPT_BATCH_SIZE per request
+
+    Notifications whose device is no longer registered are dead-lettered and their
+    tokens pruned with one update at the end of the run, other failed deliveries are
+    retried like failed sends. Receipts are asked for PUSH_RECEIPT_DELAY seconds after
+    sending and given up on after PUSH_RECEIPT_MAX_AGE, when Expo drops them.
+    Returns {'checked', 'failed', 'pending', 'tokens_pruned'}.
+    """
+    stats = {'checked': 0, 'failed': 0, 'pending': 0, 'tokens_pruned': 0}
+    client = PushClient()
+    now = timezone.now()
+
+    unchecked = PushNotification.objects.filter(
+        status=PushNotification.STATUS_SENT, receipt_checked=False)
+    unchecked.filter(sent_datetime__lt=now - datetime.timedelta(seconds=settings.PUSH_RECEIPT_MAX_AGE)).update(
+        receipt_checked=True)
+    unchecked = unchecked.filter(
+        sent_datetime__lte=now - datetime.timedelta(seconds=settings.PUSH_RECEIPT_DELAY)).exclude(ticket_id='')
+
+    dead_tokens = set()
+    last_id = 0
+    while True:
+        batch = list(unchecked.filter(id__gt=last_id).order_by(
+            'id')[:settings.PUSH_RECEIPT_BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        start = time.perf_counter()
+        receipts = client.check_receipts_multiple([PushTicket(
+            push_message=None, status=PushTicket.SUCCESS_STATUS, message='', details=None, id=notification.ticket_id)
+            for notification in batch])
+        record_upstream_request(time.perf_counter() - start)
+        receipts = {receipt.id: receipt for receipt in receipts}
+
+        checked = []
+        for notification in batch:
+            receipt = receipts.get(notification.ticket_id)
+            if receipt is None:
+                # Not ready yet, asked for again by the next run
+                stats['pending'] += 1
+                continue
+
+            notification.receipt_checked = True
+            checked.append(notification)
+            stats['checked'] += 1
+            if receipt.is_success():
+                continue
+
+            stats['failed'] += 1
+            receipt_error = (receipt.details or {}).get('error')
+            notification.last_error = f'{receipt_error or "Error"}: {receipt.message}'
+            if receipt_error == PushReceipt.ERROR_DEVICE_NOT_REGISTERED:
+                notification.status = PushNotification.STATUS_DEAD
+                dead_tokens.add(notification.token)
+            elif receipt_error == PushReceipt.ERROR_MESSAGE_TOO_BIG:
+                notification.status = PushNotification.STATUS_DEAD
+            else:
+                # Sent again by the dispatcher
+                notification.status = PushNotification.STATUS_PENDING
+                notification.ticket_id = ''
+                _schedule_retry(notification, notification.last_error, now)
+
+        PushNotification.objects.bulk_update(
+            checked, ['status', 'attempts', 'next_attempt_datetime', 'ticket_id', 'last_error', 'receipt_checked'])
+        record_rows(read=len(batch), written=len(checked))
+
+    stats['tokens_pruned'] = prune_dead_tokens(dead_tokens)
+    record_rows(written=stats['tokens_pruned'])
+
+    return stats
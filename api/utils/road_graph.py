@@ -0,0 +1,187 @@
+import heapq
+import mmap
+import os
+import struct
+from array import array
+
+# Snapshot layout: header, then 8-byte aligned sections of
+# offsets (int64, num_vertices + 1), heads (int32, num_arcs),
+# edges (int32, num_arcs) and costs (float64, num_arcs)
+SNAPSHOT_MAGIC = b'VCRGRAPH'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<8sIIqq')
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class RoadGraph:
+    """Compressed sparse row (CSR) road graph backed by a memory-mapped snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        with open(path, 'rb') as file:
+            # Read-only shared mapping, pages are shared by every worker process
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, directed, num_vertices, num_arcs = SNAPSHOT_HEADER.unpack_from(
+            self._mmap, 0)
+
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is not a valid road graph snapshot')
+
+        self.directed = bool(directed)
+        self.num_vertices = num_vertices
+        self.num_arcs = num_arcs
+
+        buffer = memoryview(self._mmap)
+        position = _align(SNAPSHOT_HEADER.size)
+
+        def section(fmt, length):
+            nonlocal position
+            size = struct.calcsize(fmt) * length
+            view = buffer[position:position + size].cast(fmt)
+            position = _align(position + size)
+            return view
+
+        self.offsets = section('q', num_vertices + 1)
+        self.heads = section('i', num_arcs)
+        self.edges = section('i', num_arcs)
+        self.costs = section('d', num_arcs)
+
+    def _search(self, source, targets=None, max_cost=float('inf')):
+        """Dijkstra from source until every target is settled or max_cost is exceeded
+
+        Returns settled {vertex: cost} and predecessor {vertex: (previous vertex, edge id)}
+        """
+        settled = {}
+        pred = {}
+        if not 0 <= source < self.num_vertices:
+            return settled, pred
+
+        remaining = None if targets is None else {
+            target for target in targets if 0 <= target < self.num_vertices}
+        offsets, heads, edges, costs = self.offsets, self.heads, self.edges, self.costs
+        dist = {source: 0.0}
+        queue = [(0.0, source)]
+
+        while queue and remaining != set():
+            cost, vertex = heapq.heappop(queue)
+            if vertex in settled:
+                continue
+            if cost > max_cost:
+                break
+            settled[vertex] = cost
+            if remaining is not None:
+                remaining.discard(vertex)
+
+            for arc in range(offsets[vertex], offsets[vertex + 1]):
+                head = heads[arc]
+                new_cost = cost + costs[arc]
+                if new_cost < dist.get(head, float('inf')):
+                    dist[head] = new_cost
+                    pred[head] = (vertex, edges[arc])
+                    heapq.heappush(queue, (new_cost, head))
+
+        return settled, pred
+
+    def shortest_paths(self, source, targets):
+        """Multi-target Dijkstra, return {target: (agg_cost, [(node, edge), ...])} for reachable targets"""
+        settled, pred = self._search(source, targets)
+
+        results = {}
+        for target in set(targets):
+            if target not in settled:
+                continue
+
+            steps = []
+            vertex = target
+            while vertex != source:
+                previous, edge = pred[vertex]
+                steps.append((previous, edge))
+                vertex = previous
+            steps.reverse()
+
+            results[target] = (settled[target], steps)
+
+        return results
+
+    def shortest_path_tree(self, source, max_cost):
+        """Bounded single-source Dijkstra, yield (vertex, cost, predecessor, edge) for every settled vertex"""
+        settled, pred = self._search(source, max_cost=max_cost)
+
+        for vertex, cost in settled.items():
+            predecessor, edge = pred.get(vertex, (None, None))
+            yield vertex, cost, predecessor, edge
+
+
+def write_snapshot(path, rows, directed=False):
+    """Write (id, source, target, cost, reverse_cost) edge rows to a CSR snapshot file"""
+    sources = array('i')
+    targets = array('i')
+    edge_ids = array('i')
+    arc_costs = array('d')
+
+    def add_arc(tail, head, edge, cost):
+        if cost is None or cost < 0:
+            return
+        sources.append(tail)
+        targets.append(head)
+        edge_ids.append(edge)
+        arc_costs.append(cost)
+
+    for edge, source, target, cost, reverse_cost in rows:
+        if source is None or target is None:
+            continue
+        add_arc(source, target, edge, cost)
+        # pgr_dijkstra(directed := FALSE) traverses every edge both ways with cost
+        add_arc(target, source, edge, reverse_cost if directed else cost)
+
+    num_vertices = max(max(sources, default=-1), max(targets, default=-1)) + 1
+    num_arcs = len(sources)
+
+    # Counting sort of arcs by tail vertex
+    offsets = array('q', bytes(8 * (num_vertices + 1)))
+    for tail in sources:
+        offsets[tail + 1] += 1
+    for vertex in range(num_vertices):
+        offsets[vertex + 1] += offsets[vertex]
+
+    cursor = array('q', offsets[:-1])
+    heads = array('i', bytes(4 * num_arcs))
+    edges = array('i', bytes(4 * num_arcs))
+    costs = array('d', bytes(8 * num_arcs))
+    for index in range(num_arcs):
+        slot = cursor[sources[index]]
+        cursor[sources[index]] += 1
+        heads[slot] = targets[index]
+        edges[slot] = edge_ids[index]
+        costs[slot] = arc_costs[index]
+
+    # Write to a temporary file first so running workers never map a partial snapshot
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                        int(directed), num_vertices, num_arcs))
+        for section in (offsets, heads, edges, costs):
+            file.write(bytes(_align(file.tell()) - file.tell()))
+            section.tofile(file)
+    os.replace(temp_path, path)
+
+    return num_vertices, num_arcs
+
+
+_road_graph = None
+
+
+def get_road_graph(path):
+    """Return the process-wide road graph, reloading it when the snapshot file is replaced"""
+    global _road_graph
+
+    if _road_graph is None or _road_graph.path != path or _road_graph.mtime != os.path.getmtime(path):
+        _road_graph = RoadGraph(path)
+
+    return _road_graph
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.cache import caches
+
+from .cache_utils import increment
+from .get_shortest_paths import get_shortest_paths
+
+ROUTE_CACHE_HITS_KEY = 'route-cache:hits'
+ROUTE_CACHE_MISSES_KEY = 'route-cache:misses'
+
+# Stored for pairs without a path so they are not routed again until expired
+UNREACHABLE = 'unreachable'
+
+
+def _route_key(user_gid, center_gid):
+    return f'route:{user_gid}:{center_gid}'
+
+
+def get_cached_shortest_paths(user_gid, center_gids, bounds=None):
+    """Function for finding shortest paths with finished (start vertex, center vertex) results cached
+
+    Returns a list of {'gid', 'agg_cost', 'coords'} rows sorted by agg_cost, only
+    pairs missing from the route cache are routed.
+    """
+    cache = caches[settings.ROUTE_CACHE_ALIAS]
+    keys = {gid: _route_key(user_gid, gid) for gid in center_gids}
+    cached = cache.get_many(keys.values())
+
+    rows = []
+    misses = []
+    for gid, key in keys.items():
+        if key not in cached:
+            misses.append(gid)
+        elif cached[key] != UNREACHABLE:
+            agg_cost, coords = cached[key]
+            rows.append({'gid': gid, 'agg_cost': agg_cost, 'coords': coords})
+
+    increment(cache, ROUTE_CACHE_HITS_KEY, len(keys) - len(misses))
+    increment(cache, ROUTE_CACHE_MISSES_KEY, len(misses))
+
+    if misses:
+        entries = {keys[gid]: UNREACHABLE for gid in misses}
+
+        for row in get_shortest_paths(user_gid, misses, bounds):
+            coords = GEOSGeometry(row['path_geom']).coords
+            entries[keys[row['gid']]] = (row['agg_cost'], coords)
+            rows.append(
+                {'gid': row['gid'], 'agg_cost': row['agg_cost'], 'coords': coords})
+
+        cache.set_many(entries)
+
+    return sorted(rows, key=lambda row: row['agg_cost'])
+
+
+def get_route_cache_stats():
+    """Return the route cache hit/miss counters"""
+    cache = caches[settings.ROUTE_CACHE_ALIAS]
+    counters = cache.get_many([ROUTE_CACHE_HITS_KEY, ROUTE_CACHE_MISSES_KEY])
+    hits = counters.get(ROUTE_CACHE_HITS_KEY, 0)
+    misses = counters.get(ROUTE_CACHE_MISSES_KEY, 0)
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import transaction
+
+from api.models import CenterDistanceField, VaccinationCenter
+from .road_graph import get_road_graph
+
+
+def update_center_distance_fields(gids=None, full=False, batch_size=5000):
+    """Function for (re)computing the shortest path tree of each center's OSM vertex
+
+    Only vertices without a field are computed unless full is set, fields of
+    vertices no longer used by any center are removed. Returns the computed roots.
+    """
+    graph = get_road_graph(settings.ROUTING_GRAPH_SNAPSHOT)
+
+    if graph.directed:
+        raise ValueError(
+            'Distance fields are rooted at the centers and need an undirected road graph snapshot')
+
+    center_gids = set(VaccinationCenter.objects.filter(
+        gid__gte=0).values_list('gid', flat=True))
+    existing = set(CenterDistanceField.objects.values_list(
+        'root', flat=True).distinct())
+
+    CenterDistanceField.objects.filter(
+        root__in=existing - center_gids).delete()
+
+    if gids is None:
+        gids = center_gids
+    roots = set(gids) & center_gids
+    if not full:
+        roots -= existing
+
+    for root in roots:
+        fields = (CenterDistanceField(root=root, vertex=vertex, cost=cost, predecessor=predecessor, edge=edge)
+                  for vertex, cost, predecessor, edge in graph.shortest_path_tree(root, settings.ROUTING_DISTANCE_FIELD_MAX_COST))
+
+        with transaction.atomic():
+            CenterDistanceField.objects.filter(root=root).delete()
+            CenterDistanceField.objects.bulk_create(
+                fields, batch_size=batch_size)
+
+    return roots
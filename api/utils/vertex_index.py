@@ -0,0 +1,204 @@
+import math
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Max
+
+from api.models import Osm22Po4Pgr
+
+
+class VertexIndex:
+    """Uniform grid index over OSM vertex coordinates for nearest vertex lookups"""
+
+    def __init__(self, vertices, cell_size):
+        """vertices is an iterable of (vertex id, x, y)"""
+        self.cell_size = cell_size
+
+        cells = {}
+        for vertex, x, y in vertices:
+            cells.setdefault(self._cell(x, y), []).append((vertex, x, y))
+
+        if not cells:
+            raise ValueError('Vertex index needs at least one vertex')
+
+        # Vertices stored contiguously per cell, cell -> (start, end) slice
+        self.vertices = array('i')
+        self.xs = array('d')
+        self.ys = array('d')
+        self.ranges = {}
+        for cell, members in cells.items():
+            start = len(self.vertices)
+            for vertex, x, y in members:
+                self.vertices.append(vertex)
+                self.xs.append(x)
+                self.ys.append(y)
+            self.ranges[cell] = (start, len(self.vertices))
+
+        columns = [cell[0] for cell in self.ranges]
+        rows = [cell[1] for cell in self.ranges]
+        self._bounds = (min(columns), min(rows), max(columns), max(rows))
+        self.extent = (min(self.xs), min(self.ys), max(self.xs), max(self.ys))
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def covers(self, x, y, margin):
+        """Whether the coordinate is within margin degrees of the indexed vertices' extent"""
+        xmin, ymin, xmax, ymax = self.extent
+        return xmin - margin <= x <= xmax + margin and ymin - margin <= y <= ymax + margin
+
+    def _scan(self, cell, x, y, scale, best, best_distance):
+        start, end = self.ranges[cell]
+        for index in range(start, end):
+            distance = ((self.xs[index] - x) * scale) ** 2 + \
+                (self.ys[index] - y) ** 2
+            if distance < best_distance:
+                best = index
+                best_distance = distance
+
+        return best, best_distance
+
+    def nearest(self, x, y):
+        """Return (vertex id, x, y) of the nearest vertex to the coordinate"""
+        # Equirectangular approximation, longitude degrees shrink with latitude
+        scale = math.cos(math.radians(y))
+        column, row = self._cell(x, y)
+        min_column, min_row, max_column, max_row = self._bounds
+        max_ring = max(abs(column - min_column), abs(column - max_column),
+                       abs(row - min_row), abs(row - max_row))
+
+        best = None
+        best_distance = float('inf')
+        for ring in range(max_ring + 1):
+            # Vertices in cells beyond this ring are at least this far away
+            if best is not None and best_distance <= ((ring - 1) * self.cell_size * scale) ** 2:
+                return self.vertices[best], self.xs[best], self.ys[best]
+
+            # Far from the data the rings are mostly empty, visit the occupied cells instead
+            if (2 * ring + 1) ** 2 > len(self.ranges):
+                break
+
+            for cell in self._ring(column, row, ring):
+                if cell in self.ranges:
+                    best, best_distance = self._scan(
+                        cell, x, y, scale, best, best_distance)
+        else:
+            return self.vertices[best], self.xs[best], self.ys[best]
+
+        # Occupied cells by their distance lower bound, scanned until none can be closer
+        size = self.cell_size
+        bounds = sorted((
+            (max(cell[0] * size - x, 0, x - (cell[0] + 1) * size) * scale) ** 2 +
+            max(cell[1] * size - y, 0, y - (cell[1] + 1) * size) ** 2, cell) for cell in self.ranges)
+        for bound, cell in bounds:
+            if bound >= best_distance:
+                break
+            best, best_distance = self._scan(
+                cell, x, y, scale, best, best_distance)
+
+        return self.vertices[best], self.xs[best], self.ys[best]
+
+    @staticmethod
+    def _ring(column, row, ring):
+        if ring == 0:
+            yield (column, row)
+            return
+
+        for offset in range(-ring, ring + 1):
+            yield (column + offset, row - ring)
+            yield (column + offset, row + ring)
+        for offset in range(-ring + 1, ring):
+            yield (column - ring, row + offset)
+            yield (column + ring, row + offset)
+
+
+def load_vertices():
+    """Yield (vertex id, x, y) of every vertex of the OSM routing table"""
+    seen = set()
+    rows = Osm22Po4Pgr.objects.using('osm').values_list(
+        'source', 'x1', 'y1', 'target', 'x2', 'y2').iterator(chunk_size=10000)
+
+    for source, x1, y1, target, x2, y2 in rows:
+        for vertex, x, y in ((source, x1, y1), (target, x2, y2)):
+            if vertex is None or x is None or y is None or vertex in seen:
+                continue
+            seen.add(vertex)
+            yield vertex, x, y
+
+
+class VertexIndexNotReady(Exception):
+    """The first vertex index of the process is still being built"""
+
+
+def _get_signature():
+    return Osm22Po4Pgr.objects.using('osm').aggregate(count=Count('id'), last_id=Max('id'))
+
+
+_vertex_index = None
+_vertex_index_signature = None
+_vertex_index_checked = 0
+_vertex_index_lock = threading.Lock()
+
+
+def refresh_vertex_index(wait=True):
+    """(Re)build the process-wide vertex index when the OSM routing table changed
+
+    Only one thread builds at a time, returns False without building when another
+    thread is building and wait is not set.
+    """
+    global _vertex_index, _vertex_index_signature, _vertex_index_checked
+
+    if not _vertex_index_lock.acquire(blocking=wait):
+        return False
+
+    try:
+        signature = _get_signature()
+        if _vertex_index is None or signature != _vertex_index_signature:
+            _vertex_index = VertexIndex(
+                load_vertices(), settings.VERTEX_INDEX_CELL_SIZE)
+            _vertex_index_signature = signature
+    finally:
+        # A failed check is retried after VERTEX_INDEX_MAX_AGE too
+        _vertex_index_checked = time.monotonic()
+        _vertex_index_lock.release()
+
+    return True
+
+
+def refresh_vertex_index_in_background():
+    """Start refresh_vertex_index in a thread unless a refresh is running, e.g. at worker start"""
+    if _vertex_index_lock.locked():
+        return
+
+    def run():
+        try:
+            refresh_vertex_index(wait=False)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_vertex_index(wait=False):
+    """Return the process-wide vertex index
+
+    The index is built in the background on first use and rebuilt when the OSM
+    routing table changed, checked every VERTEX_INDEX_MAX_AGE seconds, lookups keep
+    using the previous index meanwhile. Raises VertexIndexNotReady until the first
+    build finished unless wait is set.
+    """
+    if _vertex_index is None:
+        if not wait:
+            refresh_vertex_index_in_background()
+            raise VertexIndexNotReady()
+        refresh_vertex_index()
+    elif time.monotonic() - _vertex_index_checked >= settings.VERTEX_INDEX_MAX_AGE:
+        refresh_vertex_index_in_background()
+
+    return _vertex_index
@@ -1,44 +1,70 @@
-from django.db import connections
-from django.contrib.gis.geos import Point
-from django.contrib.gis.db.models.functions import Distance
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections
+from django.db.models import Count, Max, Min, Q, Sum
 from django.utils import timezone
-from django.contrib.gis.geos import GEOSGeometry
+from django.utils.dateparse import parse_date
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.decorators import action
 from rest_framework.mixins import ListModelMixin
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from .models import Account, Appointment, Osm22Po4Pgr, VaccinationCenter, VaxMalaysia, VaccinationTimeslot, VaccinationRecord
-from .serializers import AccountSerializer, AppointmentSerializer,  CustomTokenObtainPairSerializer, MakeAppointmentSerializer, UpdateAppointmentSerializer, VaccinationCenterSerializer, VaccinationTimeslotSerializer, VaccinationRecordSerializer, VaxMalaysiaSerializer
+from .models import Account, Appointment, VaccinationCenter, VaxMalaysia, VaxMalaysiaRollup, VaccinationTimeslot, VaccinationRecord
+from .serializers import AccountSerializer, AppointmentSerializer,  CustomTokenObtainPairSerializer, MakeAppointmentSerializer, UpdateAppointmentSerializer, VaccinationCenterSerializer, VaccinationTimeslotSerializer, VaccinationRecordSerializer, VaxMalaysiaRollupSerializer, VaxMalaysiaSerializer
+from .utils.admission_control import BookingAdmissionThrottle, get_admission_stats
+from .utils.async_api_view import AsyncAPIView
+from .utils.availability_calendar import CalendarPagination, get_cached_calendar, get_calendar_cache_key, group_by_day, set_cached_calendar
+from .utils.columnar import ColumnarListMixin
+from .utils.conditional_get import ConditionalGetMixin
+from .utils.district_index import get_district
+from .utils.find_nearby_centers import find_nearby_centers, get_district_centers, rank_by_straight_line
+from .utils.format_path import PATH_FORMAT_COORDS, PATH_FORMATS
+from .utils.nearby_cache import get_cached_nearby_results, get_nearby_cache_key, set_cached_nearby_results
+from .utils.route_cache import get_route_cache_stats
+from .utils.vertex_index import VertexIndexNotReady, get_vertex_index
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
-class AppointmentViewSet(ModelViewSet):
+def _get_account_validator(user_id, **aggregates):
+    """Account fields with aggregates over its appointments, nested in appointment and record responses"""
+    return Account.objects.filter(user_id=user_id).values_list(
+        'id', 'name', 'ic_number', 'date_of_birth', 'country', 'state', 'expo_notification_token').annotate(
+        num_appointments=Count('appointment'),
+        last_updated=Max('appointment__last_updated_datetime'),
+        booked=Sum('appointment__timeslot__booked'),
+        capacity=Sum('appointment__timeslot__capacity'),
+        timeslot_last_updated=Max(
+            'appointment__timeslot__last_updated_datetime'),
+        center_last_updated=Max(
+            'appointment__timeslot__center__last_updated_datetime'),
+        **aggregates).first()
+
+
+class AppointmentViewSet(ConditionalGetMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'head', 'options']
     permission_classes = [IsAuthenticated]
 
     def create(self, request, *args, **kwargs):
-        # Find all appointments
-        account = Account.objects.get(user_id=self.request.user.id)
-        appointments = Appointment.objects.filter(account=account)
-
-        next_dose_type = Appointment.DOSE_TYPE_FIRST
+        # Find ongoing appointments and the highest attended dose in one aggregate query
+        eligibility = Appointment.objects.filter(account__user_id=self.request.user.id).aggregate(
+            num_ongoing=Count('id', filter=Q(
+                appointment_status__in=Appointment.ONGOING_STATUSES)),
+            last_dose_type=Max('dose_type', filter=Q(appointment_status=Appointment.APPOINTMENT_STATUS_ATTENDED)))
 
-        for appointment in appointments:
-            if 0 < appointment.appointment_status < Appointment.APPOINTMENT_STATUS_ATTENDED:
-                # Return error if there is any ongoing appointment
-                return Response({'detail': 'Appointment failed to create due to ongoing appointment exists.'}, status=status.HTTP_400_BAD_REQUEST)
+        if eligibility['num_ongoing']:
+            # Return error if there is any ongoing appointment
+            return Response({'detail': 'Appointment failed to create due to ongoing appointment exists.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            elif appointment.appointment_status == Appointment.APPOINTMENT_STATUS_ATTENDED:
-                # Set dose for next appointment, e.g. taken first dose, next appointment is second dose
-                if appointment.dose_type >= next_dose_type:
-                    next_dose_type = appointment.dose_type + 1
+        # Set dose for next appointment, e.g. taken first dose, next appointment is second dose
+        next_dose_type = (eligibility['last_dose_type'] or 0) + 1
 
         if next_dose_type > Appointment.DOSE_TYPE_BOOSTER:
             # Return error if dose limit reached (Taken booster dose)
@@ -48,10 +74,23 @@ class AppointmentViewSet(ModelViewSet):
             data=request.data,
             context={'user_id': self.request.user.id})
         serializer.is_valid(raise_exception=True)
-        appointment = serializer.save(dose_type=next_dose_type)
+
+        try:
+            appointment = serializer.save(dose_type=next_dose_type)
+        except IntegrityError as e:
+            # A parallel request created an ongoing appointment first, other integrity errors are not the user's
+            if getattr(getattr(e.__cause__, 'diag', None), 'constraint_name', None) != 'unique_ongoing_appointment_per_account':
+                raise
+            return Response({'detail': 'Appointment failed to create due to ongoing appointment exists.'}, status=status.HTTP_400_BAD_REQUEST)
+
         serializer = AppointmentSerializer(appointment)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def admission(self, request):
+        """Get booking admission admitted/shed counters"""
+        return Response(get_admission_stats())
+
     def partial_update(self, request, *args, **kwargs):
         if request.data['appointment_status'] == Appointment.APPOINTMENT_STATUS_CANCELLED:
             """Cancel appointment"""
@@ -67,13 +106,23 @@ class AppointmentViewSet(ModelViewSet):
             return UpdateAppointmentSerializer
         return AppointmentSerializer
 
+    def get_etag_validator(self):
+        return _get_account_validator(self.request.user.id)
+
+    def get_throttles(self):
+        if self.action == 'create':
+            # Admission control for booking bursts when new timeslots open
+            return [BookingAdmissionThrottle()]
+        return super().get_throttles()
+
     def get_queryset(self):
         user = self.request.user
 
         account_id = Account.objects.only(
             'id').get(user_id=user.id)
 
-        return Appointment.objects.filter(account_id=account_id).order_by('-last_updated_datetime')
+        return Appointment.objects.filter(account_id=account_id).select_related(
+            'account', 'timeslot__center').order_by('-last_updated_datetime')
 
 
 class AccountViewSet(GenericViewSet):
@@ -90,7 +139,6 @@ class AccountViewSet(GenericViewSet):
             serializer = AccountSerializer(account)
             return Response(serializer.data)
         elif request.method == 'PUT':
-            account = Account.objects.get(user_id=request.user.id)
             serializer = AccountSerializer(account, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
@@ -102,110 +150,69 @@ class VaccinationCenterViewSet(GenericViewSet):
     serializer_class = VaccinationCenterSerializer
     permission_classes = [IsAuthenticated]
 
-    @action(detail=False, methods=['GET'], url_path='nearby/(?P<latitude>\d+\.\d+),(?P<longitude>\d+\.\d+)')
-    def nearby(self, request, latitude, longitude):
-        """Get nearby center list using shortest path calculation"""
-
-        def dictfetchall(cursor):
-            """Return all rows from a cursor as a dict"""
-            columns = [col[0] for col in cursor.description]
-            return [
-                dict(zip(columns, row))
-                for row in cursor.fetchall()
-            ]
-
-        # Create Point object from coordinates
-        longitude = float(longitude)
-        latitude = float(latitude)
-        user_location = Point(longitude, latitude, srid=4326)
-
-        # Get user's nearest OSM source vertex id from OSM database
-        user_osm_vertex = Osm22Po4Pgr.objects.using('osm').filter(
-            x1__range=[longitude-0.001, longitude+0.001]).annotate(
-                distance=Distance("geom_way", user_location)).order_by("distance")[0]
-
-        user_gid = user_osm_vertex.source
-
-        # Get user's district by seaching nearby vaccination center by querying VCR database, e.g. Cyberjaya
-        vaccination_center = VaccinationCenter.objects.annotate(
-            distance=Distance("location", user_location)).order_by("distance")[0]
-
-        district = vaccination_center.district
-
-        # Find all centers which are same district as user's location, e.g. All centers in Cyberjaya
-        vaccination_centers = VaccinationCenter.objects.filter(
-            district=district).filter(gid__gte=0)
-
-        # Find nearby vaccination center list with paths sorted by distance
-        with connections['osm'].cursor() as cursor:
-            cursor.execute('''
-            WITH result AS (
-                SELECT seq,
-                    '(' || start_vid || ',' || end_vid || ')' AS path_name,
-                    path_seq, start_vid, end_vid, node, edge, cost,
-                    lead(agg_cost) over() AS agg_cost
-                FROM pgr_dijkstra('SELECT id, source, target, cost FROM osm2_2po_4pgr',
-                    %s,
-                    %s,
-                    directed := FALSE)),
-
-                with_geom AS
-                    (SELECT seq, result.path_name, CASE
-                        WHEN result.node = osm2_2po_4pgr.source
-                            THEN osm2_2po_4pgr.geom_way
-                        ELSE ST_Reverse(osm2_2po_4pgr.geom_way)
-                        END AS path_geom
-                    FROM osm2_2po_4pgr 
-                        JOIN result ON osm2_2po_4pgr.id = result.edge),
-
-                one_geom AS 
-                    (SELECT path_name, ST_LineMerge(ST_Union(path_geom)) AS path_geom 
-                        FROM with_geom GROUP BY path_name ORDER BY path_name),
-
-                aggregates AS 
-                    (SELECT path_name, start_vid, end_vid, SUM(cost) AS agg_cost 
-                        FROM result GROUP BY path_name, start_vid, end_vid
-                        ORDER BY start_vid, end_vid)
-
-            SELECT end_vid AS gid, agg_cost, path_geom
-                FROM aggregates JOIN one_geom USING (path_name) ORDER BY agg_cost''',
-                           [[user_gid], list(vaccination_centers.values_list("gid"))])
-
-            rows = dictfetchall(cursor)
-
-        # Post-processing json data for client's response
-        for row in rows:
-            geom = GEOSGeometry(row['path_geom'])
-            center = vaccination_centers.get(gid=row['gid'])
-            row['id'] = center.id
-            row['distance'] = round(row['agg_cost'], 3)
-            row['cases'] = center.num_cases
-            row['name'] = center.name
-            row['district'] = center.district
-            row['state'] = center.state
-            row['lat'] = round(center.location.coords[1], 5)
-            row['lng'] = round(center.location.coords[0], 5)
-            row['path'] = geom.coords
-            row.pop("agg_cost")
-            row.pop("gid")
-            row.pop("path_geom")
-
-        return Response(rows)
-
-
-class VaccinationTimeslotViewSet(ListModelMixin, GenericViewSet):
+    @action(detail=True, methods=['GET'])
+    def calendar(self, request, pk=None):
+        """Get the center's upcoming availability per day, paginated by timeslot datetime
+
+        Query parameters:
+        cursor -- Cursor of the next/previous page, a day may continue on the next page
+        """
+        cache_key = get_calendar_cache_key(pk, request.query_params.get('cursor'))
+        calendar = get_cached_calendar(cache_key)
+        if calendar is not None:
+            return Response(calendar)
+
+        center = self.get_object()
+        paginator = CalendarPagination()
+        timeslots = paginator.paginate_queryset(
+            VaccinationTimeslot.objects.filter(center=center, datetime__gte=timezone.now()).only(
+                'id', 'datetime', 'capacity', 'booked'),
+            request, view=self)
+
+        calendar = {
+            'center': VaccinationCenterSerializer(center).data,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'days': group_by_day(timeslots),
+        }
+        set_cached_calendar(cache_key, calendar)
+
+        return Response(calendar)
+
+    @action(detail=False, methods=['GET'], url_path='nearby/cache', permission_classes=[IsAdminUser])
+    def nearby_cache(self, request):
+        """Get route cache hit/miss counters"""
+        return Response(get_route_cache_stats())
+
+
+class VaccinationTimeslotViewSet(ConditionalGetMixin, ListModelMixin, GenericViewSet):
     serializer_class = VaccinationTimeslotSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_etag_validator(self):
+        return self.get_queryset().aggregate(
+            count=Count('id'), last_id=Max('id'),
+            first_datetime=Min('datetime'), last_datetime=Max('datetime'),
+            booked=Sum('booked'), capacity=Sum('capacity'),
+            last_updated=Max('last_updated_datetime'),
+            center_last_updated=Max('center__last_updated_datetime'))
+
     def get_queryset(self):
-        return VaccinationTimeslot.objects.filter(center_id=self.kwargs['center_pk'], datetime__gte=timezone.now())
+        return VaccinationTimeslot.objects.filter(center_id=self.kwargs['center_pk'], datetime__gte=timezone.now()).select_related('center')
 
 
-class VaccinationRecordViewSet(ListModelMixin, GenericViewSet):
+class VaccinationRecordViewSet(ConditionalGetMixin, ListModelMixin, GenericViewSet):
     queryset = VaccinationRecord.objects.all()
     serializer_class = VaccinationRecordSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_etag_validator(self):
+        return _get_account_validator(
+            self.request.user.id,
+            num_records=Count('appointment__vaccinationrecord'),
+            last_record_id=Max('appointment__vaccinationrecord__id'),
+            record_last_updated=Max('appointment__vaccinationrecord__last_updated_datetime'))
+
     def get_queryset(self):
         user = self.request.user
 
@@ -214,10 +221,156 @@ class VaccinationRecordViewSet(ListModelMixin, GenericViewSet):
 
         appointments = Appointment.objects.filter(account_id=account_id)
 
-        return VaccinationRecord.objects.filter(appointment__in=appointments)
+        return VaccinationRecord.objects.filter(appointment__in=appointments).select_related(
+            'appointment__account', 'appointment__timeslot__center')
 
 
-class VaxMalaysiaViewSet(ListModelMixin, GenericViewSet):
+class VaxMalaysiaViewSet(ConditionalGetMixin, ColumnarListMixin, ListModelMixin, GenericViewSet):
+    """Vaccination statistic
+
+    Query parameters:
+    granularity -- 'daily' (default), 'weekly' or 'monthly', weekly/monthly rows are dated by the period's first day
+    from -- Only rows on or after the date, e.g. 2021-06-01
+    to -- Only rows on or before the date
+    format -- 'columns' for {field: [values]} or 'csv', both streamed without the serializer
+    """
     queryset = VaxMalaysia.objects.order_by('-date')
     serializer_class = VaxMalaysiaSerializer
     permission_classes = [IsAuthenticated]
+
+    GRANULARITY_DAILY = 'daily'
+
+    def get_granularity(self):
+        granularity = self.request.query_params.get(
+            'granularity', self.GRANULARITY_DAILY)
+        granularities = [self.GRANULARITY_DAILY] + \
+            [value for value, _ in VaxMalaysiaRollup.GRANULARITY_CHOICES]
+
+        if granularity not in granularities:
+            raise ParseError(
+                f'granularity must be one of {", ".join(granularities)}.')
+
+        return granularity
+
+    def get_queryset(self):
+        granularity = self.get_granularity()
+        if granularity == self.GRANULARITY_DAILY:
+            queryset = VaxMalaysia.objects.order_by('-date')
+        else:
+            queryset = VaxMalaysiaRollup.objects.filter(
+                granularity=granularity).order_by('-date')
+
+        for param, lookup in (('from', 'date__gte'), ('to', 'date__lte')):
+            if param in self.request.query_params:
+                try:
+                    date = parse_date(self.request.query_params[param])
+                except ValueError:
+                    date = None
+                if date is None:
+                    raise ParseError(f'{param} must be a date, e.g. 2021-06-01.')
+                queryset = queryset.filter(**{lookup: date})
+
+        return queryset
+
+    def get_serializer_class(self):
+        if self.get_granularity() == self.GRANULARITY_DAILY:
+            return VaxMalaysiaSerializer
+        return VaxMalaysiaRollupSerializer
+
+    def get_etag_validator(self):
+        return VaxMalaysia.objects.aggregate(
+            count=Count('date'), last_date=Max('date'), last_updated=Max('last_updated_datetime'))
+
+
+def _run_sync(func, *args):
+    """Run blocking code (ORM, routing) from async views, in its own thread when lookups run concurrently"""
+    if not settings.NEARBY_CONCURRENT_LOOKUPS:
+        return sync_to_async(func)(*args)
+
+    def run():
+        # Executor threads are not covered by the request_started/request_finished connection cleanup
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+class NearbyCentersView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, latitude, longitude):
+        """Get nearby center list using shortest path calculation (served concurrently under ASGI)
+
+        Query parameters:
+        path_format -- 'coords' (default), 'polyline' for Google encoded polylines or 'none' to leave out paths
+        simplify -- Simplify paths with the given tolerance in degrees, e.g. 0.0001
+
+        The whole lookup is limited to NEARBY_TIMEOUT seconds. When routing runs out
+        of time, centers are ranked by straight-line distance in km and the
+        X-Nearby-Degraded header is set, when the lookups before it do the response
+        is 503, as it is while the worker still builds its vertex index.
+        """
+        path_format = request.query_params.get('path_format', PATH_FORMAT_COORDS)
+        if path_format not in PATH_FORMATS:
+            return Response({'detail': f'path_format must be one of {", ".join(PATH_FORMATS)}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            tolerance = float(request.query_params.get('simplify', 0))
+            if tolerance < 0:
+                raise ValueError
+        except ValueError:
+            return Response({'detail': 'simplify must be a non-negative number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        longitude = float(longitude)
+        latitude = float(latitude)
+        if latitude > 90 or longitude > 180:
+            return Response({'detail': 'latitude must be at most 90 and longitude at most 180.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        def snap():
+            vertex_index = get_vertex_index()
+            if not vertex_index.covers(longitude, latitude, settings.VERTEX_INDEX_MARGIN):
+                raise ParseError(
+                    'Location is outside the area covered by the road network.')
+            return vertex_index.nearest(longitude, latitude)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.NEARBY_TIMEOUT
+
+        def remaining():
+            return max(deadline - loop.time(), 0)
+
+        try:
+            # Snap user's location to the nearest OSM vertex and find user's district (e.g. Cyberjaya) concurrently
+            (user_gid, vertex_x, vertex_y), district = await asyncio.wait_for(asyncio.gather(
+                _run_sync(snap),
+                _run_sync(get_district, longitude, latitude)), timeout=remaining())
+
+            # Users snapped to the same OSM vertex share one cached response
+            cache_key = await asyncio.wait_for(_run_sync(
+                get_nearby_cache_key, district, user_gid, path_format, tolerance), timeout=remaining())
+            results = get_cached_nearby_results(cache_key)
+            if results is not None:
+                return Response(results)
+
+            centers_by_gid = await asyncio.wait_for(
+                _run_sync(get_district_centers, district), timeout=remaining())
+        except (asyncio.TimeoutError, VertexIndexNotReady):
+            return Response({'detail': 'Nearby centers are unavailable, please try again later.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            results = await asyncio.wait_for(
+                _run_sync(find_nearby_centers, user_gid, vertex_x, vertex_y,
+                          centers_by_gid, path_format, tolerance),
+                timeout=remaining())
+        except (asyncio.TimeoutError, DatabaseError):
+            # Routing queries are cancelled by ROUTING_STATEMENT_TIMEOUT, routes finished before are cached
+            results = rank_by_straight_line(
+                longitude, latitude, centers_by_gid, path_format, tolerance)
+            return Response(results, headers={'X-Nearby-Degraded': 'straight-line'})
+
+        set_cached_nearby_results(cache_key, results)
+
+        return Response(results)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vcr.settings.dev')
 
 application = get_asgi_application()
+
+# Build the nearest OSM vertex index when the worker starts rather than in its first nearby requests
+from api.utils.vertex_index import refresh_vertex_index_in_background  # noqa: E402
+
+refresh_vertex_index_in_background()
@@ -143,7 +143,9 @@ JAZZMIN_SETTINGS = {
         "api.Appointment": "fas fa-calendar-check",
         "api.VaccinationCenter": "fas fa-hospital",
         "api.VaccinationTimeslot": "fas fa-clock",
-        "api.VaccinationRecord": "fas fa-syringe"
+        "api.VaccinationRecord": "fas fa-syringe",
+        "api.JobRun": "fas fa-stopwatch",
+        "api.PushNotification": "fas fa-bell"
     },
 }
 
@@ -157,3 +159,224 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
     'ACCESS_TOKEN_LIFETIME': timedelta(days=14)
 }
+
+# Routing configuration:
+# 'pgrouting' runs pgr_dijkstra in the OSM database, 'inprocess' runs Dijkstra
+# on the snapshot built with `python manage.py build_road_graph`
+
+ROUTING_ENGINE = os.environ.get('ROUTING_ENGINE', 'pgrouting')
+
+ROUTING_GRAPH_SNAPSHOT = os.environ.get(
+    'ROUTING_GRAPH_SNAPSHOT', os.path.join(BASE_DIR, 'road_graph.snapshot'))
+
+# Bounded subgraph ('pgrouting_bbox'): edges are limited to the extent of the user
+# and the district's centers plus a buffer in degrees, growing on each retry
+
+ROUTING_BBOX_BUFFER = 0.05
+
+ROUTING_BBOX_GROWTH = 4
+
+ROUTING_BBOX_MAX_ATTEMPTS = 3
+
+# Precomputed distance fields ('precomputed'): shortest path trees rooted at every
+# center's vertex up to ROUTING_DISTANCE_FIELD_MAX_COST hours of driving (osm2po
+# cost is km / kmh), built with `python manage.py build_distance_fields` and for
+# new or moved centers by the scheduler every DISTANCE_FIELD_UPDATE_INTERVAL
+# seconds. Users farther from a center are routed with the fallback engine
+
+ROUTING_DISTANCE_FIELD_MAX_COST = 20 / 60
+
+DISTANCE_FIELD_UPDATE_INTERVAL = 60 * 5
+
+ROUTING_PRECOMPUTED_FALLBACK = 'pgrouting'
+
+# Routing queries still running after this many milliseconds are cancelled by
+# PostgreSQL, so abandoned nearby lookups do not keep their threads busy
+
+ROUTING_STATEMENT_TIMEOUT = 5000
+
+# Grid cell size in degrees of the in-memory nearest OSM vertex index, how far
+# in degrees outside the indexed vertices nearby accepts a location (400 beyond)
+# and how often in seconds the OSM routing table is checked for an import
+
+VERTEX_INDEX_CELL_SIZE = 0.01
+
+VERTEX_INDEX_MARGIN = 0.5
+
+VERTEX_INDEX_MAX_AGE = 60 * 5
+
+# Cache configuration:
+# 'routes' keeps finished (user vertex, center vertex) routes, the local memory
+# backend evicts the least recently used entries above MAX_ENTRIES. Point it to
+# a shared backend (e.g. Redis) to share routes between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'routes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'routes',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'nearby': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nearby',
+        'TIMEOUT': 60 * 15,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+    'calendar': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'calendar',
+        'TIMEOUT': 60 * 5,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'admission': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'admission',
+    },
+}
+
+ROUTE_CACHE_ALIAS = 'routes'
+
+# 'nearby' keeps whole nearby responses per snapped OSM vertex, invalidated for
+# every worker on center changes through a generation kept in the database.
+# Memory is capped at about
+# MAX_ENTRIES * NEARBY_CACHE_MAX_ENTRY_BYTES
+
+NEARBY_CACHE_ALIAS = 'nearby'
+
+NEARBY_CACHE_MAX_ENTRY_BYTES = 256 * 1024
+
+# Nearby endpoint: budget in seconds for the whole lookup, routing falls back
+# to a straight-line ranking when it runs out, and whether the independent
+# lookups run in their own threads (needs one database connection per thread)
+
+NEARBY_TIMEOUT = 5
+
+NEARBY_CONCURRENT_LOOKUPS = True
+
+# District index: buffer in degrees around each district's centers hull, grid
+# cell size of the nearest center fallback and how often in seconds other
+# processes' center changes are checked
+
+DISTRICT_INDEX_HULL_BUFFER = 0.02
+
+DISTRICT_INDEX_CELL_SIZE = 0.05
+
+DISTRICT_INDEX_MAX_AGE = 60
+
+# Booking admission control: token buckets per center and across all centers,
+# holding up to BURST tokens and refilled with RATE tokens per second. Requests
+# over either rate get 429 with Retry-After. The buckets and their admitted/shed
+# counters are database rows shared by every worker, the 'admission' cache only
+# holds timeslot centers. A RATE of None disables that bucket
+
+ADMISSION_CACHE_ALIAS = 'admission'
+
+ADMISSION_GLOBAL_RATE = 50
+
+ADMISSION_GLOBAL_BURST = 100
+
+ADMISSION_CENTER_RATE = 5
+
+ADMISSION_CENTER_BURST = 20
+
+# Center availability calendar: timeslots per page and the cache of rendered
+# pages, invalidated per center for every worker when its timeslots or
+# appointments change
+
+CALENDAR_PAGE_SIZE = 100
+
+CALENDAR_CACHE_ALIAS = 'calendar'
+
+# Vaccination statistic ingestion: source of vax_malaysia.csv (an http(s) URL
+# or a local file path, e.g. for testing), request timeout in seconds and rows
+# per INSERT ... ON CONFLICT statement
+
+VAX_MALAYSIA_CSV_URL = os.environ.get(
+    'VAX_MALAYSIA_CSV_URL', 'https://raw.githubusercontent.com/CITF-Malaysia/citf-public/main/vaccination/vax_malaysia.csv')
+
+VAX_MALAYSIA_TIMEOUT = 60
+
+VAX_MALAYSIA_BATCH_SIZE = 1000
+
+# Rows fetched per server-side cursor round trip by the streamed columns/csv
+# list formats and bytes of encoded output kept in memory, more is spooled to a
+# temporary file until the response is sent
+
+STREAM_CHUNK_SIZE = 2000
+
+STREAM_SPOOL_MAX_SIZE = 1024 * 1024
+
+# Hotspot cases refresh: MySj hotspot API (or a stub server for testing),
+# concurrent requests, requests per second, timeout in seconds, retries with
+# jittered exponential backoff from HOTSPOT_RETRY_BACKOFF seconds and the age
+# in seconds after which a center is refreshed
+
+HOTSPOT_API_URL = os.environ.get(
+    'HOTSPOT_API_URL', 'https://mysejahtera.malaysia.gov.my/register/api/nearby/hotspots')
+
+HOTSPOT_CONCURRENCY = 8
+
+HOTSPOT_RATE_LIMIT = 20
+
+HOTSPOT_TIMEOUT = 10
+
+HOTSPOT_MAX_RETRIES = 3
+
+HOTSPOT_RETRY_BACKOFF = 0.5
+
+HOTSPOT_REFRESH_MAX_AGE = 60 * 60 * 24
+
+# Centers within this many metres of a cluster's first center share its
+# hotspot query, clusters are kept until a center moves or the radius changes
+
+HOTSPOT_CLUSTER_RADIUS = 300
+
+# Appointments moved per batch by the overdue appointment sweep
+
+APPOINTMENT_SWEEP_BATCH_SIZE = 1000
+
+# PostgreSQL advisory lock id held by the leader of the `python manage.py
+# run_scheduler` instances, the only one running the scheduled jobs
+
+SCHEDULER_LOCK_ID = 7263001
+
+# Seconds a job run is kept, older runs of a job are deleted when it runs again
+
+JOB_RUN_RETENTION = 60 * 60 * 24 * 30
+
+# Push notification outbox, drained every PUSH_DISPATCH_INTERVAL seconds by the
+# scheduler in batches of up to 100 messages (Expo's limit per request)
+
+PUSH_DISPATCH_INTERVAL = 10
+
+PUSH_BATCH_SIZE = 100
+
+PUSH_MAX_ATTEMPTS = 8
+
+PUSH_RETRY_BACKOFF = 5
+
+# Seconds a claimed batch is hidden from other dispatchers while it is sent
+
+PUSH_DISPATCH_LEASE = 120
+
+# Expo push receipts are checked every PUSH_RECEIPT_INTERVAL seconds for
+# notifications sent at least PUSH_RECEIPT_DELAY seconds ago, Expo keeps them
+# for a day
+
+PUSH_RECEIPT_INTERVAL = 60 * 15
+
+PUSH_RECEIPT_DELAY = 60 * 15
+
+PUSH_RECEIPT_MAX_AGE = 60 * 60 * 24
+
+PUSH_RECEIPT_BATCH_SIZE = 1000